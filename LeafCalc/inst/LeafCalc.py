@@ -4,13 +4,9 @@ import argparse
 import sys
 import multiprocessing
 import os
-import tempfile
-import cv2
-import numpy as np
-import pandas as pd
-from exif import Image
-from pandas.core.frame import DataFrame
-from skimage import measure
+
+# OpenCV, numpy, pandas, exif and skimage are imported by the methods that use them, so that --help and example,
+# run by R in a fresh interpreter on every call, start at once
 
 
 class EstimateLeafArea:
@@ -18,9 +14,9 @@ class EstimateLeafArea:
 
     def __init__(self, red_scale: int = 0, red_scale_pixels: int = 0, mask_pixels: int = 0,
                  mask_scale: int = 0, mask_offset_y: int = 0, mask_offset_x: int = 0,
-                 threshold: int = 120, cut_off: int = 10000, output_dir: str = tempfile.TemporaryDirectory().name,
+                 threshold: int = 120, cut_off: int = 10000, output_dir: str = '',
                  crop: int = 0, combine: bool = True, res: int = 0,
-                 workers: int = multiprocessing.cpu_count() - 1):
+                 workers: int = max(1, multiprocessing.cpu_count() - 1)):
         """
         Initiate (default) variables.
         @param red_scale: whether or not to add a red scale
@@ -31,7 +27,7 @@ class EstimateLeafArea:
         @param mask_pixels: how many pixels each side of the masking window should be
         @param threshold: value for contrast analysis
         @param cut_off: patches below this number of pixels will not be counted
-        @param output_dir: where to save the images
+        @param output_dir: where to save the images; def: '' (do not save)
         @param crop: remove the edges of the image
         @param combine: combine all patches into a single LA estimate T/F
         @param res: specify resolution manually
@@ -51,7 +47,7 @@ class EstimateLeafArea:
         self.res = res
         self.workers = workers
 
-    def estimate(self, img: str) -> DataFrame:
+    def estimate(self, img: str) -> 'DataFrame':
         """
         Estimate leaf area for a given image or directory of images.
 
@@ -60,6 +56,11 @@ class EstimateLeafArea:
         @param img: path to the scan or images folder. respects tilde expansion
         @return pandas DF with the file name of the input and the estimated area(s)
         """
+        import cv2
+        import numpy as np
+        import pandas as pd
+        from exif import Image
+        from skimage import measure
 
         if os.path.isfile(img):
             # read the image resolution
@@ -142,6 +143,8 @@ class EstimateLeafArea:
         @param img: path to the image or folder of images to process
         @return None
         """
+        import cv2
+
         if os.path.isfile(img):
             if not self.output_dir:
                 output_dir = f'{os.path.split(img)[0]}/preprocessed'
@@ -249,13 +252,15 @@ estimate_parser.add_argument("-c", "--combine", action='store_true',
 estimate_parser.add_argument("--res", type=int, default=0,
                              help="image resolution, in dots per inch (DPI); if False the resolution will be "
                                   "read from the exif tag")
-estimate_parser.add_argument('--csv', type=str, help='name of output csv (to be saved in pwd)')
+estimate_parser.add_argument('--csv', type=str,
+                             help='name of output csv (to be saved in pwd), or - to write it to standard output '
+                                  'instead of the table')
 
 
 for p in [pre_processing_parser, estimate_parser]:
     p.add_argument("input", type=str, help="Path to image or folder with images. Respects tilde expansion.")
     p.add_argument("--output_dir", type=str, help="Where to save the output. Respects tilde expansion.")
-    p.add_argument("-w", "--workers", type=int, default=multiprocessing.cpu_count() - 1,
+    p.add_argument("-w", "--workers", type=int, default=max(1, multiprocessing.cpu_count() - 1),
                    help="How many cores to use? Default is to use all available minus one. "
                         "Only relevant when assessing a folder, ignored otherwise.")
     p.add_argument("-v", "--verbose", action='store_true', help="Enable verbose screen output.")
@@ -263,10 +268,9 @@ for p in [pre_processing_parser, estimate_parser]:
 
 where_parser = subparsers.add_parser('example', help='Print the directory where example images are saved.')
 
-args = parser.parse_args()
-
 
 if __name__ == '__main__':
+    args = parser.parse_args()
     estimator = EstimateLeafArea()
 
     if args.command == 'estimate':
@@ -275,7 +279,7 @@ if __name__ == '__main__':
             estimator.output_dir = output_dir
             if not os.path.exists(output_dir):
                 os.makedirs(output_dir)
-                print(f'directory {output_dir} created')
+                sys.stderr.write(f'directory {output_dir} created\n')
             else:
                 raise NameError("Output directory already exists. Output files may overwrite existing files. "
                                 "Please choose a different output directory.")
@@ -292,9 +296,13 @@ if __name__ == '__main__':
         estimator.threshold = args.threshold
 
         output = estimator.estimate(args.input)
-        print(output)
-        if args.csv:
-            output.to_csv(args.csv)
+        if args.csv == '-':
+            # for R: quoted, typed and never truncated, unlike the printed table
+            output.to_csv(sys.stdout, index=False)
+        else:
+            print(output)
+            if args.csv:
+                output.to_csv(args.csv)
 
     elif args.command == 'preprocess':
         output_dir = os.path.abspath(args.output_dir)
@@ -322,4 +330,4 @@ if __name__ == '__main__':
         estimator.preprocess(args.input)
 
     elif args.command == 'example':
-        print(static)
\ No newline at end of file
+        print(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extdata'))
\ No newline at end of file
@@ -5,7 +5,43 @@ import multiprocessing
 import os
 import sys
 
-from leafcalc import EstimateLeafArea, static
+# only light modules at startup, so that --help and example return at once: the package loads OpenCV, numpy and
+# pandas on first use of the names that need them, and the commands import those names
+from leafcalc import parse_size, static
+
+
+def threshold_type(value):
+    """Accept a gray level or the name of an automatic thresholding method."""
+    if value == 'otsu':
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is neither an integer nor otsu")
+
+
+def edit(estimator, args):
+    """Set up the preprocess edits: the scale and mask options give the size of the square in pixels."""
+    estimator.crop = args.crop
+    estimator.red_scale = bool(args.red_scale)
+    estimator.red_scale_pixels = args.red_scale
+    estimator.mask_scale = bool(args.mask_scale)
+    estimator.mask_pixels = args.mask_scale
+    estimator.mask_offset_x = args.mask_offset_x
+    estimator.mask_offset_y = args.mask_offset_y
+
+
+def measure(estimator, args):
+    """Set up the options that estimate and watch share: how each scan is measured."""
+    estimator.threshold = args.threshold
+    estimator.cut_off = args.cut_off
+    estimator.combine = args.combine
+    estimator.morphology = args.morphology
+    estimator.res = args.res
+    estimator.engine = args.engine
+    estimator.reduce = args.reduce
+    edit(estimator, args)
+    estimator.apply_preprocess = bool(args.crop or args.red_scale or args.mask_scale)
 
 
 class ErrorParser(argparse.ArgumentParser):
@@ -22,86 +58,406 @@ subparsers.required = True
 
 pre_processing_parser = subparsers.add_parser('preprocess',
                                               help='Pre-process images of leaves so that their areas can be assessed.')
-pre_processing_parser.add_argument("-c", "--crop", type=int, default=0,
-                                   help="Number of pixels to crop off the margins of the image? Cropping occurs before "
-                                        "the other operations, so that they are performed on the cropped image.")
-pre_processing_parser.add_argument("--red_scale", type=int, default=0,
-                                   help="How many pixels wide should the side of the scale should be?")
-pre_processing_parser.add_argument("--mask_scale", type=int, default=0,
-                                   help="How many pixels should each side of the masking window be?")
-pre_processing_parser.add_argument("--mask_offset_x", type=int, default=0,
-                                   help="Offset for positioning the masking window in number of pixels from right to "
-                                        "left of the image")
-pre_processing_parser.add_argument("--mask_offset_y", type=int, default=0,
-                                   help="Offset for positioning the masking window in number of pixels from top to "
-                                        "bottom of the image")
+estimate_parser = subparsers.add_parser('estimate', help='Assess images of leaves to determine their areas.')
+watch_parser = subparsers.add_parser('watch', help='Assess the images saved into a folder as they arrive, '
+                                                   'e.g. from a scanner, appending the results to a table.')
+for p in [estimate_parser, watch_parser]:
+    p.add_argument("-t", "--threshold", type=threshold_type, default=120,
+                   help="a value between 0 (black) and 255 (white) for classification of background "
+                        "and leaf pixels, or otsu to choose it from the histogram of each image. "
+                        "Default = 120")
+    p.add_argument("--cut_off", type=int, default=10000,
+                   help="Clusters with fewer pixels than this value will be discarded. Default is 10000",)
+    p.add_argument("-c", "--combine", action='store_true',
+                   help="If true the total area will be returned; otherwise each segment will "
+                        "be returned separately")
+    p.add_argument("--morphology", action='store_true',
+                   help="Add the label, bounding box, centroid, perimeter, length, width and hole area of "
+                        "each segment; the label matches --mask_format labels. Not with --combine")
+    p.add_argument("--res", type=int, default=0,
+                   help="image resolution, in dots per inch (DPI); if False the resolution will be "
+                        "read from the image header (EXIF, JFIF, TIFF or PNG)")
+    p.add_argument("--engine", type=str, default='opencv', choices=['opencv', 'skimage'],
+                   help="connected-component engine used to count leaf pixels. Default = opencv")
+    p.add_argument("--reduce", type=int, default=1, choices=[1, 2, 4, 8],
+                   help="decode the scans at 1/2, 1/4 or 1/8 of their size for a fast, approximate "
+                        "estimate. Default = 1 (full size)")
+estimate_parser.add_argument("--strip_height", type=int, default=0,
+                             help="threshold and label very large scans in strips of this many rows to bound memory "
+                                  "use. Default = 0 (whole scan at once)")
+estimate_parser.add_argument("--cache", type=str,
+                             default=os.path.join(os.environ.get('XDG_CACHE_HOME', '~/.cache'), 'leafcalc',
+                                                  'results.sqlite'),
+                             help="SQLite file where results are cached, so that unchanged images are not processed "
+                                  "again. Default = ~/.cache/leafcalc/results.sqlite")
+estimate_parser.add_argument("--cache_size", type=int, default=100000,
+                             help="How many images to keep in the cache before evicting the least recently used. "
+                                  "Default = 100000")
+estimate_parser.add_argument("--no-cache", dest='cache', action='store_const', const='',
+                             help="Process every image, neither reading nor updating the cache.")
+estimate_parser.add_argument("--threads", type=int, default=0,
+                             help="process a folder in one process with this many reader and compute threads, "
+                                  "overlapping disk access, decoding and encoding, instead of a pool of workers. "
+                                  "Default = 0 (use workers)")
+estimate_parser.add_argument("--memory", type=parse_size, default=0,
+                             help="memory the workers may use together for images, e.g. 16G. Scans are started "
+                                  "largest first as their estimated peak memory, from the dimensions in their header, "
+                                  "fits. Default = 0 (no limit)")
+estimate_parser.add_argument("--queue_size", type=int, default=8,
+                             help="capacity of the queues between the stages of --threads. Default = 8")
+estimate_parser.add_argument("--mask_format", type=str, default='same',
+                             choices=['same', 'png', 'tiff', 'rle', 'labels'],
+                             help="how to save the classified images in --output_dir: same (format of the input), "
+                                  "1-bit png, 1-bit G4-compressed tiff (requires Pillow), rle (run lengths in .npz) or "
+                                  "labels (16-bit tiff numbering the patches as in the output). Default = same")
+estimate_parser.add_argument("--mask_thumbnail", type=int, default=1,
+                             help="save the classified images at 1/N of their size for quality checks. "
+                                  "Default = 1 (full size)")
+estimate_parser.add_argument("--profile", action='store_true',
+                             help="Time the stages of each image (metadata, decode, threshold, label, count, write), "
+                                  "record its peak memory and print a breakdown at the end of the batch.")
+estimate_parser.add_argument("--trace", type=str, default='',
+                             help="JSON-lines file to append the timings of each image to; implies --profile.")
+estimate_parser.add_argument('--csv', type=str,
+                             help='name of output csv (to be saved in pwd), or - for standard output; rows are '
+                                  'appended as each image is done')
+estimate_parser.add_argument('--parquet', type=str,
+                             help='name of output Parquet file (to be saved in pwd); requires pyarrow')
+estimate_parser.add_argument('--jsonl', type=str,
+                             help='name of output JSON-lines file, one object per row, or - for standard output')
+estimate_parser.add_argument('--arrow', type=str,
+                             help='name of output Arrow IPC stream, or - for standard output; requires pyarrow')
+estimate_parser.add_argument('--resume', action='store_true',
+                             help='append to the --csv or --jsonl file, which records the images that are done, and '
+                                  'skip the images with results in it, so that an interrupted run goes on where it '
+                                  'stopped. Images with an error are tried again. Give the same inputs as before')
+estimate_parser.add_argument('--batch', type=str,
+                             help='CSV (.csv) or JSON-lines file of requests, - to read JSON lines from standard '
+                                  'input. Each has an input and any EstimateLeafArea settings (e.g. threshold, '
+                                  'cut_off, res, combine) that override the options for it. Results get a request '
+                                  'column')
 
+sweep_parser = subparsers.add_parser('sweep', help='Assess leaf areas over a range of thresholds, decoding each image '
+                                                   'once, to help choose a threshold.')
+sweep_parser.add_argument("-t", "--thresholds", type=int, nargs='+', default=list(range(60, 200, 10)),
+                          help="values between 0 (black) and 255 (white) to try. Default = 60 70 ... 190")
+sweep_parser.add_argument("--cut_off", type=int, default=10000,
+                          help="Clusters with fewer pixels than this value will be discarded. Default is 10000",)
+sweep_parser.add_argument("-c", "--combine", action='store_true',
+                          help="If true one row of total areas per image will be returned; otherwise each segment "
+                               "will be returned separately for each threshold")
+sweep_parser.add_argument("--res", type=int, default=0,
+                          help="image resolution, in dots per inch (DPI); if False the resolution will be "
+                               "read from the image header (EXIF, JFIF, TIFF or PNG)")
+sweep_parser.add_argument("--reduce", type=int, default=1, choices=[1, 2, 4, 8],
+                          help="decode the scans at 1/2, 1/4 or 1/8 of their size. Default = 1 (full size)")
+sweep_parser.add_argument('--csv', type=str, help='name of output csv (to be saved in pwd)')
 
-estimate_parser = subparsers.add_parser('estimate', help='Assess images of leaves to determine their areas.')
-estimate_parser.add_argument("-t", "--threshold", type=int, default=120,
-                             help="a value between 0 (black) and 255 (white) for classification of background "
-                                  "and leaf pixels. Default = 120")
-estimate_parser.add_argument("--cut_off", type=int, default=10000,
-                             help="Clusters with fewer pixels than this value will be discarded. Default is 10000",)
-estimate_parser.add_argument("-c", "--combine", action='store_true',
-                             help="If true the total area will be returned; otherwise each segment will "
-                                  "be returned separately")
-estimate_parser.add_argument("--res", type=int, default=0,
-                             help="image resolution, in dots per inch (DPI); if False the resolution will be "
-                                  "read from the exif tag")
-estimate_parser.add_argument('--csv', type=str, help='name of output csv (to be saved in pwd)')
-
-
-for p in [pre_processing_parser, estimate_parser]:
+
+# the preprocess edits; estimate applies them to the decoded scans in memory
+for p, crop in [(pre_processing_parser, ["-c", "--crop"]), (estimate_parser, ["--crop"]), (watch_parser, ["--crop"])]:
+    p.add_argument(*crop, type=int, default=0,
+                   help="Number of pixels to crop off the margins of the image? Cropping occurs before "
+                        "the other operations, so that they are performed on the cropped image.")
+    p.add_argument("--red_scale", type=int, default=0,
+                   help="How many pixels wide should the side of the scale should be?")
+    p.add_argument("--mask_scale", type=int, default=0,
+                   help="How many pixels should each side of the masking window be?")
+    p.add_argument("--mask_offset_x", type=int, default=0,
+                   help="Offset for positioning the masking window in number of pixels from right to "
+                        "left of the image")
+    p.add_argument("--mask_offset_y", type=int, default=0,
+                   help="Offset for positioning the masking window in number of pixels from top to "
+                        "bottom of the image")
+estimate_parser.add_argument("--preprocess_dir", type=str, default='',
+                             help="Where to save a grayscale jpg of each scan after --crop, --red_scale and "
+                                  "--mask_scale. Default is not to save them.")
+
+
+for p in [pre_processing_parser, estimate_parser, watch_parser]:
+    p.add_argument("--output_dir", type=str,
+                   help="Where to save the output. Respects tilde expansion. With zip or tar archives as input, it "
+                        "may be a zip archive (ending in .zip) to save into.")
+
+manifest_parser = subparsers.add_parser('manifest', help='List the images in a folder with their size, modification '
+                                                         'time, dimensions and dpi, for --manifest.')
+
+estimate_parser.add_argument("input", type=str, nargs='*',
+                             help="Paths to images, folders with images, or zip or tar archives of images, which are "
+                                  "read without extracting them. Respects tilde expansion.")
+for p in [sweep_parser, manifest_parser]:
     p.add_argument("input", type=str, help="Path to image or folder with images. Respects tilde expansion.")
-    p.add_argument("--output_dir", type=str, help="Where to save the output. Respects tilde expansion.")
-    p.add_argument("-w", "--workers", type=int, default=multiprocessing.cpu_count() - 1,
-                   help="How many cores to use? Default is to use all available minus one. "
+pre_processing_parser.add_argument("input", type=str,
+                                   help="Path to image, folder with images, or zip or tar archive of images, which is "
+                                        "read without extracting it. Respects tilde expansion.")
+watch_parser.add_argument("input", type=str, help="Folder that the scans are saved into. Respects tilde expansion.")
+for p in [pre_processing_parser, estimate_parser, sweep_parser, manifest_parser, watch_parser]:
+    p.add_argument("-r", "--recursive", action='store_true', help="Also process images in subfolders.")
+    p.add_argument("--pattern", type=str, default='',
+                   help="Only process images whose path relative to the folder matches this shell-style pattern, "
+                        "e.g. 'plot*/*.jpg'. Hidden files and files without an image extension are always skipped.")
+    p.add_argument("--follow_symlinks", action='store_true', help="Descend into symbolically linked subfolders.")
+
+manifest_parser.add_argument("output", type=str, help="CSV file to write.")
+manifest_parser.add_argument("--by_resolution", action='store_true',
+                             help="Group the images by the dpi in their headers, in a column 'group' (e.g. 300, or "
+                                  "unknown), to select with --group instead of sorting them into folders.")
+manifest_parser.add_argument("--group_size", type=int, default=0,
+                             help="With --by_resolution, split each resolution into numbered groups of at most this "
+                                  "many images, e.g. 300/1, 300/2. Default is one group per resolution.")
+manifest_parser.add_argument("--link", type=str,
+                             help="With --by_resolution, also make a folder per group in this directory, holding hard "
+                                  "links (symbolic links across filesystems) to the images rather than copies.")
+manifest_parser.add_argument("-w", "--workers", type=int, default=8,
+                             help="How many headers to read at a time. Default = 8")
+
+watch_parser.add_argument("--output", type=str, required=True,
+                          help="CSV, or JSON-lines if it ends in .jsonl, file to append the results to. Scans that "
+                               "already have results in it are skipped, so a restarted watch does not repeat them.")
+watch_parser.add_argument("--settle", type=float, default=2.0,
+                          help="seconds that a file must stay unchanged before it is read, so that scans still being "
+                               "written are not. Default = 2")
+watch_parser.add_argument("--interval", type=float, default=1.0,
+                          help="seconds between checks for new and settled files. Default = 1")
+watch_parser.add_argument("--poll", action='store_true',
+                          help="list the folder every --interval instead of using inotify, e.g. on a network share "
+                               "written by other machines. Always so with --recursive or off Linux")
+
+for p in [pre_processing_parser, estimate_parser, sweep_parser]:
+    p.add_argument("--manifest", type=str, default='',
+                   help="CSV file listing the images of the folder (see the manifest command). It is read instead of "
+                        "walking the folder if it exists, and written otherwise.")
+    p.add_argument("--group", type=str, default='',
+                   help="Only process the images of a folder in this group of the --manifest, e.g. 300 (see the "
+                        "manifest command with --by_resolution).")
+    p.add_argument("--shard", type=str, default='',
+                   help="Only process shard i of N of the images of a folder, given as i/N with i from 0, e.g. "
+                        "$SLURM_ARRAY_TASK_ID/10 in an array job run with --array=0-9.")
+    p.add_argument("--shard_by", type=str, default='sorted', choices=['sorted', 'hash'],
+                   help="how images are dealt out to shards: sorted deals the sorted file list out in turn, hash "
+                        "places each image by its path so that images added later do not move others. "
+                        "Default = sorted")
+for p in [pre_processing_parser, estimate_parser, sweep_parser, watch_parser]:
+    p.add_argument("-w", "--workers", type=int, default=max(1, multiprocessing.cpu_count() - 1),
+                   help="How many cores to use? Default is to use all available minus one, and at least one. "
                         "Only relevant when assessing a folder, ignored otherwise.")
+    p.add_argument("--start_method", type=str, choices=['fork', 'forkserver', 'spawn'],
+                   help="How worker processes are started. Default is the platform default.")
     p.add_argument("-v", "--verbose", action='store_true', help="Enable verbose screen output.")
 
 
-where_parser = subparsers.add_parser('example', help='Print the directory where example images are saved.')
+benchmark_parser = subparsers.add_parser('benchmark', help='Time estimate on synthetic scans with a known leaf area, '
+                                                           'in single-image and folder modes, and check its accuracy.')
+benchmark_parser.add_argument("--dpis", type=int, nargs='+', default=[150, 300, 600, 1200],
+                              help="resolutions of the synthetic scans. Default = 150 300 600 1200")
+benchmark_parser.add_argument("-w", "--workers", type=int, nargs='+', default=[1, 2, 4],
+                              help="worker counts to time the folder mode with. Default = 1 2 4")
+benchmark_parser.add_argument("--images", type=int, default=8, help="scans per resolution. Default = 8")
+benchmark_parser.add_argument("--repeats", type=int, default=3,
+                              help="runs of each case; the fastest counts. Default = 3")
+benchmark_parser.add_argument("--leaves", type=int, default=6, help="leaves per scan. Default = 6")
+benchmark_parser.add_argument("--specks", type=float, default=20,
+                              help="dark specks per square inch. Default = 20")
+benchmark_parser.add_argument("--noise", type=float, default=4,
+                              help="standard deviation of the gray noise. Default = 4")
+benchmark_parser.add_argument("--size", type=float, nargs=2, default=[8.27, 11.69], metavar=('WIDTH', 'HEIGHT'),
+                              help="width and height of the scans in inches. Default = 8.27 11.69 (A4)")
+benchmark_parser.add_argument("--keep", type=str, default=None,
+                              help="folder to keep the synthetic scans in. Default is a temporary folder")
+benchmark_parser.add_argument('--csv', type=str, help='name of output csv (to be saved in pwd)')
+benchmark_parser.add_argument('--baseline', type=str,
+                              help='csv of an earlier benchmark; exit with status 1 if a case got slower, larger or '
+                                   'less accurate by more than --tolerance or --accuracy_tolerance')
+benchmark_parser.add_argument("--startup", action='store_true',
+                              help="time how long --help and example take from the start of a fresh interpreter, as "
+                                   "paid by every call from R, instead of estimate")
+benchmark_parser.add_argument("--startup_limit", type=float, default=1.0,
+                              help="with --startup, exit with status 1 if a command takes longer than this many "
+                                   "seconds. Default = 1.0")
+benchmark_parser.add_argument("--tolerance", type=float, default=0.1,
+                              help="allowed relative loss of throughput and gain of peak memory. Default = 0.1")
+benchmark_parser.add_argument("--accuracy_tolerance", type=float, default=0.005,
+                              help="allowed absolute gain of the mean relative error. Default = 0.005")
+
+serve_parser = subparsers.add_parser('serve', help='Keep the engine and its workers warm and answer estimate and '
+                                                   'preprocess requests over local HTTP, e.g. from R.')
+serve_parser.add_argument("--host", type=str, default='127.0.0.1',
+                          help="address to listen on. Default = 127.0.0.1 (this machine only)")
+serve_parser.add_argument("--port", type=int, default=8765, help="TCP port to listen on; 0 picks a free one. "
+                                                                 "Default = 8765")
+serve_parser.add_argument("--socket", type=str, default='',
+                          help="path of a Unix socket to listen on instead of a TCP port")
+serve_parser.add_argument("-w", "--workers", type=int, default=max(1, multiprocessing.cpu_count() - 1),
+                          help="How many cores to use? Default is to use all available minus one, and at least one.")
+serve_parser.add_argument("--start_method", type=str, choices=['fork', 'forkserver', 'spawn'],
+                          help="How worker processes are started. Default is the platform default.")
+serve_parser.add_argument("--concurrency", type=int, default=0,
+                          help="requests processed at once. Default = 0 (as many as workers)")
+serve_parser.add_argument("--backlog", type=int, default=64,
+                          help="requests that may wait for a free slot; further ones are refused with 503 until "
+                               "one finishes. Default = 64")
+serve_parser.add_argument("--cache", type=str, default='',
+                          help="SQLite file where results are cached between requests. Default is not to cache")
+serve_parser.add_argument("--cache_size", type=int, default=100000,
+                          help="How many images to keep in the cache before evicting the least recently used. "
+                               "Default = 100000")
+serve_parser.add_argument("-v", "--verbose", action='store_true', help="Log each request.")
 
-args = parser.parse_args()
+merge_parser = subparsers.add_parser('merge', help='Combine the results of several runs, e.g. the shards of an array '
+                                                   'job, into one table.')
+merge_parser.add_argument("output", type=str,
+                          help="file to write: CSV, or JSON lines, Parquet or Arrow IPC if it ends in .jsonl, "
+                               ".parquet or .arrow")
+merge_parser.add_argument("inputs", type=str, nargs='+',
+                          help="results files to combine, in any of those formats. An image in several of them "
+                               "keeps the rows of the first.")
+
+where_parser = subparsers.add_parser('example', help='Print the directory where example images are saved.')
 
 
 if __name__ == '__main__':
-    estimator = EstimateLeafArea()
+    args = parser.parse_args()
+    if args.command in ('preprocess', 'estimate', 'sweep'):
+        from leafcalc import ARCHIVE_EXTENSIONS, EstimateLeafArea, parse_shard
+        estimator = EstimateLeafArea()
+        estimator.start_method = args.start_method
+        estimator.recursive = args.recursive
+        estimator.pattern = args.pattern
+        estimator.follow_symlinks = args.follow_symlinks
+        estimator.manifest = args.manifest
+        estimator.group = args.group
+        estimator.shard = args.shard
+        estimator.shard_by = args.shard_by
+        if args.shard:
+            try:
+                parse_shard(args.shard)
+            except ValueError as error:
+                parser.error(str(error))
 
     if args.command == 'estimate':
+        if not args.input and not args.batch:
+            parser.error('give an input or --batch')
+        if args.resume:
+            if args.parquet or args.arrow:
+                parser.error('--resume cannot append to --parquet or --arrow files')
+            checkpoints = [path for path in (args.csv, args.jsonl) if path and path != '-']
+            if not checkpoints:
+                parser.error('--resume needs a --csv or --jsonl file to append to')
+            estimator.checkpoint = checkpoints[0]
         if args.output_dir:
             output_dir = os.path.abspath(args.output_dir)
             estimator.output_dir = output_dir
-            if not os.path.exists(output_dir):
+            # the masks of an archive are saved under its name
+            archives = [os.path.basename(source) for source in args.input
+                        if source.lower().endswith(ARCHIVE_EXTENSIONS)]
+            if len(set(archives)) < len(archives):
+                parser.error('archives with the same name would save their masks under the same name; rename one')
+            if output_dir.lower().endswith('.zip'):
+                # made when the first mask is saved; only the workers of an archive hand their masks back
+                if not all(source.lower().endswith(ARCHIVE_EXTENSIONS) for source in args.input) or args.batch:
+                    parser.error('masks can only be saved into a zip archive when every input is an archive')
+                if os.path.exists(output_dir) and not args.resume:
+                    raise NameError("Output archive already exists. Please choose a different output archive.")
+            elif not os.path.exists(output_dir):
                 os.makedirs(output_dir)
-                print(f'directory {output_dir} created')
-            else:
+                sys.stderr.write(f'directory {output_dir} created\n')
+            elif not args.resume:
                 raise NameError("Output directory already exists. Output files may overwrite existing files. "
                                 "Please choose a different output directory.")
 
-            if os.path.split(os.path.abspath(args.input))[0] == output_dir:
+            if any(os.path.split(os.path.abspath(source))[0] == output_dir for source in args.input):
                 raise NameError(
                     'You have provided identical paths for the source and destination directories. '
                     'This would cause your files to be overwritten. Execution has been halted. ')
 
+        measure(estimator, args)
+        estimator.workers = args.workers
+        estimator.strip_height = args.strip_height
+        estimator.cache = args.cache
+        estimator.cache_size = args.cache_size
+        estimator.threads = args.threads
+        estimator.queue_size = args.queue_size
+        estimator.memory_budget = args.memory
+        estimator.profile = args.profile or bool(args.trace)
+        estimator.trace = args.trace
+        estimator.mask_format = args.mask_format
+        estimator.mask_thumbnail = args.mask_thumbnail
+        estimator.preprocess_dir = args.preprocess_dir
+        if args.preprocess_dir:
+            os.makedirs(args.preprocess_dir, exist_ok=True)
+
+        import pandas as pd
+        from leafcalc import ResultWriter, iter_requests, profile_summary, read_requests, request_columns
+
+        # every input is a request with the options as settings; a batch adds requests with their own settings
+        requests = [{'input': source} for source in args.input]
+        if args.batch:
+            requests += read_requests(args.batch)
+        numbered = len(requests) > 1 or bool(args.batch)
+        columns = request_columns(estimator, requests) if numbered else estimator.columns()
+        machine = '-' in (args.csv, args.jsonl, args.arrow)
+
+        # stream the results to disk as each image is done, sharing one pool of workers between the requests
+        with ResultWriter(columns, csv=args.csv, parquet=args.parquet, jsonl=args.jsonl, arrow=args.arrow,
+                          append=args.resume) as writer:
+            frames = []
+            if numbered:
+                if not estimator.threads and estimator.workers >= 1:
+                    estimator.open()
+                results = iter_requests(estimator, requests)
+            else:
+                results = estimator.iter_estimate(requests[0]['input'])
+            try:
+                for frame in results:
+                    writer.write(frame)
+                    frames.append(frame)
+            finally:
+                estimator.close()
+
+        if not frames:
+            # nothing left after --resume, or an empty --shard, is not a failure
+            sys.stderr.write('no images left to process\n')
+            sys.exit(0 if args.resume or args.shard else 1)
+        output = pd.concat(frames)
+        if 'error' in output:
+            for filename, error in output.loc[output['error'].notna(), ['filename', 'error']].values:
+                sys.stderr.write(f'{filename}: {error}\n')
+        if not machine:
+            print(output.drop(columns='error', errors='ignore'))
+        if args.cache:
+            sys.stderr.write(f'cache: {estimator.cache_hits} hits, {estimator.cache_misses} misses\n')
+        if args.verbose and estimator.queue_peaks:
+            sys.stderr.write('peak queue depths: ' +
+                             ', '.join(f'{stage} {depth}' for stage, depth in estimator.queue_peaks.items()) + '\n')
+        if estimator.profile and 'time_decode' in output:
+            summary = profile_summary(output.dropna(subset=['time_decode']))
+            sys.stderr.write(f"profile of {summary.attrs['images']} images:\n{summary.round(4)}\n")
+            if pd.notna(summary.attrs['peak_rss']):
+                sys.stderr.write(f"largest peak memory: {summary.attrs['peak_rss'] / 2 ** 20:.0f} MiB\n")
+        if 'error' in output and output['error'].notna().all():
+            sys.exit(1)
+
+    elif args.command == 'sweep':
         estimator.res = args.res
         estimator.workers = args.workers
         estimator.combine = args.combine
         estimator.cut_off = args.cut_off
-        estimator.threshold = args.threshold
+        estimator.reduce = args.reduce
 
-        output = estimator.estimate(args.input)
+        output = estimator.sweep(args.input, args.thresholds)
         print(output)
         if args.csv:
             output.to_csv(args.csv)
 
     elif args.command == 'preprocess':
         output_dir = os.path.abspath(args.output_dir)
+        if output_dir.lower().endswith('.zip') and not args.input.lower().endswith(ARCHIVE_EXTENSIONS):
+            parser.error('images can only be saved into a zip archive when the input is an archive')
         if not os.path.exists(output_dir):
             estimator.output_dir = output_dir
-            os.makedirs(output_dir)
-            print(f'directory {output_dir} created')
+            if not output_dir.lower().endswith('.zip'):
+                os.makedirs(output_dir)
+                print(f'directory {output_dir} created')
         else:
             raise NameError(
                 "Output directory already exists. Output files may overwrite existing files. "
@@ -112,14 +468,100 @@ if __name__ == '__main__':
                 'You have provided identical paths for the source and destination directories. '
                 'This would cause your files to be overwritten. Execution has been halted. ')
 
-        estimator.crop = args.crop
-        estimator.red_scale = args.red_scale
-        estimator.mask_scale = args.mask_scale
-        estimator.mask_offset_x = args.mask_offset_x
-        estimator.mask_offset_y = args.mask_offset_y
+        edit(estimator, args)
         estimator.workers = args.workers
 
         estimator.preprocess(args.input)
 
+    elif args.command == 'watch':
+        import signal
+        import threading
+        from leafcalc import EstimateLeafArea, watch
+        estimator = EstimateLeafArea()
+        estimator.start_method = args.start_method
+        estimator.recursive = args.recursive
+        estimator.pattern = args.pattern
+        estimator.follow_symlinks = args.follow_symlinks
+        estimator.workers = args.workers
+        measure(estimator, args)
+        if args.output_dir:
+            # kept across restarts, unlike for estimate
+            estimator.output_dir = os.path.abspath(args.output_dir)
+            os.makedirs(estimator.output_dir, exist_ok=True)
+
+        def report(frame):
+            if args.verbose:
+                for filename, area, error in frame.reindex(columns=['filename', 'Area', 'error']).values:
+                    sys.stderr.write(f'{filename}: {error}\n' if isinstance(error, str) else f'{filename}: {area}\n')
+
+        # finish the scans in hand and stop on Ctrl-C or kill; set before the workers start, who inherit it
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+        sys.stderr.write(f'watching {os.path.abspath(os.path.expanduser(args.input))}; results in {args.output}\n')
+        count = watch(estimator, args.input, args.output, settle=args.settle, interval=args.interval, poll=args.poll,
+                      stop=stop, on_results=report)
+        sys.stderr.write(f'{count} scans processed\n')
+
+    elif args.command == 'merge':
+        from leafcalc import ResultWriter, merge_results
+        output = merge_results(args.inputs)
+        kind = {'.jsonl': 'jsonl', '.parquet': 'parquet', '.arrow': 'arrow'}.get(
+            os.path.splitext(args.output)[1].lower(), 'csv')
+        with ResultWriter(list(output.columns), **{kind: args.output}) as writer:
+            writer.write(output)
+        print(f"{output['filename'].nunique()} images ({len(output)} rows) from {len(args.inputs)} files merged "
+              f"into {args.output}")
+
+    elif args.command == 'manifest':
+        from leafcalc import build_manifest, group_by_resolution, link_groups, write_manifest
+        if (args.group_size or args.link) and not args.by_resolution:
+            parser.error('--group_size and --link need --by_resolution')
+        manifest = build_manifest(args.input, workers=args.workers, recursive=args.recursive, pattern=args.pattern,
+                                  follow_symlinks=args.follow_symlinks)
+        if args.by_resolution:
+            manifest = group_by_resolution(manifest, args.group_size)
+            if args.link:
+                manifest = link_groups(manifest, args.link)
+        write_manifest(manifest, args.output)
+        print(f'{len(manifest)} images listed in {args.output}')
+        if args.by_resolution:
+            for group, count in manifest['group'].value_counts(sort=False).sort_index().items():
+                print(f'  {group}: {count}')
+
+    elif args.command == 'benchmark' and args.startup:
+        from leafcalc import startup_time
+        output = startup_time(os.path.abspath(__file__))
+        print(output.round(3).to_string(index=False))
+        if (output['seconds'] > args.startup_limit).any():
+            sys.exit(1)
+
+    elif args.command == 'benchmark':
+        import pandas as pd
+        from leafcalc import regressions, run_benchmark
+        output = run_benchmark(dpis=args.dpis, workers=args.workers, images=args.images, repeats=args.repeats,
+                               folder=args.keep, leaves=args.leaves, specks=args.specks, noise=args.noise,
+                               size=tuple(args.size))
+        print(output.round(4).to_string(index=False))
+        if args.csv:
+            output.to_csv(args.csv, index=False)
+        if args.baseline:
+            worse = regressions(output, pd.read_csv(args.baseline), tolerance=args.tolerance,
+                                accuracy_tolerance=args.accuracy_tolerance)
+            if len(worse):
+                sys.stderr.write(f'regressions against {args.baseline}:\n{worse.round(4).to_string(index=False)}\n')
+                sys.exit(1)
+
+    elif args.command == 'serve':
+        from leafcalc import EstimateLeafArea, serve
+        estimator = EstimateLeafArea(workers=args.workers, start_method=args.start_method, cache=args.cache,
+                                     cache_size=args.cache_size)
+        try:
+            serve(estimator, host=args.host, port=args.port, unix_socket=args.socket, concurrency=args.concurrency,
+                  backlog=args.backlog, verbose=args.verbose,
+                  ready=lambda address: print(f'serving on {address}', flush=True))
+        except KeyboardInterrupt:
+            pass
+
     elif args.command == 'example':
         print(static)
\ No newline at end of file
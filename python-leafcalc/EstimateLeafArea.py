@@ -5,16 +5,48 @@ A class to process images for leaf area.
 Boris Bongalov, Tim C.E Paine, Sabine Both
 """
 
+import contextlib
+import copy
+import functools
+import inspect
+import io
 import multiprocessing
 import os
-import tempfile
+import posixpath
+import sys
+from typing import Callable, Iterator, Optional, Sequence, Tuple, Union
 
 import cv2
 import numpy as np
 import pandas as pd
-from exif import Image
+from numpy import ndarray
 from pandas.core.frame import DataFrame
-from skimage import measure
+
+from .archives import ArchiveWriter, is_archive, iter_members
+from .cache import ResultCache
+from .discovery import list_images, shard_images
+from .engines import AREA_ENGINES, AUTO_THRESHOLDS, opencv_labels, strip_areas, sweep_areas
+from .masks import encode_mask, mask_path, relative_name, write_mask
+from .metadata import read_resolution
+from .morphology import AREA_COLUMNS, LENGTH_COLUMNS, MORPHOLOGY_COLUMNS, patch_morphology
+from .pipeline import Pipeline
+from .profiling import PROFILE_COLUMNS, new_profile, peak_rss, reset_peak_rss, timed, trace_line
+from .scheduler import image_memory, run_streamed, run_within_budget
+from .writers import processed_files
+
+# imread flags that decode straight to grayscale, optionally with the JPEG decoder's DCT-domain downscaling
+READ_FLAGS = {1: cv2.IMREAD_GRAYSCALE,
+              2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+              4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+              8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+# luma of the red scale, (0, 0, 255) in BGR, as drawn into scans decoded to grayscale
+RED_GRAY = 76
+
+# constructor arguments about running the pool rather than processing an image; they are not sent to workers
+_POOL_ARGUMENTS = ('workers', 'cache', 'cache_size', 'start_method', 'threads', 'queue_size', 'memory_budget',
+                   'recursive', 'pattern', 'follow_symlinks', 'manifest', 'group', 'shard', 'shard_by', 'checkpoint',
+                   'trace')
 
 
 class EstimateLeafArea:
@@ -22,9 +54,17 @@ class EstimateLeafArea:
 
     def __init__(self, red_scale: int = 0, red_scale_pixels: int = 0, mask_pixels: int = 0,
                  mask_scale: int = 0, mask_offset_y: int = 0, mask_offset_x: int = 0,
-                 threshold: int = 120, cut_off: int = 10000, output_dir: str = tempfile.TemporaryDirectory().name,
+                 threshold: Union[int, str] = 120, cut_off: int = 10000, output_dir: str = '',
                  crop: int = 0, combine: bool = True, res: int = 0,
-                 workers: int = multiprocessing.cpu_count() - 1):
+                 workers: int = max(1, multiprocessing.cpu_count() - 1), engine: str = 'opencv',
+                 reduce: int = 1, strip_height: int = 0, cache: str = '', cache_size: int = 100000,
+                 start_method: Optional[str] = None, threads: int = 0, queue_size: int = 8,
+                 mask_format: str = 'same', mask_thumbnail: int = 1, morphology: bool = False,
+                 apply_preprocess: bool = False, preprocess_dir: str = '', memory_budget: int = 0,
+                 recursive: bool = False, pattern: str = '', follow_symlinks: bool = False, input_root: str = '',
+                 manifest: str = '',
+                 group: str = '', shard: str = '', shard_by: str = 'sorted', checkpoint: str = '',
+                 profile: bool = False, trace: str = ''):
         """
         Initiate (default) variables.
         @param red_scale: whether or not to add a red scale
@@ -33,13 +73,49 @@ class EstimateLeafArea:
         @param mask_offset_x: offset for the masking window in number of pixels from top to bottom of the image
         @param mask_offset_y: offset for the masking window in number of pixels from right to left of the image
         @param mask_pixels: how many pixels each side of the masking window should be
-        @param threshold: value for contrast analysis
+        @param threshold: value for contrast analysis, or one of AUTO_THRESHOLDS to choose it for each image
         @param cut_off: patches below this number of pixels will not be counted
-        @param output_dir: where to save the images
+        @param output_dir: where to save the images; def: '' (do not save)
         @param crop: remove the edges of the image
         @param combine: combine all patches into a single LA estimate T/F
         @param res: specify resolution manually
-        @param workers: how many cores to use for multiprocessing; def: all but one
+        @param workers: how many cores to use for multiprocessing; def: all but one, at least one
+        @param engine: connected-component engine used to count patch pixels, one of AREA_ENGINES; def: opencv
+        @param reduce: estimate from a scan decoded at 1/2, 1/4 or 1/8 of its size for fast triage; def: 1 (full size)
+        @param strip_height: threshold and label the scan in strips of this many rows to bound memory; def: 0 (whole scan)
+        @param cache: path to an SQLite file caching results between runs; def: '' (no cache)
+        @param cache_size: how many images the cache keeps before evicting the least recently used
+        @param start_method: how worker processes are started: fork, forkserver or spawn; def: the platform default
+        @param threads: process folders in this process with a pipeline of this many reader and compute threads
+            (and half as many writer threads) instead of a pool of workers; def: 0 (use workers)
+        @param queue_size: capacity of the queues between pipeline stages
+        @param mask_format: how to save classified images, one of MASK_EXTENSIONS; def: same (format of the input name)
+        @param mask_thumbnail: save classified images at 1/mask_thumbnail of their size; def: 1 (full size)
+        @param morphology: add the shape of each patch (see morphology.patch_morphology) to per-patch output
+        @param apply_preprocess: crop, mask and add the red scale as preprocess() does, to the decoded scan in memory
+            before estimating, rather than to a re-encoded copy on disk
+        @param preprocess_dir: where to save a grayscale JPEG of each scan after apply_preprocess; def: '' (do not save)
+        @param memory_budget: bytes that the workers may use together for image buffers when processing a folder; scans
+            are started largest first as their estimated peak memory fits (see scheduler); def: 0 (no limit)
+        @param recursive: also process the images in subfolders of a folder
+        @param pattern: only process the images of a folder whose relative path matches this shell-style pattern
+        @param follow_symlinks: descend into symbolically linked subfolders
+        @param input_root: folder whose layout the masks in output_dir and the copies in preprocess_dir mirror, so that
+            scans of the same name in different subfolders do not overwrite each other; set to the folder given to
+            estimate() or preprocess(); def: '' (save by file name)
+        @param manifest: CSV file listing the images of a folder with their size, dimensions and dpi; it is read
+            instead of walking the folder if it exists, and written otherwise; def: '' (walk the folder every time)
+        @param group: only process the images of a folder in this group of the manifest, e.g. a resolution (see
+            discovery.group_by_resolution); def: '' (all)
+        @param shard: only process shard i of N of the images of a folder, given as 'i/N' with i from 0, e.g. in a task
+            of a cluster array job; def: '' (all)
+        @param shard_by: how images are dealt out to shards, 'sorted' or 'hash' (see discovery.shard_images)
+        @param checkpoint: CSV or JSON-lines file of the results of an earlier, interrupted run; the images with
+            results in it, other than errors, are skipped, so appending to it resumes the run; def: '' (process every
+            image)
+        @param profile: add the seconds spent in each stage and the peak memory of each image (see profiling) to the
+            output; peak memory is not measured with threads
+        @param trace: JSON-lines file to append the profile of each processed image to; def: '' (none)
         """
         self.red_scale = red_scale
         self.red_scale_pixels = red_scale_pixels
@@ -54,99 +130,919 @@ class EstimateLeafArea:
         self.combine = combine
         self.res = res
         self.workers = workers
+        self.engine = engine
+        self.reduce = reduce
+        self.strip_height = strip_height
+        self.cache = cache
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.start_method = start_method
+        self.threads = threads
+        self.queue_size = queue_size
+        self.queue_peaks = {}
+        self.mask_format = mask_format
+        self.mask_thumbnail = mask_thumbnail
+        self.morphology = morphology
+        self.apply_preprocess = apply_preprocess
+        self.preprocess_dir = preprocess_dir
+        self.memory_budget = memory_budget
+        self.recursive = recursive
+        self.pattern = pattern
+        self.follow_symlinks = follow_symlinks
+        self.input_root = input_root
+        self.manifest = manifest
+        self.group = group
+        self.shard = shard
+        self.shard_by = shard_by
+        self.checkpoint = checkpoint
+        self.profile = profile
+        self.trace = trace
+        self._pool = None
 
-    def estimate(self, img: str) -> DataFrame:
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
         """
-        Estimate leaf area for a given image or directory of images.
+        Start a pool of workers that is kept warm for all calls until close().
 
-        TO DO: filter images only in the folder - ask the user for extension?
+        Within a with block, repeated calls on small folders only pay for the image work, not for starting processes
+        and importing OpenCV and pandas in each of them. Settings can still be changed between calls.
+        """
+        if self._pool is None:
+            context = multiprocessing.get_context(self.start_method)
+            if context.get_start_method() == 'forkserver':
+                # import the heavy modules once in the server rather than in every worker
+                context.set_forkserver_preload([__name__])
+            _share_resource_tracker()
+            self._pool = context.Pool(self.workers)
 
-        @param img: path to the scan or images folder. respects tilde expansion
-        @return pandas DF with the file name of the input and the estimated area(s)
+    def close(self):
+        """Stop the pool started by open()."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    @contextlib.contextmanager
+    def _workers(self):
         """
+        Provide the warm pool if one is open, otherwise a pool for the duration of a single call.
 
-        if os.path.isfile(img):
-            # read the image resolution
-            if not self.res:
-                with open(os.path.expanduser(img), 'rb') as image_meta:
-                    metadata = Image(image_meta)
-                if not metadata.has_exif:
-                    raise ValueError("Image of unknown resolution. Please specify the res argument in dpi.")
-                if not metadata.x_resolution == metadata.y_resolution:
-                    raise ValueError(
-                        "X and Y resolutions differ in Image. This is unusual, and may indicate a problem.")
-                else:
-                    self.res = metadata.x_resolution
+        @return context manager yielding a pool
+        """
+        if self._pool is not None:
+            yield self._pool
+            return
+        _share_resource_tracker()
+        pool = multiprocessing.get_context(self.start_method).Pool(self.workers)
+        try:
+            yield pool
+        finally:
+            pool.terminate()
+            pool.join()
 
-            # read the scan
-            scan = cv2.imread(os.path.expanduser(img))
+    def _task(self, method: str) -> Callable:
+        """
+        Wrap a method for the pool so that tasks carry only the settings and the image, not the estimator.
 
-            # transfer to grayscale
-            scan = cv2.cvtColor(scan, cv2.COLOR_BGR2GRAY)
+        @param method: name of the method to call in the worker
+        @return picklable callable
+        """
+        return functools.partial(_run_in_worker, self._settings(), method)
 
-            # classify leaf and background
-            if self.threshold < 0 or self.threshold > 255:
-                raise ValueError("Threshold must be an integer between 0 and 255.")
-            scan = cv2.threshold(scan, self.threshold, 255, cv2.THRESH_BINARY_INV)[1]
+    def _settings(self) -> tuple:
+        """Constructor arguments that affect the processing of a single image, as an immutable task payload."""
+        return tuple((name, getattr(self, name)) for name in inspect.signature(EstimateLeafArea).parameters
+                     if name not in _POOL_ARGUMENTS)
 
-            # label leaflets
-            leaflets = measure.label(scan, background=0)
+    def with_settings(self, **settings) -> 'EstimateLeafArea':
+        """
+        Copy the estimator with other settings, sharing its pool of workers and cache.
 
-            # count number of pixels in each label
-            leaflets = np.unique(leaflets, return_counts=True)
+        Used to run requests with different settings side by side, e.g. in a batch or by the server.
 
-            # create mask to remove dirt and background
-            mask = np.ones(len(leaflets[1]), dtype=bool)
+        @param settings: constructor arguments that affect the processing of a single image, e.g. threshold, cut_off,
+            combine or res. Strings are converted to the annotated type, so text from a query string or a CSV file can
+            be passed as it is
+        @return the copy
+        """
+        annotations = {name: parameter.annotation for name, parameter in
+                       inspect.signature(EstimateLeafArea).parameters.items() if name not in _POOL_ARGUMENTS}
+        estimator = copy.copy(self)
+        for name, value in settings.items():
+            if name not in annotations:
+                raise ValueError(f"{name} is not a setting of the estimator. Use one of {', '.join(annotations)}.")
+            setattr(estimator, name, _setting_value(name, value, annotations[name]))
+        return estimator
 
-            # remove small patches
-            if self.cut_off < 0:
-                raise ValueError("cutoff for small specks must not be negative.")
-            mask[leaflets[1] < self.cut_off] = False
+    def _chunksize(self, tasks: int) -> int:
+        """Hand out work in chunks of about a quarter of each worker's share to balance transfer and load."""
+        return max(1, tasks // (4 * max(1, self.workers)))
 
-            # remove background pixels
-            mask[leaflets[0] == 0] = False  # background is labeled as 0
+    def _open_cache(self):
+        """
+        Open the result cache, or a stand-in that does nothing if caching is off.
 
-            # apply mask
-            areas = leaflets[1][mask]
+        @return context manager yielding a ResultCache or None
+        """
+        if not self.cache:
+            return contextlib.nullcontext()
+        return ResultCache(self.cache, max_entries=self.cache_size)
 
-            # convert from pixels to cm2
-            res = self.res / 2.54  # 2.54 cm in an inch
-            res = res * res  # pixels per cm^2
-            areas = areas / res
+    def _cache_key(self, cache: ResultCache, img: str) -> str:
+        """Key a scan by its file version and the settings that change its areas."""
+        edits = None
+        if self.apply_preprocess:
+            edits = [self.crop, self.mask_scale, self.mask_pixels, self.mask_offset_x, self.mask_offset_y,
+                     self.red_scale, self.red_scale_pixels]
+        return cache.key(img, threshold=self.threshold, cut_off=self.cut_off, res=self.res, reduce=self.reduce,
+                         morphology=self.morphology, edits=edits)
 
-            # save image
+    def _read(self, img: str, profile: Optional[dict] = None) -> Tuple[ndarray, float]:
+        """
+        Read a scan to grayscale together with its effective resolution.
+
+        @param img: path to the scan. respects tilde expansion
+        @param profile: where to add the time spent, see profiling; def: None (not profiling)
+        @return the grayscale scan, and its resolution in dpi after any reduction
+        """
+        # read the image resolution from the file header, without touching the instance default
+        res = self.res
+        if not res:
+            with timed(profile, 'metadata'):
+                res = read_resolution(img)
+            if not res:
+                raise ValueError("Image of unknown resolution. Please specify the res argument in dpi.")
+
+        # read the scan straight to grayscale, downscaled by the decoder if requested
+        if self.reduce not in READ_FLAGS:
+            raise ValueError("reduce must be one of 1, 2, 4 or 8.")
+        with timed(profile, 'decode'):
+            scan = cv2.imread(os.path.expanduser(img), READ_FLAGS[self.reduce])
+        if scan is None:
+            raise ValueError(f'Could not read {img} as an image.')
+        return self._prepare(scan, res, img)
+
+    def _prepare(self, scan: ndarray, res: float, name: Optional[str] = None) -> Tuple[ndarray, float]:
+        """
+        Apply the preprocess() edits, if requested, to a scan decoded to grayscale.
+
+        @param scan: grayscale scan, reduced if requested
+        @param res: resolution of the original scan in dpi
+        @param name: file name of the scan, for the copy saved to preprocess_dir; None not to save it
+        @return the grayscale scan, and its resolution in dpi after any reduction
+        """
+        # apply the preprocess() edits without a round trip through a re-encoded file
+        if self.apply_preprocess:
+            scan = self._edit(scan, self.reduce)
+            if self.preprocess_dir and name is not None:
+                cv2.imwrite(self._preprocessed_path(self.preprocess_dir, name, self.input_root), scan)
+
+        # each pixel of a reduced scan stands for reduce^2 pixels of the original
+        return scan, res / self.reduce
+
+    def _decode(self, data, res: float = 0, name: Optional[str] = None,
+                profile: Optional[dict] = None) -> Tuple[ndarray, float]:
+        """
+        Decode an encoded image held in memory to grayscale together with its effective resolution.
+
+        @param data: bytes-like object holding the image file, e.g. a JPEG
+        @param res: resolution in dpi; def: 0 (res, or else the image header)
+        @param name: file name of the scan, see _prepare
+        @param profile: see _read
+        @return the grayscale scan, and its resolution in dpi after any reduction
+        """
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        res = res or self.res
+        if not res:
+            with timed(profile, 'metadata'):
+                res = read_resolution(io.BytesIO(buffer))
+            if not res:
+                raise ValueError("Image of unknown resolution. Please specify the res argument in dpi.")
+
+        if self.reduce not in READ_FLAGS:
+            raise ValueError("reduce must be one of 1, 2, 4 or 8.")
+        with timed(profile, 'decode'):
+            scan = cv2.imdecode(buffer, READ_FLAGS[self.reduce])
+        if scan is None:
+            raise ValueError("Could not decode the data as an image.")
+        return self._prepare(scan, res, name)
+
+    def _convert(self, scan: ndarray, res: float = 0, name: Optional[str] = None,
+                 profile: Optional[dict] = None) -> Tuple[ndarray, float]:
+        """
+        Bring a decoded image to grayscale at the requested reduction.
+
+        @param scan: 8-bit grayscale, BGR or BGRA image
+        @param res: resolution in dpi; def: 0 (res)
+        @param name: file name of the scan, see _prepare
+        @param profile: see _read
+        @return the grayscale scan, and its resolution in dpi after any reduction
+        """
+        res = res or self.res
+        if not res:
+            raise ValueError("Arrays carry no resolution. Please specify the res argument in dpi.")
+        if scan.dtype != np.uint8 or scan.ndim not in (2, 3):
+            raise ValueError("The scan must be an 8-bit grayscale, BGR or BGRA image.")
+        if self.reduce not in READ_FLAGS:
+            raise ValueError("reduce must be one of 1, 2, 4 or 8.")
+
+        with timed(profile, 'grayscale'):
+            if scan.ndim == 3:
+                scan = cv2.cvtColor(scan, cv2.COLOR_BGRA2GRAY if scan.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+            elif self.apply_preprocess or self.strip_height:
+                # both write into the scan; leave the caller's array alone
+                scan = scan.copy()
+            if self.reduce > 1:
+                size = (scan.shape[1] // self.reduce, scan.shape[0] // self.reduce)
+                scan = cv2.resize(scan, size, interpolation=cv2.INTER_AREA)
+        return self._prepare(scan, res, name)
+
+    def _measure(self, img: str) -> dict:
+        """
+        Estimate the area of each leaf patch in a single image.
+
+        @param img: path to the scan. respects tilde expansion
+        @return dict with the areas of the retained patches in cm2 under 'Area', plus the threshold that was applied
+            under 'threshold' if it was chosen automatically, the shape of each patch if morphology is set and the
+            timings of the stages under 'profile' if profile is set
+        """
+        profile = self._start_profile()
+        result, scan = self._classify(*self._read(img, profile), profile)
+        self._save(img, scan, profile)
+        if profile is not None:
+            profile['peak_rss'] = peak_rss()
+        return result
+
+    def _start_profile(self) -> Optional[dict]:
+        """Start the profile of an image in this process, if profiling."""
+        if not self.profile:
+            return None
+        reset_peak_rss()
+        return new_profile()
+
+    def _measure_data(self, data, res: float = 0, name: Optional[str] = None) -> dict:
+        """
+        Estimate the area of each leaf patch in an image held in memory.
+
+        @param data: decoded image (ndarray, see _convert) or encoded image file (any other bytes-like object)
+        @param res: resolution in dpi; def: 0 (res, or else the header of an encoded image)
+        @param name: file name of the scan, for the images saved to output_dir and preprocess_dir; None not to save
+        @return see _measure
+        """
+        profile = self._start_profile()
+        if isinstance(data, ndarray) and data.dtype == np.uint8 and data.ndim > 1:
+            result, scan = self._classify(*self._convert(data, res, name, profile), profile)
+        else:
+            result, scan = self._classify(*self._decode(data, res, name, profile), profile)
+        if name is not None:
+            self._save(name, scan, profile)
+        if profile is not None:
+            profile['peak_rss'] = peak_rss()
+        return result
+
+    def _measure_shared(self, task: tuple) -> Tuple[int, dict]:
+        """
+        Measure an image that was placed in shared memory by estimate_batch, without copying it into the worker.
+
+        @param task: index of the image, name of the shared memory block, offset, shape and dtype of the image in it,
+            its resolution and its name; encoded images are one-dimensional
+        @return the index and the result, with any error recorded under 'error'
+        """
+        from multiprocessing import shared_memory
+        index, memory, offset, shape, dtype, res, name = task
+        # the block belongs to estimate_batch, which unlinks it; only 3.13 can attach without registering it
+        block = shared_memory.SharedMemory(memory, **({'track': False} if sys.version_info >= (3, 13) else {}))
+        try:
+            data = np.ndarray(shape, dtype, buffer=block.buf, offset=offset)
+            try:
+                result = self._measure_data(data, res, name)
+            except Exception as error:
+                result = {'error': f'{type(error).__name__}: {error}'}
+            # views must be gone before the block can be closed
+            del data
+        finally:
+            block.close()
+        return index, result
+
+    def _measure_member(self, member: Tuple[str, bytes]) -> dict:
+        """
+        Measure an image read from an archive, returning its mask encoded rather than saving it.
+
+        @param member: name of the image in the archive and its contents
+        @return see _measure, plus the name and contents of the mask file under 'mask' if output_dir is set; errors
+            are recorded under 'error'
+        """
+        name, data = member
+        try:
+            profile = self._start_profile()
+            result, scan = self._classify(*self._decode(memoryview(data), profile=profile), profile)
             if self.output_dir:
-                write_to = os.path.join(os.path.expanduser(self.output_dir), os.path.basename(img))
-                cv2.imwrite(write_to, scan)
+                # next to the member, as in the archive
+                mask_name = os.path.join(os.path.dirname(name), mask_path('', name, self.mask_format))
+                with timed(profile, 'write'):
+                    result['mask'] = mask_name, encode_mask(mask_name, scan, self.mask_format, self.mask_thumbnail)
+            if profile is not None:
+                profile['peak_rss'] = peak_rss()
+            return result
+        except Exception as error:
+            return {'error': f'{type(error).__name__}: {error}'}
+
+    def _preprocess_member(self, member: Tuple[str, bytes]) -> bytes:
+        """
+        Preprocess an image read from an archive.
+
+        @param member: name of the image in the archive and its contents
+        @return the edited image encoded as JPEG
+        """
+        scan = cv2.imdecode(np.frombuffer(member[1], dtype=np.uint8), cv2.IMREAD_COLOR)
+        if scan is None:
+            raise ValueError(f"Could not decode {member[0]} as an image.")
+        return cv2.imencode('.jpg', self._edit(scan))[1].tobytes()
 
-            if self.combine:
-                return pd.DataFrame(data={'filename': [img], 'Area': [areas.sum()]})
+    def _classify(self, scan: ndarray, res: float, profile: Optional[dict] = None) -> Tuple[dict, ndarray]:
+        """
+        Threshold a grayscale scan and measure its leaf patches.
+
+        @param scan: grayscale scan, as returned by _read
+        @param res: its resolution in dpi, as returned by _read
+        @param profile: see _read; it is also added to the result
+        @return the result (see _measure), and the thresholded scan or the label image if that is to be saved
+        """
+        result = {}
+
+        # classify leaf and background
+        threshold = self.threshold
+        if isinstance(threshold, str):
+            if threshold not in AUTO_THRESHOLDS:
+                raise ValueError(f"Threshold must be an integer or one of: {', '.join(AUTO_THRESHOLDS)}.")
+            with timed(profile, 'threshold'):
+                threshold = AUTO_THRESHOLDS[threshold](cv2.calcHist([scan], [0], None, [256], [0, 256]).ravel())
+            result['threshold'] = threshold
+        if threshold < 0 or threshold > 255:
+            raise ValueError("Threshold must be an integer between 0 and 255.")
+        if self.cut_off < 0:
+            raise ValueError("cutoff for small specks must not be negative.")
+        if self.morphology and self.combine:
+            raise ValueError("Morphology is measured per patch. Set combine to False.")
+        cut_off = self.cut_off / self.reduce ** 2
+
+        # res / 2.54 = pixels per cm, as 2.54 cm in an inch
+        res = res / 2.54
+
+        labels = self.output_dir and self.mask_format == 'labels'
+        if self.strip_height:
+            if self.strip_height < 0:
+                raise ValueError("strip_height must not be negative.")
+            if labels or self.morphology:
+                raise ValueError("Label images and morphology cannot be computed in strip mode.")
+            # threshold each strip in place and label it before moving on to the next one
+            with timed(profile, 'label'):
+                strips = (cv2.threshold(scan[row:row + self.strip_height], threshold, 255, cv2.THRESH_BINARY_INV,
+                                        dst=scan[row:row + self.strip_height])[1]
+                          for row in range(0, scan.shape[0], self.strip_height))
+                areas = strip_areas(strips, cut_off)
+        else:
+            with timed(profile, 'threshold'):
+                scan = cv2.threshold(scan, threshold, 255, cv2.THRESH_BINARY_INV)[1]
+
+            # label leaflets and count the pixels of those above the cut off
+            if self.engine not in AREA_ENGINES:
+                raise ValueError(f"Unknown engine {self.engine}. Choose one of: {', '.join(AREA_ENGINES)}.")
+            if labels or self.morphology:
+                with timed(profile, 'label'):
+                    stats, label_image = opencv_labels(scan, cut_off)
+                with timed(profile, 'count'):
+                    areas = stats[:, cv2.CC_STAT_AREA].astype(np.int64)
+                    if self.morphology:
+                        for column, values in patch_morphology(label_image, stats).items():
+                            if column in LENGTH_COLUMNS:
+                                values = values / res
+                            elif column in AREA_COLUMNS:
+                                values = values / (res * res)
+                            result[column] = values
+                if labels:
+                    scan = label_image
             else:
-                return pd.DataFrame(data={'filename': [img] * areas.shape[0], 'Area': areas})
-        elif os.path.isdir(img):
-            # obtain a list of images
-            images = os.listdir(img)
-            images = [os.path.join(img, i) for i in images]
-
-            # create a workers pool and start processing
-            pool = multiprocessing.Pool(self.workers)
-            results = pool.map(self.estimate, images)
-            pool.close()
-            pool.join()
+                with timed(profile, 'label'):
+                    areas = AREA_ENGINES[self.engine](scan, cut_off)
+
+        # convert from pixels to cm2
+        with timed(profile, 'count'):
+            res = res * res  # pixels per cm^2
+            result['Area'] = areas / res
+        if profile is not None:
+            result['profile'] = profile
+        return result, scan
 
-            # unify the results into a single dataframe
-            return pd.concat(results)
+    def _save(self, img: str, scan: ndarray, profile: Optional[dict] = None):
+        """
+        Save the thresholded scan to output_dir in mask_format, if output_dir is set.
+
+        @param img: path to the original scan, for the file name
+        @param scan: thresholded scan, or label image
+        @param profile: see _read
+        """
+        if self.output_dir:
+            with timed(profile, 'write'):
+                write_mask(mask_path(self.output_dir, img, self.mask_format, self.input_root), scan, self.mask_format,
+                           self.mask_thumbnail)
+
+    def _frame(self, img: str, result: dict) -> DataFrame:
+        """
+        Tabulate the areas of a single image.
+
+        @param img: path to the scan
+        @param result: as returned by _measure
+        @return pandas DF with the file name of the input, the estimated area(s) and any per-image values; at least one
+            row, with an area of 0 if no patch is above the cut off
+        """
+        if 'error' in result:
+            return pd.DataFrame(data={'filename': [img], 'Area': [np.nan], 'error': [result['error']]})
+        areas = result['Area']
+        extra = {column: value for column, value in result.items() if column not in ('Area', 'profile')}
+        extra.update(result.get('profile', {}))
+        if self.combine:
+            return pd.DataFrame(data={'filename': [img], 'Area': [areas.sum()], **extra})
+        elif not areas.shape[0]:
+            # a row of zero area for an image without leaves, so that the output records it as done
+            extra = {column: [np.nan if isinstance(value, np.ndarray) else value] for column, value in extra.items()}
+            return pd.DataFrame(data={'filename': [img], 'Area': [0.0], **extra})
+        else:
+            return pd.DataFrame(data={'filename': [img] * areas.shape[0], 'Area': areas, **extra})
+
+    def columns(self) -> list:
+        """
+        List the columns of the result frames with the current settings, so streamed output has a fixed layout.
+
+        @return column names; 'error' is only filled for images that could not be processed
+        """
+        columns = ['filename', 'Area']
+        if isinstance(self.threshold, str):
+            columns.append('threshold')
+        if self.morphology:
+            columns += MORPHOLOGY_COLUMNS
+        if self.profile:
+            columns += PROFILE_COLUMNS
+        return columns + ['error']
+
+    def _images(self, img: Union[str, Sequence[str]]) -> list:
+        """
+        List the images to process.
+
+        @param img: path to the scan or images folder, or a list of paths to scans
+        @return a list with img itself, or the paths of the images in the folder (see discovery.find_images), less
+            those with results in the checkpoint
+        """
+        if not isinstance(img, (str, os.PathLike)):
+            images = list(img)
+        elif os.path.isfile(img):
+            images = [img]
+            self.input_root = ''
+        elif os.path.isdir(img):
+            self.input_root = img
+            # skip other files, hidden entries and, unless recursive, subfolders
+            images = list_images(img, self.manifest, group=self.group, recursive=self.recursive,
+                                 pattern=self.pattern, follow_symlinks=self.follow_symlinks)
+            if self.shard:
+                images = shard_images(images, self.shard, img, self.shard_by)
         else:
             raise ValueError(f'Your input {img} needs to be a path to an image or a directory.')
+        if self.checkpoint:
+            done = processed_files(self.checkpoint)
+            images = [image for image in images if image not in done]
+        return images
+
+    def _try_measure(self, img: str, catch: bool = True) -> Tuple[str, dict]:
+        """
+        Measure an image, recording any failure in the result rather than raising it.
+
+        @param img: path to the scan
+        @param catch: whether to record errors; if False they are raised
+        @return img and its result; failed images have their error message under 'error'
+        """
+        if not catch:
+            return img, self._measure(img)
+        try:
+            return img, self._measure(img)
+        except Exception as error:
+            return img, {'error': f'{type(error).__name__}: {error}'}
+
+    def _results(self, images: list, catch: bool = True) -> Iterator[Tuple[str, dict]]:
+        """
+        Measure images, yielding their results as they become available.
+
+        Cached results come first, then the others in order of completion.
+
+        @param images: paths to the scans
+        @param catch: whether to record errors in the results rather than raise them; always True in the pool
+        @return iterator of (image, result) pairs
+        """
+        with self._open_cache() as cache:
+            # look up images processed before
+            missing = []
+            self.cache_hits = self.cache_misses = 0
+            for image in images:
+                result = None
+                if cache is not None and not self.output_dir and not self.preprocess_dir:
+                    result = cache.get(self._cache_key(cache, image))
+                if result is None:
+                    missing.append(image)
+                else:
+                    self.cache_hits += 1
+                    yield image, result
+            self.cache_misses = len(missing)
+
+            with contextlib.ExitStack() as stack:
+                trace = stack.enter_context(open(os.path.expanduser(self.trace), 'a')) if self.trace else None
+                if len(missing) == 1 and self._pool is not None:
+                    # on a warm worker, so that calls from several threads (e.g. the server) run in parallel
+                    measured = iter([self._pool.apply(self._task('_try_measure'), (missing[0], catch))])
+                elif len(missing) == 1:
+                    measured = iter([self._try_measure(missing[0], catch)])
+                elif missing and self.threads:
+                    measured = self._pipeline(missing)
+                elif missing and self.memory_budget:
+                    measured = self._scheduled(stack.enter_context(self._workers()), missing)
+                elif missing:
+                    # hand out images in chunks as workers become free
+                    pool = stack.enter_context(self._workers())
+                    measured = pool.imap_unordered(self._task('_try_measure'), missing,
+                                                   chunksize=self._chunksize(len(missing)))
+                else:
+                    measured = iter([])
+
+                for image, result in measured:
+                    if trace is not None and 'profile' in result:
+                        trace.write(trace_line(image, result['profile']))
+                    if cache is not None and 'error' not in result:
+                        # timings describe this run only
+                        cache.put(self._cache_key(cache, image),
+                                  {column: value for column, value in result.items() if column != 'profile'})
+                    yield image, result
+
+    def _archive_results(self, archive: str) -> Iterator[Tuple[str, dict]]:
+        """
+        Measure the images in a zip or tar archive without extracting it.
+
+        The archive is read once from start to end and the bytes of each image are sent to the workers, with at most
+        two images per worker in memory at a time. Masks come back encoded and are saved here, to output_dir, which may
+        be a zip archive, under the name of the archive, e.g. site3.zip/plot1/scan01.png, so that the masks of several
+        archives do not collide. Results are not cached, but the members with results in the checkpoint are skipped.
+
+        @param archive: path to the zip or tar archive
+        @return iterator of (archive/member, result) pairs in order of completion
+        """
+        self.cache_hits = self.cache_misses = 0
+        done = processed_files(self.checkpoint) if self.checkpoint else set()
+        prefix = os.path.join(archive, '')
+        members = iter_members(archive, self.pattern, {name[len(prefix):] for name in done if name.startswith(prefix)})
+
+        with contextlib.ExitStack() as stack:
+            outputs = stack.enter_context(ArchiveWriter(self.output_dir)) if self.output_dir else None
+            trace = stack.enter_context(open(os.path.expanduser(self.trace), 'a')) if self.trace else None
+            if self._pool is None and self.workers < 2:
+                measured = ((member, self._measure_member(member), None) for member in members)
+            else:
+                measured = run_streamed(stack.enter_context(self._workers()), self._task('_measure_member'), members,
+                                        2 * max(1, self.workers))
+            for (name, _), result, error in measured:
+                if error is not None:
+                    result = {'error': f'{type(error).__name__}: {error}'}
+                self.cache_misses += 1
+                mask = result.pop('mask', None)
+                if mask is not None:
+                    try:
+                        outputs.write(posixpath.join(os.path.basename(archive), mask[0]), mask[1])
+                    except ValueError as error:
+                        result = {'error': f'{type(error).__name__}: {error}'}
+                image = os.path.join(archive, name)
+                if trace is not None and 'profile' in result:
+                    trace.write(trace_line(image, result['profile']))
+                yield image, result
+
+    def _pipeline(self, images: list) -> Iterator[Tuple[str, dict]]:
+        """
+        Measure images on threads, overlapping disk reads, decoding, labeling and mask encoding.
+
+        The peak depth of each queue is kept in queue_peaks: a queue that is often full sits in front of the stage
+        that limits the batch.
+
+        @param images: paths to the scans
+        @return iterator of (image, result) pairs in order of completion
+        """
+        def read(image: str) -> tuple:
+            # the profile travels with the scan, as each stage runs on a different thread
+            profile = new_profile() if self.profile else None
+            return self._read(image, profile) + (profile,)
+
+        def classify(scan: ndarray, res: float, profile: Optional[dict]) -> tuple:
+            result, scan = self._classify(scan, res, profile)
+            return result, (scan, profile)
+
+        def save(image: str, payload: tuple):
+            self._save(image, *payload)
+
+        pipeline = Pipeline(read, classify, save if self.output_dir else None,
+                            readers=self.threads, computers=self.threads, writers=max(1, self.threads // 2),
+                            queue_size=self.queue_size)
+        self.queue_peaks = pipeline.peaks
+        for image, result, error in pipeline.run(images):
+            if error is not None:
+                result = {'error': f'{type(error).__name__}: {error}'}
+            self.queue_peaks = pipeline.peaks
+            yield image, result
+
+    def _scheduled(self, pool, images: list) -> Iterator[Tuple[str, dict]]:
+        """
+        Measure images on the pool while their estimated peak memory fits in memory_budget, largest first.
+
+        Scans whose header does not give their dimensions are assumed to be as large as the largest one that does.
+
+        @param pool: pool of workers
+        @param images: paths to the scans
+        @return iterator of (image, result) pairs in order of completion
+        """
+        settings = dict(reduce=self.reduce, strip_height=self.strip_height, engine=self.engine,
+                        numbered=bool(self.output_dir) and self.mask_format == 'labels', morphology=self.morphology)
+        costs = [image_memory(image, **settings) for image in images]
+        known = [cost for cost in costs if cost is not None]
+        largest = max(known) if known else self.memory_budget
+        costs = [largest if cost is None else cost for cost in costs]
+
+        for image, measured, error in run_within_budget(pool, self._task('_try_measure'), images, costs,
+                                                        self.memory_budget):
+            if error is not None:
+                measured = image, {'error': f'{type(error).__name__}: {error}'}
+            yield measured
+
+    def iter_estimate(self, img: Union[str, Sequence[str]]) -> Iterator[DataFrame]:
+        """
+        Estimate leaf area for a given image or directory of images, yielding one frame per image as soon as it is done.
+
+        Images that cannot be processed do not stop the run; they yield a single row with a NaN area and the reason in
+        the error column.
+
+        @param img: path to the scan, images folder or zip or tar archive of images (see archives), or a list of paths
+            to scans, e.g. the new files of a folder (see watch). respects tilde expansion
+        @return iterator of pandas DFs with the file name of the input and the estimated area(s)
+        """
+        results = self._archive_results(img) if is_archive(img) else self._results(self._images(img))
+        for image, result in results:
+            yield self._frame(image, result)
+
+    def estimate(self, img: str) -> DataFrame:
+        """
+        Estimate leaf area for a given image or directory of images.
+
+        If a result cache is set, images that were processed before with the same settings are not decoded again,
+        unless output_dir is set and the classified images have to be written. The hit and miss counts of the last
+        call are kept in cache_hits and cache_misses.
+
+        A single image that cannot be processed raises an error. In a directory, such images are reported in an error
+        column and the others are still processed.
+
+        @param img: path to the scan, images folder or zip or tar archive of images. respects tilde expansion
+        @return pandas DF with the file name of the input and the estimated area(s)
+        """
+        if is_archive(img):
+            # in the order of the member names, as for a folder
+            results = sorted(self._archive_results(img), key=lambda pair: pair[0])
+            output = pd.concat([self._frame(image, result) for image, result in results])
+            output.attrs.update(cache_hits=self.cache_hits, cache_misses=self.cache_misses)
+            return output
+        images = self._images(img)
+        results = dict(self._results(images, catch=not os.path.isfile(img)))
+
+        # unify the results into a single dataframe, in the order of the images
+        output = pd.concat([self._frame(image, results[image]) for image in images])
+        output.attrs.update(cache_hits=self.cache_hits, cache_misses=self.cache_misses)
+        return output
+
+    def estimate_array(self, scan: ndarray, res: float = 0, name: Optional[str] = None) -> DataFrame:
+        """
+        Estimate leaf area for a scan that is already decoded, e.g. straight from a scanner, without touching disk.
+
+        @param scan: 8-bit grayscale, BGR or BGRA image
+        @param res: resolution in dpi; def: 0 (res)
+        @param name: file name to report and to save the classified image under in output_dir; def: None (do not save)
+        @return pandas DF with the name and the estimated area(s)
+        """
+        return self._frame(name, self._measure_data(scan, res, name))
+
+    def estimate_bytes(self, data, res: float = 0, name: Optional[str] = None) -> DataFrame:
+        """
+        Estimate leaf area for an encoded image held in memory, e.g. an upload, without writing it to a file.
+
+        @param data: the image file as a bytes-like object, or a binary file object to read it from
+        @param res: resolution in dpi; def: 0 (res, or else the image header)
+        @param name: file name to report and to save the classified image under in output_dir; def: None (do not save)
+        @return pandas DF with the name and the estimated area(s)
+        """
+        if hasattr(data, 'read'):
+            data = data.read()
+        return self._frame(name, self._measure_data(memoryview(data), res, name))
+
+    def estimate_batch(self, items: Sequence, res: Union[float, Sequence[float]] = 0,
+                       names: Optional[Sequence[str]] = None) -> DataFrame:
+        """
+        Estimate leaf area for many images held in memory on the pool of workers.
+
+        The images are copied once into a shared memory block that the workers read in place, rather than being
+        pickled to each of them. As in a directory, images that cannot be processed are reported in an error column.
+
+        @param items: decoded scans (see estimate_array) and/or encoded images (see estimate_bytes)
+        @param res: resolution in dpi, for all images or one per image; def: 0 (res, or else the image header)
+        @param names: file names to report and to save the classified images under; def: None (positions, not saved)
+        @return pandas DF with the name (or position) of each image and the estimated area(s), in the order of items
+        """
+        items = [item.read() if hasattr(item, 'read') else item for item in items]
+        resolutions = [res] * len(items) if np.ndim(res) == 0 else list(res)
+        labels = list(range(len(items))) if names is None else list(names)
+        if not len(resolutions) == len(labels) == len(items):
+            raise ValueError("Give one resolution and one name per image, or none.")
+
+        results = {}
+        if len(items) < 2 or self.workers < 2:
+            for index, item in enumerate(items):
+                try:
+                    result = self._measure_data(item if isinstance(item, ndarray) else memoryview(item),
+                                                resolutions[index], None if names is None else names[index])
+                except Exception as error:
+                    result = {'error': f'{type(error).__name__}: {error}'}
+                results[index] = result
+        else:
+            from multiprocessing import shared_memory
+
+            # lay the images out in one block, each aligned to a cache line
+            arrays = [np.ascontiguousarray(item) if isinstance(item, ndarray) else np.frombuffer(item, dtype=np.uint8)
+                      for item in items]
+            offsets = np.cumsum([0] + [-(-array.nbytes // 64) * 64 for array in arrays])
+            block = shared_memory.SharedMemory(create=True, size=max(1, int(offsets[-1])))
+            try:
+                tasks = []
+                for index, array in enumerate(arrays):
+                    np.ndarray(array.shape, array.dtype, buffer=block.buf, offset=offsets[index])[...] = array
+                    tasks.append((index, block.name, int(offsets[index]), array.shape, array.dtype.str,
+                                  resolutions[index], None if names is None else names[index]))
+                with self._workers() as pool:
+                    for index, result in pool.imap_unordered(self._task('_measure_shared'), tasks,
+                                                             chunksize=self._chunksize(len(tasks))):
+                        results[index] = result
+            finally:
+                block.close()
+                block.unlink()
+
+        return pd.concat([self._frame(labels[index], results[index]) for index in range(len(items))])
+
+    def _sweep_areas(self, img: str, thresholds: Sequence[int]) -> dict:
+        """
+        Estimate the area of each leaf patch in a single image for a range of thresholds, decoding it once.
+
+        @param img: path to the scan. respects tilde expansion
+        @param thresholds: values between 0 and 255
+        @return dict mapping each threshold to the areas of the retained patches in cm2
+        """
+        if any(threshold < 0 or threshold > 255 for threshold in thresholds):
+            raise ValueError("Threshold must be an integer between 0 and 255.")
+        if self.cut_off < 0:
+            raise ValueError("cutoff for small specks must not be negative.")
+        scan, res = self._read(img)
+        counts = sweep_areas(scan, thresholds, self.cut_off / self.reduce ** 2)
+
+        # convert from pixels to cm2
+        res = res / 2.54  # 2.54 cm in an inch
+        res = res * res  # pixels per cm^2
+        return {threshold: areas / res for threshold, areas in counts.items()}
+
+    def sweep(self, img: str, thresholds: Sequence[int] = range(60, 200, 10)) -> DataFrame:
+        """
+        Estimate leaf area for a given image or directory of images over a range of thresholds.
+
+        Each image is decoded once and the thresholds share the labeling work, which makes this much faster than
+        calling estimate() once per threshold. Use it to choose the threshold for a new scanner or paper.
+
+        @param img: path to the scan or images folder. respects tilde expansion
+        @param thresholds: values between 0 (black) and 255 (white) to try
+        @return pandas DF; if combine, one row per image and one column of total area per threshold, otherwise the
+            file name, threshold and area of each retained patch. images of a folder that could not be processed get
+            a row without areas and their message in an 'error' column
+        """
+        thresholds = sorted(set(thresholds))
+        images = self._images(img)
+
+        if len(images) == 1:
+            results = [self._sweep_areas(images[0], thresholds)]
+        else:
+            with self._workers() as pool:
+                results = pool.starmap(self._task('_try_sweep'), [(image, thresholds) for image in images],
+                                       chunksize=self._chunksize(len(images)))
+        errors = [areas.get('error', np.nan) for areas in results]
+
+        if self.combine:
+            output = pd.DataFrame([[np.nan] * len(thresholds) if 'error' in areas else
+                                   [areas[threshold].sum() for threshold in thresholds] for areas in results],
+                                  index=pd.Index(images, name='filename'), columns=thresholds)
+            output.columns.name = 'threshold'
+            if any(isinstance(error, str) for error in errors):
+                output['error'] = errors
+            return output
+        frames = []
+        for image, areas in zip(images, results):
+            if 'error' in areas:
+                frames.append(pd.DataFrame(data={'filename': [image], 'threshold': [np.nan], 'Area': [np.nan],
+                                                 'error': [areas['error']]}))
+            else:
+                frames += [pd.DataFrame(data={'filename': image, 'threshold': threshold, 'Area': areas[threshold]})
+                           for threshold in thresholds]
+        return pd.concat(frames, ignore_index=True)
+
+    def _try_sweep(self, img: str, thresholds: Sequence[int]) -> dict:
+        """
+        Sweep a single image, recording any failure in the result rather than raising it, as _try_measure does.
+
+        @param img: path to the scan
+        @param thresholds: values between 0 and 255
+        @return as returned by _sweep_areas, or the error message under 'error'
+        """
+        try:
+            return self._sweep_areas(img, thresholds)
+        except Exception as error:
+            return {'error': f'{type(error).__name__}: {error}'}
+
+    def _edit(self, scan: ndarray, scale: int = 1) -> ndarray:
+        """
+        Crop the edges of a scan, mask an existing scale and add a red scale, as set up for preprocess().
+
+        @param scan: BGR or grayscale image; it may be modified in place
+        @param scale: the factor by which the scan was reduced when it was decoded; pixel settings refer to the original
+        @return the edited scan
+        """
+        dims = scan.shape
+        crop = self.crop // scale
+        mask_pixels, mask_offset_x, mask_offset_y = (self.mask_pixels // scale, self.mask_offset_x // scale,
+                                                     self.mask_offset_y // scale)
+        red_scale_pixels = self.red_scale_pixels // scale
+
+        # crop the edges
+        if crop:
+            if crop < 0:
+                raise ValueError('You have attempted to crop a negative number of pixels.')
+            if crop > dims[0] or crop > dims[1]:
+                raise ValueError('You have attempted to crop away more pixels than are available in the image.')
+            scan = scan[crop:dims[0] - crop, crop:dims[1] - crop]
+
+        # mask scale
+        if self.mask_scale:
+            if mask_offset_y < 0 or mask_offset_x < 0 or mask_pixels < 0:
+                raise ValueError("You have attempted to mask a negative number of pixels.")
+            if mask_offset_y + mask_pixels > dims[0] or mask_offset_x + mask_pixels > dims[1]:
+                raise ValueError("You have attempted to mask more pixels than are available in the image.")
+            scan[mask_offset_y:mask_offset_y + mask_pixels, mask_offset_x:mask_offset_x + mask_pixels] = 255  # white
+
+        # add scale
+        if self.red_scale:
+            if red_scale_pixels > dims[0] or red_scale_pixels > dims[1]:
+                raise ValueError("You have attempted to place a scale bar beyond the margins of the image.")
+            # pure red (BGR), or its luma in a grayscale scan
+            scan[0:red_scale_pixels, 0:red_scale_pixels] = (0, 0, 255) if scan.ndim == 3 else RED_GRAY
+
+        return scan
+
+    @staticmethod
+    def _preprocessed_path(output_dir: str, img: str, root: str = '') -> str:
+        """Name the preprocessed copy of a scan: its path relative to root, or its base name, as a jpg in output_dir."""
+        path = os.path.join(os.path.expanduser(output_dir), f'{os.path.splitext(relative_name(img, root))[0]}.jpg')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
 
     def preprocess(self, img):
         """
         Pre-processes an image by cropping its edges, adding a red scale, masking existing scales and converting to jpg.
 
-        @param img: path to the image or folder of images to process
+        To estimate leaf area from the edited scans without writing and decoding them again, set apply_preprocess and
+        call estimate() on the original scans instead.
+
+        @param img: path to the image, folder of images or zip or tar archive of images to process; the edited
+            images of an archive are saved under their member names, into output_dir or the zip archive it names
         @return None
         """
-        if os.path.isfile(img):
+        if is_archive(img):
+            if not self.output_dir:
+                raise ValueError("Give an output_dir, a folder or a zip archive, for the images of an archive.")
+            with ArchiveWriter(self.output_dir) as outputs, self._workers() as pool:
+                for (name, _), edited, error in run_streamed(pool, self._task('_preprocess_member'),
+                                                             iter_members(img, self.pattern), 2 * max(1, self.workers)):
+                    if error is not None:
+                        raise error
+                    outputs.write(f'{os.path.splitext(name)[0]}.jpg', edited)
+        elif os.path.isfile(img):
             if not self.output_dir:
                 output_dir = f'{os.path.split(img)[0]}/preprocessed'
                 os.makedirs(output_dir)
@@ -157,56 +1053,79 @@ class EstimateLeafArea:
                     'This would cause your file to be overwritten. Execution has been halted.')
             # read the image
             scan = cv2.imread(os.path.expanduser(img))
-            dims = scan.shape
-
-            # crop the edges
-            if self.crop:
-                if self.crop < 0:
-                    raise ValueError('You have attempted to crop a negative number of pixels.')
-                if self.crop > dims[0] or self.crop > dims[1]:
-                    raise ValueError('You have attempted to crop away more pixels than are available in the image.')
-                scan = scan[self.crop:dims[0] - self.crop, self.crop:dims[1] - self.crop]
-
-            # mask scale
-            if self.mask_scale:
-                if self.mask_offset_y < 0 or self.mask_offset_x < 0 or self.mask_pixels < 0:
-                    raise ValueError("You have attempted to mask a negative number of pixels.")
-                if self.mask_offset_y + self.mask_pixels > dims[0] or self.mask_offset_x + self.mask_pixels > dims[1]:
-                    raise ValueError("You have attempted to mask more pixels than are available in the image.")
-
-                scan[self.mask_offset_y:self.mask_offset_y + self.mask_pixels,
-                     self.mask_offset_x:self.mask_offset_x + self.mask_pixels,
-                     0] = 255  # b channel
-                scan[self.mask_offset_y:self.mask_offset_y + self.mask_pixels,
-                     self.mask_offset_x:self.mask_offset_x + self.mask_pixels,
-                     1] = 255  # g channel
-                scan[self.mask_offset_y:self.mask_offset_y + self.mask_pixels,
-                     self.mask_offset_x:self.mask_offset_x + self.mask_pixels,
-                     2] = 255  # r channel
-
-            # add scale
-            if self.red_scale:
-                if self.red_scale_pixels > dims[0] or self.red_scale_pixels > dims[1]:
-                    raise ValueError("You have attempted to place a scale bar beyond the margins of the image.")
-                scan[0:self.red_scale_pixels, 0:self.red_scale_pixels, 0] = 0  # b channel
-                scan[0:self.red_scale_pixels, 0:self.red_scale_pixels, 1] = 0  # g channel
-                scan[0:self.red_scale_pixels, 0:self.red_scale_pixels, 2] = 255  # red channel
-
-            # file name
-            file_name = os.path.basename(img)
-            file_name = f'{os.path.splitext(file_name)[0]}.jpg'
-            file_name = os.path.join(os.path.expanduser(self.output_dir), file_name)
 
             # save as jpg
-            cv2.imwrite(file_name, scan)
+            cv2.imwrite(self._preprocessed_path(self.output_dir, img, self.input_root), self._edit(scan))
         elif os.path.isdir(img):
-            images = os.listdir(img)
-            images = [os.path.join(img, i) for i in images]
+            images = self._images(img)
 
-            # create a workers pool and start processing
-            pool = multiprocessing.Pool(self.workers)
-            pool.map_async(self.preprocess, images)
-            pool.close()
-            pool.join()
+            # start processing
+            with self._workers() as pool:
+                pool.map_async(self._task('preprocess'), images, chunksize=self._chunksize(len(images))).wait()
         else:
             raise ValueError(f'Your input {img} needs to be either a file or a directory')
+
+
+def _setting_value(name: str, value, annotation):
+    """
+    Convert the text of a setting to its annotated type; other values are passed through.
+
+    @param name: the setting, for error messages
+    @param value: its value
+    @param annotation: type annotation of the constructor argument
+    @return the converted value
+    """
+    if not isinstance(value, str):
+        return value
+    types = getattr(annotation, '__args__', (annotation,))
+    if bool in types:
+        if value.lower() not in ('true', 'false', '1', '0', 'yes', 'no'):
+            raise ValueError(f"{name} must be true or false.")
+        return value.lower() in ('true', '1', 'yes')
+    if int in types or float in types:
+        for number in (int, float):
+            try:
+                return number(value)
+            except ValueError:
+                pass
+        # flags annotated as int, e.g. red_scale=TRUE from R
+        if value.lower() in ('true', 'false'):
+            return value.lower() == 'true'
+    if str in types:
+        # e.g. threshold=otsu
+        return value
+    raise ValueError(f"{name} must be a number.")
+
+
+# estimators built in this worker process, by settings
+_worker_estimators = {}
+
+
+def _share_resource_tracker():
+    """
+    Start the resource tracker before workers are forked, so that they report to it rather than each to their own.
+
+    Workers attaching to the shared memory of estimate_batch register it with the tracker; one of their own would
+    warn about a leaked block when the pool stops, as only the parent unlinks it. Spawned and forkserver workers
+    reach the parent's tracker already.
+    """
+    if os.name == 'posix':
+        from multiprocessing import resource_tracker
+        resource_tracker.ensure_running()
+
+
+def _run_in_worker(settings: tuple, method: str, *args):
+    """
+    Call an EstimateLeafArea method in a worker process, reusing one estimator per settings.
+
+    @param settings: as returned by EstimateLeafArea._settings
+    @param method: name of the method to call
+    @param args: arguments of the method
+    @return whatever the method returns
+    """
+    estimator = _worker_estimators.get(settings)
+    if estimator is None:
+        if len(_worker_estimators) >= 16:
+            _worker_estimators.clear()
+        estimator = _worker_estimators[settings] = EstimateLeafArea(workers=1, **dict(settings))
+    return getattr(estimator, method)(*args)
@@ -1,8 +1,47 @@
 #!/usr/bin/env python3
 
+import importlib
 import os
 
-from .EstimateLeafArea import EstimateLeafArea
+# names are imported from their module on first use, so that importing the package (e.g. to print the command line
+# help) does not load OpenCV, numpy and pandas
+_EXPORTS = {
+    'EstimateLeafArea': 'EstimateLeafArea',
+    'ARCHIVE_EXTENSIONS': 'archives', 'ArchiveWriter': 'archives', 'is_archive': 'archives',
+    'iter_members': 'archives',
+    'regressions': 'benchmark', 'run_benchmark': 'benchmark', 'startup_time': 'benchmark',
+    'synthetic_scan': 'benchmark', 'write_scans': 'benchmark',
+    'iter_requests': 'batch', 'read_requests': 'batch', 'request_columns': 'batch',
+    'ResultCache': 'cache',
+    'LeafAreaClient': 'client',
+    'IMAGE_EXTENSIONS': 'discovery', 'build_manifest': 'discovery', 'find_images': 'discovery',
+    'group_by_resolution': 'discovery', 'link_groups': 'discovery', 'parse_shard': 'discovery',
+    'read_manifest': 'discovery', 'shard_images': 'discovery', 'write_manifest': 'discovery',
+    'AREA_ENGINES': 'engines', 'AUTO_THRESHOLDS': 'engines',
+    'MASK_EXTENSIONS': 'masks', 'read_mask': 'masks',
+    'read_header': 'metadata', 'read_resolution': 'metadata',
+    'MORPHOLOGY_COLUMNS': 'morphology', 'patch_morphology': 'morphology',
+    'PROFILE_COLUMNS': 'profiling', 'profile_summary': 'profiling',
+    'parse_size': 'scheduler', 'task_memory': 'scheduler',
+    'serve': 'server',
+    'watch': 'watch',
+    'ResultWriter': 'writers', 'merge_results': 'writers', 'processed_files': 'writers', 'read_results': 'writers',
+}
+
+__all__ = list(_EXPORTS) + ['static']
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{_EXPORTS[name]}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS))
+
 
 here, file = os.path.split(os.path.abspath(__file__))
 static = os.path.join(here, 'static')
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Read scans straight from zip and tar archives, and save outputs into zip archives, without extracting anything.
+
+Collections from field sites arrive as archives of many gigabytes; extracting them only to read every file once doubles
+the disk traffic and the scratch space. Here the members are read one after the other, in the order they are stored,
+so that the archive is read once from start to end, and compressed tar archives are decompressed as a stream. The
+results of a member are named after the archive and the member, e.g. site3.zip/plot1/scan01.jpg.
+
+Boris Bongalov, Tim C.E Paine, Sabine Both
+"""
+
+import fnmatch
+import os
+import posixpath
+import re
+import tarfile
+import zipfile
+from typing import Collection, Iterator, Tuple
+
+from .discovery import IMAGE_EXTENSIONS
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+def is_archive(path) -> bool:
+    """
+    Tell archives from scans and folders by their extension.
+
+    @param path: path to the input or output
+    @return whether path names a zip or tar archive
+    """
+    return isinstance(path, (str, os.PathLike)) and os.fspath(path).lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def _wanted(name: str, pattern: str) -> bool:
+    """Whether find_images would list a member: an image, not hidden or a macOS resource fork, matching pattern."""
+    parts = name.split('/')
+    return (not any(part.startswith('.') or part == '__MACOSX' for part in parts) and
+            name.lower().endswith(IMAGE_EXTENSIONS) and (not pattern or fnmatch.fnmatch(name, pattern)))
+
+
+def _relative(name: str) -> str:
+    """
+    Make a member name relative, so that it names a file inside the output folder and after the archive.
+
+    Archives made from absolute paths name their members /data/scan01.jpg or C:/data/scan01.jpg, and tar archives of
+    a folder made with tar -C folder . name them ./scan01.jpg; all three become data/scan01.jpg or scan01.jpg.
+
+    @param name: name of the member as stored
+    @return the name without a drive letter, leading slashes or redundant parts
+    """
+    return posixpath.normpath(re.sub(r'^[A-Za-z]:', '', posixpath.normpath(name)).lstrip('/'))
+
+
+def iter_members(path: str, pattern: str = '', skip: Collection[str] = ()) -> Iterator[Tuple[str, bytes]]:
+    """
+    Read the images in an archive one at a time, in the order they are stored.
+
+    @param path: zip or tar archive, possibly compressed. respects tilde expansion
+    @param pattern: shell-style pattern that the member name must match, e.g. 'plot*/*.jpg'; def: '' (all)
+    @param skip: names of members not to read, e.g. those already done
+    @return iterator of (member name, made relative, contents)
+    """
+    path = os.path.expanduser(path)
+    if not os.path.isfile(path):
+        raise ValueError(f'Your input {path} needs to be a zip or tar archive.')
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            # in the order of the data in the file rather than of the directory at its end
+            for info in sorted(archive.infolist(), key=lambda info: info.header_offset):
+                name = _relative(info.filename)
+                if not info.is_dir() and _wanted(name, pattern) and name not in skip:
+                    yield name, archive.read(info)
+        return
+    try:
+        archive = tarfile.open(path, 'r|*')
+    except tarfile.TarError:
+        raise ValueError(f"{path} is neither a zip nor a tar archive.")
+    with archive:
+        for member in archive:
+            name = _relative(member.name)
+            if member.isfile() and _wanted(name, pattern) and name not in skip:
+                yield name, archive.extractfile(member).read()
+
+
+class ArchiveWriter:
+    """Save named files into a folder, or into a zip archive if its name ends in .zip."""
+
+    def __init__(self, output_dir: str):
+        """
+        @param output_dir: folder, created if needed, or zip archive, added to if it exists. respects tilde expansion
+        """
+        self.output_dir = os.path.expanduser(output_dir)
+        self.archive = None
+        self.names = set()  # saved so far, and those in the archive already
+        if self.output_dir.lower().endswith('.zip'):
+            # stored, not deflated: images and masks are compressed already
+            self.archive = zipfile.ZipFile(self.output_dir, 'a')
+            self.names.update(self.archive.namelist())
+        elif is_archive(self.output_dir):
+            raise ValueError("Outputs can only be saved into zip archives, not tar archives.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, name: str, data: bytes):
+        """
+        Save a file.
+
+        @param name: its path relative to the folder or within the archive
+        @param data: its contents
+        @raise ValueError: if name would put the file outside the folder or the archive, e.g. ../scan01.jpg, or if a
+            file of that name was saved already, rather than overwrite it or add a duplicate to the archive
+        """
+        relative = posixpath.normpath(name)
+        if posixpath.isabs(relative) or relative == '..' or relative.startswith('../'):
+            raise ValueError(f"{name} would be saved outside {self.output_dir}.")
+        if relative in self.names:
+            raise ValueError(f"{name} was saved in {self.output_dir} already.")
+        self.names.add(relative)
+        if self.archive is not None:
+            self.archive.writestr(relative, data)
+            return
+        path = os.path.join(self.output_dir, relative)
+        # also through links inside the folder
+        folder = os.path.realpath(self.output_dir)
+        if os.path.commonpath([folder, os.path.realpath(path)]) != folder:
+            raise ValueError(f"{name} would be saved outside {self.output_dir}.")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as stream:
+            stream.write(data)
+
+    def close(self):
+        """Finish the archive, writing its directory."""
+        if self.archive is not None:
+            self.archive.close()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Run many estimate requests, each an input with its own settings, in one process.
+
+Programs that call LeafCalc.py (e.g. the R package) can then start one process per session rather than one per image
+or per parameter set. A request file is CSV (by its .csv extension) or JSON lines, one request per row or line:
+
+    {"input": "scans/plot1", "threshold": 110, "res": 600}
+    {"input": "scans/plot2", "threshold": "otsu", "combine": true}
+
+input is a scan or a folder; the other keys are per-image arguments of EstimateLeafArea and override the settings of
+the estimator for that request only. Empty CSV cells keep the estimator's setting.
+
+Boris Bongalov, Tim C.E Paine, Sabine Both
+"""
+
+import json
+import os
+import sys
+from typing import Iterator, List
+
+import pandas as pd
+from pandas.core.frame import DataFrame
+
+from .archives import is_archive
+
+
+def read_requests(path: str) -> List[dict]:
+    """
+    Load a request file.
+
+    @param path: CSV or JSON-lines file, or '-' to read JSON lines from standard input. respects tilde expansion
+    @return one dict per request, each with an input
+    """
+    if path.lower().endswith('.csv'):
+        table = pd.read_csv(os.path.expanduser(path), dtype=str, keep_default_na=False)
+        requests = [{name: value for name, value in row.items() if value != ''} for row in table.to_dict('records')]
+    else:
+        if path == '-':
+            text = sys.stdin.read()
+        else:
+            with open(os.path.expanduser(path)) as stream:
+                text = stream.read()
+        requests = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    for number, request in enumerate(requests):
+        if not isinstance(request, dict) or not request.get('input'):
+            raise ValueError(f"Request {number} of {path} has no input.")
+    return requests
+
+
+def _settings(request: dict) -> dict:
+    """The settings of a request: everything but its input, skipping nulls."""
+    return {name: value for name, value in request.items() if name != 'input' and value is not None}
+
+
+def request_columns(estimator, requests: List[dict]) -> list:
+    """
+    List the columns of the results of a batch, so streamed output has a fixed layout.
+
+    @param estimator: EstimateLeafArea with the settings the requests override
+    @param requests: as returned by read_requests
+    @return 'request' followed by the columns of every request, each once, with 'error' last
+    """
+    columns = ['request']
+    for request in requests:
+        try:
+            names = estimator.with_settings(**_settings(request)).columns()
+        except ValueError:
+            # reported as the error of the request
+            continue
+        columns += [name for name in names if name not in columns]
+    return [name for name in columns if name != 'error'] + ['error']
+
+
+def iter_requests(estimator, requests: List[dict]) -> Iterator[DataFrame]:
+    """
+    Estimate leaf area for each request, yielding one frame per image as soon as it is done.
+
+    A request that cannot be run, e.g. with a missing input or an unknown setting, yields a single row with its error
+    and does not stop the batch. The cache hits and misses of all requests are added up in the estimator's cache_hits
+    and cache_misses.
+
+    @param estimator: EstimateLeafArea with the settings the requests override; open it first to share one pool of
+        workers between the requests
+    @param requests: as returned by read_requests
+    @return iterator of pandas DFs as from EstimateLeafArea.iter_estimate, with the number of the request (from 0) in
+        a first column 'request'
+    """
+    cache_hits = cache_misses = 0
+    for number, request in enumerate(requests):
+        try:
+            engine = estimator.with_settings(**_settings(request))
+            # a zip archive to save into is created by the estimator
+            if engine.output_dir and not is_archive(engine.output_dir):
+                os.makedirs(os.path.expanduser(engine.output_dir), exist_ok=True)
+            for frame in engine.iter_estimate(os.path.expanduser(request['input'])):
+                frame.insert(0, 'request', number)
+                yield frame
+            cache_hits += engine.cache_hits
+            cache_misses += engine.cache_misses
+            estimator.queue_peaks = engine.queue_peaks
+        except (ValueError, OSError) as error:
+            yield DataFrame({'request': [number], 'filename': [request['input']], 'Area': [float('nan')],
+                             'error': [f'{type(error).__name__}: {error}']})
+    estimator.cache_hits, estimator.cache_misses = cache_hits, cache_misses
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Benchmark leaf area estimation on synthetic scans with a known leaf area.
+
+Synthetic scans are white pages with dark green elliptical leaves, small specks and gray noise, saved as JPEGs that
+record their resolution. The true area of each scan is the number of leaf pixels drawn, so the benchmark checks
+accuracy as well as speed: a change that makes estimate() faster but less accurate shows up as a larger error.
+
+Boris Bongalov, Tim C.E Paine, Sabine Both
+"""
+
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import pandas as pd
+from pandas.core.frame import DataFrame
+
+# through the package, which binds the name to the class rather than to the module of the same name
+from . import EstimateLeafArea
+
+PAPER = (235, 235, 235)  # BGR
+LEAF = (40, 110, 50)
+SPECK = (60, 60, 60)
+
+
+def _set_jfif_density(jpeg: bytes, dpi: int) -> bytes:
+    """Write the resolution into the JFIF segment that OpenCV puts at the start of a JPEG."""
+    if jpeg[6:11] != b'JFIF\x00':
+        raise ValueError("The JPEG has no JFIF segment to record its resolution in.")
+    return jpeg[:13] + struct.pack('>BHH', 1, dpi, dpi) + jpeg[18:]
+
+
+def synthetic_scan(dpi: int = 300, size: Tuple[float, float] = (8.27, 11.69), leaves: int = 6,
+                   specks: float = 20, noise: float = 4, seed: Optional[int] = None) -> Tuple[np.ndarray, float]:
+    """
+    Draw a scan of leaves with a known area.
+
+    Leaves are ellipses of 2 to 10 cm that do not touch each other or the edge of the page. Specks are dark dots of
+    0.1 to 0.5 mm, far below a cut off of 0.5 cm2.
+
+    @param dpi: resolution in dots per inch
+    @param size: width and height of the page in inches; def: A4
+    @param leaves: number of leaves; fewer are drawn if they do not fit
+    @param specks: dark specks per square inch
+    @param noise: standard deviation of the gray noise added to every pixel
+    @param seed: seed of the random generator, for repeatable scans
+    @return BGR scan, and the true leaf area in cm2
+    """
+    rng = np.random.default_rng(seed)
+    width, height = int(size[0] * dpi), int(size[1] * dpi)
+    per_cm = dpi / 2.54
+    scan = np.empty((height, width, 3), dtype=np.uint8)
+    scan[:] = PAPER
+
+    # place leaves by rejection, keeping a margin around each bounding box
+    boxes = []
+    leaf_pixels = 0
+    for _ in range(leaves * 20):
+        if len(boxes) == leaves:
+            break
+        major = rng.uniform(2, 10) * per_cm / 2
+        minor = major * rng.uniform(0.3, 0.7)
+        angle = rng.uniform(0, 180)
+        half = int(np.ceil(major)) + 2
+        margin = int(0.5 * per_cm)
+        if width <= 2 * (half + margin) or height <= 2 * (half + margin):
+            continue
+        x = int(rng.integers(half + margin, width - half - margin))
+        y = int(rng.integers(half + margin, height - half - margin))
+        box = (x - half - margin, y - half - margin, x + half + margin, y + half + margin)
+        if any(box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3] for other in boxes):
+            continue
+        boxes.append(box)
+
+        # count the pixels of the leaf on a canvas of its own; the page gets exactly the same raster
+        axes = (int(round(major)), int(round(minor)))
+        canvas = np.zeros((2 * half + 1, 2 * half + 1), dtype=np.uint8)
+        cv2.ellipse(canvas, (half, half), axes, angle, 0, 360, 255, -1)
+        leaf_pixels += cv2.countNonZero(canvas)
+        cv2.ellipse(scan, (x, y), axes, angle, 0, 360, LEAF, -1)
+
+    # specks, away from the leaves so they do not add to the true area
+    count = int(specks * size[0] * size[1])
+    for x, y in zip(rng.integers(0, width, count), rng.integers(0, height, count)):
+        if any(box[0] <= x < box[2] and box[1] <= y < box[3] for box in boxes):
+            continue
+        cv2.circle(scan, (int(x), int(y)), max(1, int(rng.uniform(0.05, 0.25) / 10 * per_cm)), SPECK, -1)
+
+    # gray noise, in bands of rows to bound memory on large scans
+    if noise:
+        for row in range(0, height, 1024):
+            band = scan[row:row + 1024]
+            jitter = rng.normal(0, noise, band.shape[:2])[..., np.newaxis]
+            band[...] = np.clip(band + jitter, 0, 255)
+
+    return scan, leaf_pixels / per_cm ** 2
+
+
+def write_scans(folder: str, images: int, dpi: int, quality: int = 95, seed: int = 0, **scan) -> DataFrame:
+    """
+    Save synthetic scans as JPEGs that record their resolution.
+
+    @param folder: where to save them
+    @param images: how many scans
+    @param dpi: their resolution
+    @param quality: JPEG quality
+    @param seed: seed of the first scan; the others use the following seeds
+    @param scan: as for synthetic_scan
+    @return pandas DF with the path and the true area in cm2 of each scan
+    """
+    rows = []
+    for index in range(images):
+        image, area = synthetic_scan(dpi=dpi, seed=seed + index, **scan)
+        ok, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise ValueError("Could not encode the synthetic scan.")
+        path = os.path.join(folder, f'synthetic_{dpi}dpi_{index:03d}.jpg')
+        with open(path, 'wb') as stream:
+            stream.write(_set_jfif_density(jpeg.tobytes(), dpi))
+        rows.append([path, area, image.shape[0] * image.shape[1]])
+    return pd.DataFrame(rows, columns=['filename', 'true_area', 'pixels'])
+
+
+def _time_estimate(estimator: EstimateLeafArea, source: str, repeats: int) -> Tuple[float, DataFrame]:
+    """Run estimate() repeatedly and keep the fastest run, which is the least disturbed by other processes."""
+    best, output = np.inf, None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = estimator.estimate(source)
+        best = min(best, time.perf_counter() - start)
+    return best, output
+
+
+def run_benchmark(dpis: Sequence[int] = (150, 300, 600, 1200), workers: Sequence[int] = (1, 2, 4), images: int = 8,
+                  repeats: int = 3, folder: Optional[str] = None, **scan) -> DataFrame:
+    """
+    Time estimate() on synthetic scans in single-image and directory modes and check its accuracy.
+
+    The scans are read from the page cache after they are written, so the timings leave out cold disk reads.
+
+    @param dpis: resolutions to benchmark
+    @param workers: worker counts to benchmark the directory mode with
+    @param images: scans per resolution
+    @param repeats: runs of each case; the fastest counts
+    @param folder: where to write the scans; def: None (a temporary folder, removed afterwards)
+    @param scan: as for synthetic_scan, e.g. leaves, specks, noise or size
+    @return pandas DF with one row per resolution, mode and worker count: seconds, throughput in megapixels per
+        second, the largest peak memory of an image in MiB, and the mean and largest relative error of the total area
+    """
+    rows = []
+    with tempfile.TemporaryDirectory() as temporary:
+        for dpi in dpis:
+            path = os.path.join(folder or temporary, f'{dpi}dpi')
+            os.makedirs(path, exist_ok=True)
+            truth = write_scans(path, images, dpi, **scan).set_index('filename')
+
+            # drop specks but keep every leaf, whatever the resolution
+            cut_off = int(0.5 * (dpi / 2.54) ** 2)
+            cases = [('single', 1, truth.index[0])] + [('directory', count, path) for count in workers]
+            for mode, count, source in cases:
+                estimator = EstimateLeafArea(cut_off=cut_off, combine=True, workers=count, profile=True)
+                seconds, output = _time_estimate(estimator, source, repeats)
+                output = output.set_index('filename')
+                expected = truth.loc[output.index]
+                error = (output['Area'] - expected['true_area']).abs() / expected['true_area']
+                pixels = expected['pixels'].sum()
+                rows.append([dpi, mode, count, len(output), pixels / 1e6, seconds, pixels / 1e6 / seconds,
+                             output['peak_rss'].max() / 2 ** 20, error.mean(), error.max()])
+
+    return pd.DataFrame(rows, columns=['dpi', 'mode', 'workers', 'images', 'megapixels', 'seconds', 'mpx_per_s',
+                                       'peak_rss_mib', 'mean_error', 'max_error'])
+
+
+def regressions(results: DataFrame, baseline: DataFrame, tolerance: float = 0.1,
+                accuracy_tolerance: float = 0.005) -> DataFrame:
+    """
+    Compare a benchmark with an earlier one.
+
+    @param results: as returned by run_benchmark
+    @param baseline: an earlier result of run_benchmark, e.g. read back from CSV
+    @param tolerance: allowed relative loss of throughput and gain of peak memory, which vary from run to run
+    @param accuracy_tolerance: allowed absolute gain of the mean relative error, which the seeded scans make
+        reproducible; def: half a percentage point
+    @return the cases that got slower, larger or less accurate, with their baseline values suffixed _baseline
+    """
+    keys = ['dpi', 'mode', 'workers']
+    both = results.merge(baseline, on=keys, suffixes=('', '_baseline'))
+    worse = ((both['mpx_per_s'] < both['mpx_per_s_baseline'] * (1 - tolerance)) |
+             (both['peak_rss_mib'] > both['peak_rss_mib_baseline'] * (1 + tolerance)) |
+             (both['mean_error'] > both['mean_error_baseline'] + accuracy_tolerance))
+    return both[worse]
+
+
+def startup_time(script: str, commands: Sequence[Sequence[str]] = (('--help',), ('example',)),
+                 repeats: int = 5) -> DataFrame:
+    """
+    Time the command line from the start of a fresh interpreter to its exit.
+
+    The R functions start a new interpreter for every call, so this is paid on every call from R.
+
+    @param script: path to LeafCalc.py
+    @param commands: arguments of each command to time
+    @param repeats: runs of each command; the fastest counts
+    @return pandas DF with the command and its seconds
+    """
+    rows = []
+    for arguments in commands:
+        best = np.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, script, *arguments], stdout=subprocess.DEVNULL, check=True)
+            best = min(best, time.perf_counter() - start)
+        rows.append([' '.join(arguments), best])
+    return pd.DataFrame(rows, columns=['command', 'seconds'])
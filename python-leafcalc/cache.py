@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+An on-disk cache of leaf areas, so re-runs over growing directories only process new or changed scans.
+
+Several runs may share a cache file, e.g. the shards of a cluster job, a watch and calls from R. Each result is
+committed on its own, so no run holds the file locked for longer than one write, and a cache that stays locked or
+cannot be read costs a miss or a skipped write rather than the run.
+
+Boris Bongalov, Tim C.E Paine, Sabine Both
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Optional
+
+import numpy as np
+
+
+class ResultCache:
+    """SQLite-backed store of per-image results keyed by file version and analysis settings."""
+
+    def __init__(self, path: str, max_entries: int = 100000, timeout: float = 5):
+        """
+        Open (or create) a cache file.
+        @param path: SQLite file to keep the results in. respects tilde expansion
+        @param max_entries: how many images to keep; the least recently used are evicted when the cache is closed
+        @param timeout: seconds to wait for another run to release the file before giving up on a read or write
+        """
+        if max_entries < 1:
+            raise ValueError("The cache must be able to hold at least one image.")
+        self.path = os.path.expanduser(path)
+        self.max_entries = max_entries
+        self._used = {}  # keys read since the last flush and when
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, timeout=timeout)
+        try:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT, used REAL)')
+        except sqlite3.OperationalError:
+            # locked by another run; until it is released, lookups miss and writes are skipped
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def key(img: str, **settings) -> str:
+        """
+        Build the cache key of an image.
+
+        Files are identified by absolute path, size and modification time, so an edited or replaced scan is
+        processed again.
+
+        @param img: path to the scan. respects tilde expansion
+        @param settings: analysis settings that change the result, e.g. threshold and cut_off
+        @return hex digest
+        """
+        path = os.path.abspath(os.path.expanduser(img))
+        stat = os.stat(path)
+        identity = json.dumps([path, stat.st_size, stat.st_mtime_ns, sorted(settings.items())])
+        return hashlib.sha1(identity.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Look up the result stored under a key.
+
+        @param key: as returned by key()
+        @return the stored result with lists turned back into arrays, or None if the image is not cached or the cache
+            is locked
+        """
+        try:
+            row = self.connection.execute('SELECT result FROM results WHERE key = ?', (key,)).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        if row is None:
+            return None
+        self._used[key] = time.time()
+        return {name: np.array(value) if isinstance(value, list) else value
+                for name, value in json.loads(row[0]).items()}
+
+    def put(self, key: str, result: dict):
+        """
+        Store the result of an image, unless the cache stays locked by another run.
+
+        @param key: as returned by key()
+        @param result: per-image values and per-patch arrays, e.g. areas of the retained patches in cm2 under 'Area'
+        """
+        result = {name: value.tolist() if isinstance(value, np.ndarray) else value for name, value in result.items()}
+        try:
+            with self.connection:
+                self.connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                                        (key, json.dumps(result, default=int), time.time()))
+        except sqlite3.OperationalError:
+            pass
+
+    def flush(self):
+        """Commit the access times of the results read, in a single transaction; they are dropped if it is locked."""
+        try:
+            with self.connection:
+                self.connection.executemany('UPDATE results SET used = ? WHERE key = ?',
+                                            [(used, key) for key, used in self._used.items()])
+        except sqlite3.OperationalError:
+            pass
+        self._used.clear()
+
+    def evict(self):
+        """Drop the least recently used images beyond max_entries, or leave that to a later run if it is locked."""
+        self.flush()
+        try:
+            with self.connection:
+                self.connection.execute('DELETE FROM results WHERE key NOT IN '
+                                        '(SELECT key FROM results ORDER BY used DESC LIMIT ?)', (self.max_entries,))
+        except sqlite3.OperationalError:
+            pass
+
+    def close(self):
+        """Commit, evict old entries and close the file."""
+        self.evict()
+        self.connection.close()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Client of the leaf area server started with LeafCalc.py serve.
+
+Boris Bongalov, Tim C.E Paine, Sabine Both
+"""
+
+import http.client
+import json
+import os
+import socket
+from typing import Optional
+from urllib.parse import urlencode, urlsplit
+
+import pandas as pd
+from pandas.core.frame import DataFrame
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    """HTTP over a Unix socket."""
+
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class LeafAreaClient:
+    """Send scans to a running server and get the estimates back as pandas DFs."""
+
+    def __init__(self, address: str = 'http://127.0.0.1:8765', timeout: Optional[float] = None):
+        """
+        @param address: URL of the server, or the path of its Unix socket
+        @param timeout: seconds to wait for a reply; def: None (as long as it takes, for large folders)
+        """
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if not self.address.startswith(('http://', 'https://')):
+            return _UnixConnection(os.path.expanduser(self.address), timeout=self.timeout)
+        url = urlsplit(self.address)
+        return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=self.timeout)
+
+    def _request(self, method: str, path: str, body: Optional[bytes] = None,
+                 content_type: str = 'application/json') -> dict:
+        connection = self._connection()
+        try:
+            connection.request(method, path, body=body, headers={'Content-Type': content_type})
+            response = connection.getresponse()
+            payload = json.loads(response.read() or b'{}')
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise ValueError(f"The server replied {response.status}: {payload.get('error', response.reason)}")
+        return payload
+
+    @staticmethod
+    def _frame(payload: dict) -> DataFrame:
+        output = pd.DataFrame(payload['results'])
+        output.attrs.update(cache_hits=payload.get('cache_hits', 0), cache_misses=payload.get('cache_misses', 0))
+        return output
+
+    def health(self) -> dict:
+        """
+        Check that the server is up.
+
+        @return workers, concurrency, running and waiting requests and process id of the server
+        """
+        return self._request('GET', '/health')
+
+    def estimate(self, img: str, **settings) -> DataFrame:
+        """
+        Estimate leaf area for a scan or folder that the server can read.
+
+        @param img: path to the scan or images folder on the server's machine. respects tilde expansion there
+        @param settings: per-image arguments of EstimateLeafArea, e.g. threshold, cut_off, combine or res
+        @return pandas DF as returned by EstimateLeafArea.estimate
+        """
+        body = json.dumps({'path': img, 'settings': settings}).encode()
+        return self._frame(self._request('POST', '/estimate', body))
+
+    def estimate_bytes(self, data, res: float = 0, name: Optional[str] = None, **settings) -> DataFrame:
+        """
+        Estimate leaf area for an encoded image held in memory, e.g. one from another machine.
+
+        @param data: the image file as a bytes-like object, or a binary file object to read it from
+        @param res: resolution in dpi; def: 0 (the server's res, or else the image header)
+        @param name: file name to report and to save the classified image under; def: None (do not save)
+        @param settings: per-image arguments of EstimateLeafArea
+        @return pandas DF as returned by EstimateLeafArea.estimate_bytes
+        """
+        if hasattr(data, 'read'):
+            data = data.read()
+        query = {'res': res, **settings}
+        if name is not None:
+            query['name'] = name
+        return self._frame(self._request('POST', f'/estimate_bytes?{urlencode(query)}', bytes(data),
+                                         'application/octet-stream'))
+
+    def preprocess(self, img: str, output_dir: str, **settings) -> str:
+        """
+        Preprocess a scan or folder that the server can read.
+
+        @param img: path to the image or folder of images on the server's machine
+        @param output_dir: where the server saves the preprocessed copies
+        @param settings: per-image arguments of EstimateLeafArea, e.g. crop or red_scale
+        @return output_dir as an absolute path on the server's machine
+        """
+        body = json.dumps({'path': img, 'output_dir': output_dir, 'settings': settings}).encode()
+        return self._request('POST', '/preprocess', body)['output_dir']
+
+    def shutdown(self):
+        """Stop the server once the requests in progress are answered."""
+        self._request('POST', '/shutdown')
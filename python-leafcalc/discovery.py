@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Find the scans in a folder, and record them in a manifest so that later runs need not walk the folder again.
+
+Only files with an image extension are returned; hidden entries are skipped. Walking uses os.scandir, which gets the
+entry types from the directory listing itself, so folders with many entries on network filesystems are listed without
+a stat call per entry.
+
+A manifest can also group the scans by resolution, which replaces sorting them into a folder per dpi: an estimate run
+selects a group from the manifest, and where a folder per group is needed it is made of hard links, not copies.
+
+For cluster array jobs, the images of a folder can be split into shards, the same on every node, so that each task
+processes its own part without any coordination.
+
+Boris Bongalov, Tim C.E Paine, Sabine Both
+"""
+
+import errno
+import fnmatch
+import os
+import zlib
+from multiprocessing.pool import ThreadPool
+from typing import Iterator, Optional, Tuple
+
+import pandas as pd
+from pandas.core.frame import DataFrame
+
+from .metadata import Header, read_header
+
+# extensions of the formats OpenCV reads, compared case-insensitively
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.jpe', '.png', '.tif', '.tiff', '.bmp', '.webp', '.jp2', '.pbm', '.pgm', '.ppm')
+
+MANIFEST_COLUMNS = ['path', 'size', 'mtime_ns', 'width', 'height', 'dpi']
+
+SHARD_METHODS = ('sorted', 'hash')
+
+
+def find_images(root: str, recursive: bool = False, pattern: str = '', follow_symlinks: bool = False) -> Iterator[str]:
+    """
+    List the images in a folder, in sorted order.
+
+    @param root: folder to search. respects tilde expansion
+    @param recursive: also search subfolders
+    @param pattern: shell-style pattern that the path relative to root must match, e.g. 'plot*/*.jpg'; def: '' (all)
+    @param follow_symlinks: descend into symbolically linked folders; linked files are always included. Each folder
+        is visited once, so link loops do not recurse
+    @return iterator of paths, each root joined with the path relative to it
+    """
+    root = os.path.expanduser(root)
+    visited = set()
+    folders = [root]
+    while folders:
+        folder = folders.pop()
+        try:
+            stat = os.stat(folder)
+        except OSError:
+            continue
+        if (stat.st_dev, stat.st_ino) in visited:
+            continue
+        visited.add((stat.st_dev, stat.st_ino))
+
+        try:
+            with os.scandir(folder) as listing:
+                entries = sorted(listing, key=lambda entry: entry.name)
+        except OSError:
+            continue
+        subfolders = []
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=follow_symlinks):
+                    if recursive:
+                        subfolders.append(entry.path)
+                    continue
+                # follows links; broken ones are not files
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if pattern and not fnmatch.fnmatch(os.path.relpath(entry.path, root), pattern):
+                continue
+            yield entry.path
+        # depth first, in sorted order
+        folders.extend(reversed(subfolders))
+
+
+def _manifest_row(path: str) -> Optional[list]:
+    """The manifest entry of an image, or None if it has gone."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    try:
+        header = read_header(path)
+    except (OSError, ValueError):
+        header = Header(None, None, None, None)
+    dpi = header.x_dpi if header.x_dpi == header.y_dpi else None
+    return [path, stat.st_size, stat.st_mtime_ns, header.width, header.height, dpi]
+
+
+def build_manifest(root: str, workers: int = 1, **search) -> DataFrame:
+    """
+    Record the images in a folder together with their size, modification time, dimensions and resolution.
+
+    @param root: folder to search. respects tilde expansion
+    @param workers: read this many headers at a time, on threads, which hides the latency of network filesystems;
+        def: 1
+    @param search: as for find_images
+    @return pandas DF with MANIFEST_COLUMNS; dimensions and dpi are empty where the header does not give them
+    """
+    paths = find_images(root, **search)
+    if workers > 1:
+        # only a few bytes are read per image, so threads are enough and start at once
+        with ThreadPool(workers) as pool:
+            rows = list(pool.imap(_manifest_row, paths, chunksize=64))
+    else:
+        rows = [_manifest_row(path) for path in paths]
+    return pd.DataFrame([row for row in rows if row is not None], columns=MANIFEST_COLUMNS)
+
+
+def group_by_resolution(manifest: DataFrame, group_size: int = 0) -> DataFrame:
+    """
+    Assign the images of a manifest to groups of the same resolution.
+
+    @param manifest: as returned by build_manifest
+    @param group_size: split each resolution, in manifest order, into numbered groups of at most this many images,
+        e.g. '300/1', '300/2'; def: 0 (one group per resolution)
+    @return a copy of manifest with a column 'group' named after the dpi, e.g. '300', or 'unknown' for images that
+        do not record it
+    """
+    if group_size < 0:
+        raise ValueError("group_size must not be negative.")
+    groups = manifest['dpi'].map(lambda dpi: 'unknown' if pd.isna(dpi) else f'{dpi:g}')
+    if group_size:
+        groups = groups + '/' + (groups.groupby(groups).cumcount() // group_size + 1).astype(str)
+    return manifest.assign(group=groups)
+
+
+def link_groups(manifest: DataFrame, output_dir: str) -> DataFrame:
+    """
+    Lay the groups of a manifest out as folders, e.g. output_dir/300/1/scan.jpg, for tools that expect one folder per
+    resolution. The folders hold hard links, so no image is copied; across filesystems, where hard links are not
+    possible, they hold symbolic links. Links that already point at their image are kept, so this can be rerun.
+
+    @param manifest: with groups, as returned by group_by_resolution
+    @param output_dir: where to make the group folders. respects tilde expansion
+    @return a copy of manifest with the path of each link in a column 'link'
+    """
+    if 'group' not in manifest:
+        raise ValueError("The manifest has no groups. Group it with group_by_resolution first.")
+    output_dir = os.path.expanduser(output_dir)
+    links = []
+    for path, group in zip(manifest['path'], manifest['group']):
+        folder = os.path.join(output_dir, *str(group).split('/'))
+        os.makedirs(folder, exist_ok=True)
+        link = os.path.join(folder, os.path.basename(path))
+        if os.path.lexists(link):
+            if not os.path.exists(link) or not os.path.samefile(link, path):
+                raise ValueError(f"{link} already exists and is not {path}. Images of one group need distinct names.")
+        else:
+            try:
+                os.link(path, link)
+            except OSError as error:
+                if error.errno != errno.EXDEV:
+                    raise
+                os.symlink(os.path.abspath(path), link)
+        links.append(link)
+    return manifest.assign(link=links)
+
+
+def write_manifest(manifest: DataFrame, path: str):
+    """
+    Save a manifest as CSV.
+
+    @param manifest: as returned by build_manifest
+    @param path: where to save it. respects tilde expansion
+    """
+    manifest.to_csv(os.path.expanduser(path), index=False)
+
+
+def read_manifest(path: str) -> DataFrame:
+    """
+    Load a manifest saved by write_manifest.
+
+    @param path: manifest file. respects tilde expansion
+    @return pandas DF with MANIFEST_COLUMNS, and the groups and links if it has them
+    """
+    return pd.read_csv(os.path.expanduser(path), dtype={'path': str, 'group': str, 'link': str})
+
+
+def _select(paths: list, root: str, manifest: str, recursive: bool = False, pattern: str = '', **_) -> list:
+    """
+    Keep the images of a manifest that find_images would list in a folder.
+
+    @param paths: paths of the images in the manifest
+    @param root: folder searched. respects tilde expansion
+    @param manifest: the manifest file, for the error message
+    @param recursive: keep the images in subfolders
+    @param pattern: shell-style pattern that the path relative to root must match; def: '' (all)
+    @return the selected paths, in their order in the manifest
+    @raise ValueError: if the manifest lists images but none in root, e.g. it was built for another folder
+    """
+    folder = os.path.abspath(os.path.expanduser(root))
+    selected = []
+    inside = False
+    for path in paths:
+        relative = os.path.relpath(os.path.abspath(os.path.expanduser(path)), folder)
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            continue
+        inside = True
+        if (recursive or not os.path.dirname(relative)) and (not pattern or fnmatch.fnmatch(relative, pattern)):
+            selected.append(path)
+    if paths and not inside:
+        raise ValueError(f"The manifest {manifest} lists no images in {root}. It was built for another folder; give "
+                         f"another manifest file for {root}.")
+    return selected
+
+
+def list_images(root: str, manifest: str = '', group: str = '', **search) -> list:
+    """
+    List the images in a folder, reusing a manifest if there is one.
+
+    The images of a manifest are those of root that match the search, so that a manifest of a whole collection can
+    serve any of its folders and patterns.
+
+    @param root: folder to search. respects tilde expansion
+    @param manifest: manifest file to read, or to build and write if it does not exist; def: '' (walk the folder)
+    @param group: only list the images of this group of the manifest (see group_by_resolution); a resolution, e.g.
+        '300', also selects its numbered groups '300/1', '300/2' and so on; def: '' (all)
+    @param search: as for find_images
+    @return paths of the images
+    """
+    if group:
+        if not manifest or not os.path.exists(os.path.expanduser(manifest)):
+            raise ValueError("Selecting a group requires a manifest with groups. Build one with group_by_resolution "
+                             "(the manifest command with --by_resolution).")
+        records = read_manifest(manifest)
+        if 'group' not in records:
+            raise ValueError(f"The manifest {manifest} has no groups. Build it again with group_by_resolution.")
+        selected = (records['group'] == group) | records['group'].str.startswith(group + '/')
+        found = set(_select(records['path'].tolist(), root, manifest, **search))
+        return [path for path in records.loc[selected, 'path'] if path in found]
+    if not manifest:
+        return list(find_images(root, **search))
+    if os.path.exists(os.path.expanduser(manifest)):
+        return _select(read_manifest(manifest)['path'].tolist(), root, manifest, **search)
+    records = build_manifest(root, **search)
+    write_manifest(records, manifest)
+    return records['path'].tolist()
+
+
+def parse_shard(text: str) -> Tuple[int, int]:
+    """
+    Read a shard given as i/N, e.g. from the task id of a SLURM array job run with --array=0-(N-1).
+
+    @param text: shard number i, from 0, and shard count N, as 'i/N'
+    @return (i, N)
+    """
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise ValueError(f"{text} is not a shard. Give it as i/N, e.g. 0/10.")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard {text} does not exist. i must be from 0 to N - 1.")
+    return index, count
+
+
+def shard_images(images: list, shard: str, root: str = '', method: str = 'sorted') -> list:
+    """
+    Select the images of one shard, so that N tasks given shards 0/N to N-1/N process every image exactly once.
+
+    @param images: paths of the images, in any order
+    @param shard: which shard, as 'i/N'; see parse_shard
+    @param root: folder the images were found in; paths are hashed relative to it, so that nodes that mount it at
+        different places agree
+    @param method: 'sorted' deals the sorted images out in turn, which evens out the shards; 'hash' places each image
+        by a hash of its path, so that images added later do not move the others to other shards
+    @return the paths of the images of the shard, in sorted order
+    """
+    index, count = parse_shard(shard)
+    images = sorted(images)
+    if method == 'sorted':
+        return images[index::count]
+    if method == 'hash':
+        return [image for image in images
+                if zlib.crc32(os.fsencode(os.path.relpath(image, root) if root else image)) % count == index]
+    raise ValueError(f"{method} is not a way to shard. Use one of {', '.join(SHARD_METHODS)}.")
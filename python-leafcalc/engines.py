@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Connected-component area engines.
+
+An engine takes a binary (0/255) uint8 image and the speck cut off and returns the pixel counts of the leaf patches
+that survive the cut off. Patches are ordered by the raster position of their first pixel, so all engines return the
+same areas in the same order.
+
+Boris Bongalov, Tim C.E Paine, Sabine Both
+"""
+
+from typing import Iterable, Tuple
+
+import cv2
+import numpy as np
+
+
+def _first_pixels(labels: np.ndarray, stats: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """
+    Find the raster position of the first pixel of each component.
+
+    Only the requested components are visited, which keeps the loop short even on scans with many specks.
+
+    @param labels: int32 label image
+    @param stats: component statistics as returned by cv2.connectedComponentsWithStats
+    @param ids: labels to look up
+    @return flat index of the first pixel of each label in ids
+    """
+    first = np.empty(len(ids), dtype=np.int64)
+    for i, label in enumerate(ids):
+        top = stats[label, cv2.CC_STAT_TOP]
+        left = stats[label, cv2.CC_STAT_LEFT]
+        row = labels[top, left:left + stats[label, cv2.CC_STAT_WIDTH]]
+        first[i] = top * labels.shape[1] + left + np.argmax(row == label)
+    return first
+
+
+def _raster_order(labels: np.ndarray, stats: np.ndarray, keep: np.ndarray) -> np.ndarray:
+    """
+    Sort component labels by the raster position of their first pixel.
+
+    OpenCV does not number components in scan order, skimage does.
+
+    @param labels: int32 label image
+    @param stats: component statistics as returned by cv2.connectedComponentsWithStats
+    @param keep: labels to sort
+    @return the labels in keep, sorted
+    """
+    return keep[np.argsort(_first_pixels(labels, stats, keep), kind='stable')]
+
+
+def _opencv_components(binary: np.ndarray, cut_off: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Label patches with a single cv2.connectedComponentsWithStats pass over a compact int32 label buffer.
+
+    @param binary: thresholded image, leaf pixels are non-zero
+    @param cut_off: patches below this number of pixels will not be counted
+    @return label image, component statistics and the retained labels in raster order
+    """
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8, ltype=cv2.CV_32S)
+
+    # background is labeled as 0
+    keep = np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] >= cut_off) + 1
+    return labels, stats, _raster_order(labels, stats, keep)
+
+
+def opencv_areas(binary: np.ndarray, cut_off: int) -> np.ndarray:
+    """
+    Count patch pixels with OpenCV's connected components.
+
+    @param binary: thresholded image, leaf pixels are non-zero
+    @param cut_off: patches below this number of pixels will not be counted
+    @return pixel counts of the retained patches
+    """
+    _, stats, keep = _opencv_components(binary, cut_off)
+    return stats[keep, cv2.CC_STAT_AREA].astype(np.int64)
+
+
+def opencv_labels(binary: np.ndarray, cut_off: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Label patches with OpenCV's connected components and number the retained ones.
+
+    @param binary: thresholded image, leaf pixels are non-zero
+    @param cut_off: patches below this number of pixels will not be counted
+    @return statistics of the retained patches (rows of cv2.CC_STAT_* values, in the order of opencv_areas), and an
+        int32 label image in which they are numbered 1, 2, ... in the same order while background and specks are 0
+    """
+    labels, stats, keep = _opencv_components(binary, cut_off)
+    lookup = np.zeros(len(stats), dtype=np.int32)
+    lookup[keep] = np.arange(1, len(keep) + 1)
+    return stats[keep], lookup[labels]
+
+
+def skimage_areas(binary: np.ndarray, cut_off: int) -> np.ndarray:
+    """
+    Count patch pixels with skimage.measure.label and np.unique.
+
+    This is the original implementation. It sorts every pixel of the scan and needs an int64 label image, so it is
+    much slower than opencv_areas; it is kept as a reference.
+
+    @param binary: thresholded image, leaf pixels are non-zero
+    @param cut_off: patches below this number of pixels will not be counted
+    @return pixel counts of the retained patches
+    """
+    from skimage import measure
+
+    # label leaflets and count number of pixels in each label
+    labels, counts = np.unique(measure.label(binary, background=0), return_counts=True)
+
+    # remove small patches and background pixels
+    mask = (counts >= cut_off) & (labels != 0)
+    return counts[mask]
+
+
+def _find(parent: np.ndarray, i: int) -> int:
+    """Find the root of i, compressing the path on the way."""
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    while parent[i] != root:
+        parent[i], i = root, parent[i]
+    return root
+
+
+def strip_areas(strips: Iterable[np.ndarray], cut_off: int) -> np.ndarray:
+    """
+    Count patch pixels of a scan that is labeled one horizontal strip at a time.
+
+    Each strip is labeled on its own and patches that touch across a strip boundary are merged with union-find, so only
+    one strip's int32 label buffer is held in memory at a time. The result is identical to opencv_areas on the whole
+    scan.
+
+    @param strips: consecutive thresholded strips of the scan, top to bottom, all of the same width
+    @param cut_off: patches below this number of pixels will not be counted
+    @return pixel counts of the retained patches
+    """
+    parent = np.empty(0, dtype=np.int64)  # union-find forest over the patches of all strips
+    areas = []  # pixel count of each strip patch
+    first = {}  # raster position of the first pixel, only for patches that can be retained
+    previous = None  # patch ids of the last row of the previous strip, -1 for background
+    offset = 0  # patch id of label 1 of the current strip
+    row0 = 0  # first row of the current strip in the scan
+
+    for strip in strips:
+        n, labels, stats, _ = cv2.connectedComponentsWithStats(strip, connectivity=8, ltype=cv2.CV_32S)
+        height, width = labels.shape
+        parent = np.concatenate([parent, np.arange(offset, offset + n - 1, dtype=np.int64)])
+        areas.append(stats[1:, cv2.CC_STAT_AREA].astype(np.int64))
+
+        # only patches above the cut off or touching a strip boundary can end up in a retained patch
+        top = stats[1:, cv2.CC_STAT_TOP]
+        bottom = top + stats[1:, cv2.CC_STAT_HEIGHT]
+        candidates = np.flatnonzero((stats[1:, cv2.CC_STAT_AREA] >= cut_off) | (top == 0) | (bottom == height)) + 1
+        for label, pixel in zip(candidates, _first_pixels(labels, stats, candidates)):
+            first[offset + label - 1] = row0 * width + pixel
+
+        # merge patches that are 8-connected across the boundary with the previous strip
+        current = labels[0].astype(np.int64) + offset - 1
+        if previous is not None:
+            for shift in (-1, 0, 1):
+                above = previous[max(0, -shift):width - max(0, shift)]
+                below = current[max(0, shift):width - max(0, -shift)]
+                touching = (above >= 0) & (below >= offset)
+                for a, b in np.unique(np.stack([above[touching], below[touching]], axis=1), axis=0):
+                    a, b = _find(parent, a), _find(parent, b)
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)
+
+        previous = labels[-1].astype(np.int64) + offset - 1
+        previous[labels[-1] == 0] = -1
+        offset += n - 1
+        row0 += height
+
+    if not offset:
+        return np.empty(0, dtype=np.int64)
+
+    # resolve every patch to its root and add up the pixels
+    roots = parent
+    while True:
+        jumped = roots[roots]
+        if np.array_equal(jumped, roots):
+            break
+        roots = jumped
+    totals = np.bincount(roots, weights=np.concatenate(areas)).astype(np.int64)
+
+    # retain large patches in the order of their first pixel
+    keep = np.flatnonzero((totals >= cut_off) & (np.arange(len(totals)) == roots[:len(totals)]))
+    order = np.full(len(totals), np.iinfo(np.int64).max, dtype=np.int64)
+    for patch, pixel in first.items():
+        root = roots[patch]
+        order[root] = min(order[root], pixel)
+    keep = keep[np.argsort(order[keep], kind='stable')]
+    return totals[keep]
+
+
+def sweep_areas(gray: np.ndarray, thresholds: Iterable[int], cut_off: int) -> dict:
+    """
+    Count patch pixels of a grayscale scan for a range of thresholds, sharing work between thresholds.
+
+    Leaf pixels at threshold t are a subset of those at any higher threshold, so every patch at t lies inside a single
+    patch at the next higher threshold. Thresholds are visited from high to low and each one only relabels the inside
+    of the patches retained at the previous one; patches below the cut off are dropped for good, as their parts can only
+    be smaller. Each threshold therefore touches the retained leaves only, not the whole scan.
+
+    @param gray: grayscale scan
+    @param thresholds: values between 0 and 255; pixels at or below a threshold are leaf
+    @param cut_off: patches below this number of pixels will not be counted
+    @return dict mapping each threshold to the pixel counts of its retained patches, in raster order
+    """
+    width = gray.shape[1]
+    regions = [(0, 0, gray, None)]  # top, left, grayscale crop and mask of a patch retained at the previous threshold
+    counts = {}
+    for threshold in sorted(set(thresholds), reverse=True):
+        found = []  # (first pixel in the scan, area) of the retained patches
+        retained = []
+        for top, left, crop, mask in regions:
+            binary = cv2.threshold(crop, threshold, 255, cv2.THRESH_BINARY_INV)[1]
+            if mask is not None:
+                binary = cv2.bitwise_and(binary, mask)
+            _, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8, ltype=cv2.CV_32S)
+            keep = np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] >= cut_off) + 1
+            for label, first in zip(keep, _first_pixels(labels, stats, keep)):
+                row, column = divmod(int(first), crop.shape[1])
+                found.append(((top + row) * width + left + column, int(stats[label, cv2.CC_STAT_AREA])))
+                x, y, w, h = stats[label, :4]
+                retained.append((top + y, left + x, crop[y:y + h, x:x + w],
+                                 (labels[y:y + h, x:x + w] == label).astype(np.uint8) * 255))
+        found.sort()
+        counts[threshold] = np.array([area for _, area in found], dtype=np.int64)
+        regions = retained
+    return counts
+
+
+def otsu_threshold(histogram: np.ndarray) -> int:
+    """
+    Choose the threshold that maximises the between-class variance of a grayscale histogram (Otsu, 1979).
+
+    @param histogram: pixel counts of the 256 gray levels
+    @return pixels at or below the threshold are leaf
+    """
+    p = histogram / histogram.sum()
+    omega = np.cumsum(p)  # share of pixels at or below each level
+    mu = np.cumsum(p * np.arange(256))  # their first moment
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma = (mu[-1] * omega - mu) ** 2 / (omega * (1 - omega))
+    return int(np.argmax(np.nan_to_num(sigma, nan=0, posinf=0)))
+
+
+AUTO_THRESHOLDS = {
+    'otsu': otsu_threshold,
+}
+
+AREA_ENGINES = {
+    'opencv': opencv_areas,
+    'skimage': skimage_areas,
+}
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Write and read the classified scans saved to output_dir.
+
+A thresholded scan is a binary mask, so re-encoding it as a full-size 8-bit JPEG is slow, lossy and large. The formats
+here are lossless and compact:
+    same: the original behaviour; the mask is encoded in the format of the input file name (usually JPEG)
+    png: 1-bit PNG
+    tiff: 1-bit TIFF with CCITT Group 4 compression; requires Pillow
+    rle: run lengths of the flattened mask in a NumPy .npz file
+    labels: TIFF label image in which the retained patches are numbered 1, 2, ... in the order of the result rows
+
+Boris Bongalov, Tim C.E Paine, Sabine Both
+"""
+
+import io
+import os
+
+import cv2
+import numpy as np
+
+MASK_EXTENSIONS = {'same': None, 'png': '.png', 'tiff': '.tif', 'rle': '.npz', 'labels': '.tif'}
+
+
+def relative_name(img: str, root: str = '') -> str:
+    """
+    Name an output after its scan, keeping the subfolders of a folder searched recursively.
+
+    @param img: path to the scan
+    @param root: folder that was searched; def: '' (none)
+    @return the path of img relative to root, or its base name if there is no root or img is outside it
+    """
+    if root:
+        name = os.path.relpath(os.path.abspath(os.path.expanduser(img)), os.path.abspath(os.path.expanduser(root)))
+        if name != os.pardir and not name.startswith(os.pardir + os.sep):
+            return name
+    return os.path.basename(img)
+
+
+def mask_path(output_dir: str, img: str, mask_format: str, root: str = '') -> str:
+    """
+    Name the mask of a scan.
+
+    @param output_dir: where masks are saved. respects tilde expansion
+    @param img: path to the scan
+    @param mask_format: one of MASK_EXTENSIONS
+    @param root: folder that was searched for the scan, whose subfolders are kept (see relative_name); def: ''
+    @return path of the mask file
+    """
+    name = relative_name(img, root)
+    if MASK_EXTENSIONS[mask_format]:
+        name = os.path.splitext(name)[0] + MASK_EXTENSIONS[mask_format]
+    return os.path.join(os.path.expanduser(output_dir), name)
+
+
+def rle_encode(mask: np.ndarray) -> dict:
+    """
+    Run-length encode a binary mask in raster order.
+
+    @param mask: binary image, leaf pixels are non-zero
+    @return shape of the mask, value of the first run (0 or 1) and the length of each run
+    """
+    flat = mask.ravel() != 0
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate([[0], changes, [flat.size]])
+    return {'shape': np.array(mask.shape), 'first': np.uint8(flat[0]) if flat.size else np.uint8(0),
+            'runs': np.diff(bounds).astype(np.uint32)}
+
+
+def rle_decode(shape: np.ndarray, first: int, runs: np.ndarray) -> np.ndarray:
+    """
+    Rebuild a binary mask from its run lengths.
+
+    @return uint8 mask with leaf pixels set to 255
+    """
+    values = (np.arange(len(runs)) + int(first)) % 2 * 255
+    return np.repeat(values.astype(np.uint8), runs).reshape(shape)
+
+
+def encode_mask(name: str, mask: np.ndarray, mask_format: str, thumbnail: int = 1) -> bytes:
+    """
+    Encode a mask as write_mask saves it, e.g. to store it in an archive.
+
+    @param name: file name of the mask, see mask_path; for the same format, its extension chooses the encoding
+    @param mask: thresholded scan, or a label image for the labels format
+    @param mask_format: one of MASK_EXTENSIONS
+    @param thumbnail: encode at 1/thumbnail of the size, e.g. for quality checks; def: 1 (full size)
+    @return the contents of the mask file
+    """
+    if mask_format not in MASK_EXTENSIONS:
+        raise ValueError(f"Unknown mask format {mask_format}. Choose one of: {', '.join(MASK_EXTENSIONS)}.")
+    if thumbnail < 1:
+        raise ValueError("The thumbnail factor must be a positive integer.")
+    if thumbnail > 1:
+        size = (max(1, mask.shape[1] // thumbnail), max(1, mask.shape[0] // thumbnail))
+        if mask_format == 'labels':
+            mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+        else:
+            mask = cv2.resize(mask, size, interpolation=cv2.INTER_AREA)
+            if mask_format != 'same':
+                mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)[1]
+
+    if mask_format == 'same':
+        return cv2.imencode(os.path.splitext(name)[1], mask)[1].tobytes()
+    elif mask_format == 'png':
+        return cv2.imencode('.png', mask, [cv2.IMWRITE_PNG_BILEVEL, 1])[1].tobytes()
+    elif mask_format == 'tiff':
+        try:
+            from PIL import Image
+        except ImportError:
+            raise ImportError("1-bit TIFF masks require Pillow. Install it with: pip3 install pillow")
+        stream = io.BytesIO()
+        Image.fromarray(mask != 0).save(stream, format='TIFF', compression='group4')
+        return stream.getvalue()
+    elif mask_format == 'rle':
+        stream = io.BytesIO()
+        np.savez(stream, **rle_encode(mask))
+        return stream.getvalue()
+    else:
+        labels = mask.astype(np.uint16) if mask.max(initial=0) < 2 ** 16 else mask.astype(np.int32)
+        return cv2.imencode('.tif', labels)[1].tobytes()
+
+
+def write_mask(path: str, mask: np.ndarray, mask_format: str, thumbnail: int = 1):
+    """
+    Save a mask.
+
+    @param path: where to write it, see mask_path
+    @param mask: thresholded scan, or a label image for the labels format
+    @param mask_format: one of MASK_EXTENSIONS
+    @param thumbnail: save at 1/thumbnail of the size, e.g. for quality checks; def: 1 (full size)
+    """
+    data = encode_mask(path, mask, mask_format, thumbnail)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'wb') as stream:
+        stream.write(data)
+
+
+def read_mask(path: str) -> np.ndarray:
+    """
+    Load a mask saved by write_mask.
+
+    @param path: mask file. respects tilde expansion
+    @return binary mask (0/255) or label image
+    """
+    path = os.path.expanduser(path)
+    if path.endswith('.npz'):
+        with np.load(path) as rle:
+            return rle_decode(rle['shape'], rle['first'], rle['runs'])
+    return cv2.imread(path, cv2.IMREAD_UNCHANGED)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Read image size and resolution from file headers without decoding the image.
+
+Only the few bytes that hold the JFIF density, the EXIF IFD0 / TIFF XResolution and YResolution tags or the PNG pHYs
+chunk are read, so looking up the resolution of a multi-megabyte scan takes microseconds.
+
+Boris Bongalov, Tim C.E Paine, Sabine Both
+"""
+
+import functools
+import io
+import os
+import struct
+from collections import namedtuple
+from typing import BinaryIO, Optional, Union
+
+Header = namedtuple('Header', ['width', 'height', 'x_dpi', 'y_dpi'])
+Header.__doc__ = "Image dimensions in pixels and resolution in dots per inch; fields are None when unknown."
+
+_TIFF_WIDTH, _TIFF_HEIGHT = 256, 257
+_TIFF_X_RESOLUTION, _TIFF_Y_RESOLUTION, _TIFF_RESOLUTION_UNIT = 282, 283, 296
+_TIFF_TYPES = {3: ('H', 2), 4: ('I', 4), 5: ('II', 8)}  # SHORT, LONG, RATIONAL
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _tiff_header(stream: BinaryIO, base: int = 0) -> Header:
+    """
+    Parse the first IFD of a TIFF structure, as found in TIFF files and EXIF segments.
+
+    @param stream: seekable file containing the TIFF structure
+    @param base: position of the TIFF byte order mark in stream; offsets are relative to it
+    @return image header
+    """
+    stream.seek(base)
+    mark = stream.read(8)
+    if mark[:2] == b'II':
+        order = '<'
+    elif mark[:2] == b'MM':
+        order = '>'
+    else:
+        return Header(None, None, None, None)
+    stream.seek(base + struct.unpack_from(order + 'I', mark, 4)[0])
+    count = struct.unpack(order + 'H', stream.read(2))[0]
+    entries = stream.read(12 * count)
+
+    tags = {}
+    for entry in range(0, 12 * count, 12):
+        tag, kind, n = struct.unpack_from(order + 'HHI', entries, entry)
+        if kind not in _TIFF_TYPES or n != 1:
+            continue
+        fmt, size = _TIFF_TYPES[kind]
+        if size <= 4:
+            value = struct.unpack_from(order + fmt, entries, entry + 8)
+        else:
+            stream.seek(base + struct.unpack_from(order + 'I', entries, entry + 8)[0])
+            value = struct.unpack(order + fmt, stream.read(size))
+        tags[tag] = value[0] / value[1] if kind == 5 and value[1] else value[0]
+
+    # resolution unit: 1 = none, 2 = inch (default), 3 = cm
+    unit = {2: 1, 3: 2.54}.get(tags.get(_TIFF_RESOLUTION_UNIT, 2))
+    x_dpi = tags.get(_TIFF_X_RESOLUTION)
+    y_dpi = tags.get(_TIFF_Y_RESOLUTION)
+    if unit is None or not x_dpi or not y_dpi:
+        x_dpi = y_dpi = None
+    else:
+        x_dpi, y_dpi = x_dpi * unit, y_dpi * unit
+    return Header(tags.get(_TIFF_WIDTH), tags.get(_TIFF_HEIGHT), x_dpi, y_dpi)
+
+
+def _jpeg_header(stream: BinaryIO) -> Header:
+    """
+    Walk the JPEG markers up to the start of scan, reading only the APP0, APP1 and SOF segments.
+
+    EXIF resolution takes precedence over JFIF density, as it is what scanners write.
+
+    @param stream: file positioned just after the SOI marker
+    @return image header
+    """
+    width = height = None
+    exif = jfif = (None, None)
+    while True:
+        marker = stream.read(4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            break
+        kind = marker[1]
+        length = struct.unpack('>H', marker[2:])[0] - 2
+        if kind == 0xDA:  # start of scan, no more headers
+            break
+        if kind == 0xE0 or kind == 0xE1 or kind in _JPEG_SOF:
+            segment = stream.read(length)
+            if kind == 0xE0 and segment[:5] == b'JFIF\x00' and len(segment) >= 12:
+                units, x_density, y_density = struct.unpack_from('>BHH', segment, 7)
+                # density units: 0 = aspect ratio only, 1 = dots per inch, 2 = dots per cm
+                if units in (1, 2) and x_density and y_density:
+                    scale = 2.54 if units == 2 else 1
+                    jfif = (x_density * scale, y_density * scale)
+            elif kind == 0xE1 and segment[:6] == b'Exif\x00\x00':
+                try:
+                    tiff = _tiff_header(io.BytesIO(segment), 6)
+                    exif = (tiff.x_dpi, tiff.y_dpi)
+                except struct.error:
+                    pass
+            elif kind in _JPEG_SOF:
+                height, width = struct.unpack_from('>HH', segment, 1)
+        else:
+            stream.seek(length, os.SEEK_CUR)
+    x_dpi, y_dpi = exif if exif[0] else jfif
+    return Header(width, height, x_dpi, y_dpi)
+
+
+def _png_header(stream: BinaryIO) -> Header:
+    """
+    Read the IHDR and pHYs chunks of a PNG file, skipping everything else.
+
+    @param stream: file positioned just after the PNG signature
+    @return image header
+    """
+    width = height = x_dpi = y_dpi = None
+    while True:
+        chunk = stream.read(8)
+        if len(chunk) < 8:
+            break
+        length, kind = struct.unpack('>I4s', chunk)
+        if kind == b'IDAT' or kind == b'IEND':
+            break
+        if kind == b'IHDR':
+            width, height = struct.unpack('>II', stream.read(8))
+            stream.seek(length - 8 + 4, os.SEEK_CUR)
+        elif kind == b'pHYs':
+            x_ppu, y_ppu, unit = struct.unpack('>IIB', stream.read(9))
+            if unit == 1 and x_ppu and y_ppu:  # pixels per metre, rounded when written; undo that for whole dpi
+                x_dpi, y_dpi = round(x_ppu * 0.0254, 1), round(y_ppu * 0.0254, 1)
+            stream.seek(length - 9 + 4, os.SEEK_CUR)
+        else:
+            stream.seek(length + 4, os.SEEK_CUR)  # chunk data and CRC
+    return Header(width, height, x_dpi, y_dpi)
+
+
+def read_header(source: Union[str, BinaryIO]) -> Header:
+    """
+    Read the dimensions and resolution of a JPEG, TIFF or PNG image from its header.
+
+    @param source: path to the image (respects tilde expansion) or a binary file object positioned at its start
+    @return image header; fields are None for unsupported formats or missing tags
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(os.path.expanduser(source), 'rb') as stream:
+            return read_header(stream)
+
+    signature = source.read(8)
+    try:
+        if signature[:2] == b'\xff\xd8':
+            source.seek(-6, os.SEEK_CUR)
+            return _jpeg_header(source)
+        if signature == b'\x89PNG\r\n\x1a\n':
+            return _png_header(source)
+        if signature[:4] in (b'II*\x00', b'MM\x00*'):
+            return _tiff_header(source, source.tell() - 8)
+    except struct.error:
+        pass
+    return Header(None, None, None, None)
+
+
+@functools.lru_cache(maxsize=4096)
+def _cached_header(path: str, size: int, mtime: int) -> Header:
+    """Read a header once per file version; size and mtime are part of the cache key."""
+    return read_header(path)
+
+
+def cached_header(path: str) -> Header:
+    """
+    Read the header of an image file, caching the result until the file changes.
+
+    @param path: path to the image, respects tilde expansion
+    @return image header
+    """
+    path = os.path.expanduser(path)
+    stat = os.stat(path)
+    return _cached_header(path, stat.st_size, stat.st_mtime_ns)
+
+
+def read_resolution(source: Union[str, BinaryIO]) -> Optional[float]:
+    """
+    Read the resolution of an image in dots per inch.
+
+    @param source: path to the image (respects tilde expansion) or a binary file object positioned at its start
+    @return the resolution, or None if the image does not record it
+    @raise ValueError: if the horizontal and vertical resolutions differ
+    """
+    header = cached_header(source) if isinstance(source, (str, os.PathLike)) else read_header(source)
+    if not header.x_dpi:
+        return None
+    if header.x_dpi != header.y_dpi:
+        raise ValueError("X and Y resolutions differ in Image. This is unusual, and may indicate a problem.")
+    return header.x_dpi
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Per-patch shape measurements from a label image.
+
+Everything is computed with whole-image reductions (np.bincount over the label buffer) rather than one object per
+region, so the cost is a few passes over the scan no matter how many patches it holds. Patches are identified by their
+label, which is also the number they carry in the label image saved with mask_format='labels'.
+
+Boris Bongalov, Tim C.E Paine, Sabine Both
+"""
+
+import cv2
+import numpy as np
+
+# measurements in pixels of the decoded scan, and those that are converted to cm (lengths) or cm2 (areas)
+PIXEL_COLUMNS = ['label', 'left', 'top', 'bbox_width', 'bbox_height', 'centroid_x', 'centroid_y']
+LENGTH_COLUMNS = ['perimeter', 'length', 'width']
+AREA_COLUMNS = ['hole_area']
+MORPHOLOGY_COLUMNS = PIXEL_COLUMNS + LENGTH_COLUMNS + AREA_COLUMNS
+
+
+def _hole_areas(labels: np.ndarray, count: int) -> np.ndarray:
+    """
+    Count the pixels of the background enclosed by each patch.
+
+    Background is labeled with 4-connectivity, the dual of the 8-connectivity of the patches, and regions that do not
+    touch the edge of the scan are holes. The pixel above the top row of a hole always belongs to the patch enclosing
+    it, which assigns the holes to patches without visiting them one by one.
+
+    @param labels: int32 label image, patches numbered 1 to count
+    @param count: number of patches
+    @return number of hole pixels of each patch
+    """
+    background = (labels == 0).view(np.uint8)
+    holes, hole_labels, stats, _ = cv2.connectedComponentsWithStats(background, connectivity=4, ltype=cv2.CV_32S)
+    left, top = stats[:, cv2.CC_STAT_LEFT], stats[:, cv2.CC_STAT_TOP]
+    enclosed = ((left > 0) & (top > 0) & (left + stats[:, cv2.CC_STAT_WIDTH] < labels.shape[1]) &
+                (top + stats[:, cv2.CC_STAT_HEIGHT] < labels.shape[0]))
+    enclosed[0] = False  # the patches themselves
+
+    # find the patch directly above the top row of each hole
+    owner = np.zeros(holes, dtype=np.int64)
+    rows, cols = np.nonzero((hole_labels[1:] > 0) & (labels[:-1] > 0))
+    below = hole_labels[rows + 1, cols]
+    first = rows + 1 == top[below]
+    owner[below[first]] = labels[rows[first], cols[first]]
+
+    return np.bincount(owner[enclosed], weights=stats[enclosed, cv2.CC_STAT_AREA], minlength=count + 1)[1:]
+
+
+def patch_morphology(labels: np.ndarray, stats: np.ndarray) -> dict:
+    """
+    Measure the shape of each patch in a label image.
+
+    @param labels: int32 label image, background 0 and patches numbered 1, 2, ..., as returned by engines.opencv_labels
+    @param stats: statistics of the patches in label order, as returned by engines.opencv_labels
+    @return dict of arrays in label order:
+        label: the patch's number in the label image
+        left, top, bbox_width, bbox_height: bounding box, in pixels
+        centroid_x, centroid_y: centre of mass, in pixels
+        perimeter: length of the pixel edges between the patch and everything else, in pixels
+        length, width: major and minor axes of the ellipse with the same second moments, in pixels
+        hole_area: background pixels enclosed by the patch
+    """
+    count = len(stats)
+    size = count + 1
+    pixels = np.concatenate([[1], np.maximum(stats[:, cv2.CC_STAT_AREA], 1)])
+
+    # centroids and central second moments
+    flat = np.flatnonzero(labels)
+    rows, cols = np.divmod(flat, labels.shape[1])
+    ids = labels.ravel()[flat]
+    x = np.bincount(ids, weights=cols, minlength=size) / pixels
+    y = np.bincount(ids, weights=rows, minlength=size) / pixels
+    dx = cols - x[ids]
+    dy = rows - y[ids]
+    xx = np.bincount(ids, weights=dx * dx, minlength=size) / pixels
+    yy = np.bincount(ids, weights=dy * dy, minlength=size) / pixels
+    xy = np.bincount(ids, weights=dx * dy, minlength=size) / pixels
+    spread = np.sqrt(((xx - yy) / 2) ** 2 + xy ** 2)
+    major = (xx + yy) / 2 + spread
+    minor = np.maximum((xx + yy) / 2 - spread, 0)
+
+    # perimeter: label changes between neighbouring pixels, plus patch pixels on the edge of the scan
+    edges = np.zeros(size, dtype=np.int64)
+    for first, second in ((labels[:, :-1], labels[:, 1:]), (labels[:-1], labels[1:])):
+        change = first != second
+        edges += np.bincount(first[change], minlength=size) + np.bincount(second[change], minlength=size)
+    for border in (labels[0], labels[-1], labels[:, 0], labels[:, -1]):
+        edges += np.bincount(border, minlength=size)
+
+    return {'label': np.arange(1, size),
+            'left': stats[:, cv2.CC_STAT_LEFT], 'top': stats[:, cv2.CC_STAT_TOP],
+            'bbox_width': stats[:, cv2.CC_STAT_WIDTH], 'bbox_height': stats[:, cv2.CC_STAT_HEIGHT],
+            'centroid_x': x[1:], 'centroid_y': y[1:],
+            'perimeter': edges[1:],
+            'length': 4 * np.sqrt(major[1:]), 'width': 4 * np.sqrt(minor[1:]),
+            'hole_area': _hole_areas(labels, count)}
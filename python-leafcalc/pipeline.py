@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+A staged read -> compute -> write pipeline on threads.
+
+OpenCV releases the GIL while it decodes, thresholds, labels and encodes, so threads can keep the disk busy reading
+the next scans and writing the previous masks while other threads process the current ones.
+
+Boris Bongalov, Tim C.E Paine, Sabine Both
+"""
+
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+
+class Pipeline:
+    """Run the stages of a batch on pools of threads connected by bounded queues."""
+
+    def __init__(self, read: Callable, compute: Callable, write: Optional[Callable] = None,
+                 readers: int = 2, computers: int = 2, writers: int = 1, queue_size: int = 8):
+        """
+        Set up the stages.
+        @param read: read(item) -> data; typically disk access and decoding
+        @param compute: compute(*data) -> (result, payload); payload is handed to write unless it is None
+        @param write: write(item, payload); typically encoding and disk access. None to skip the stage
+        @param readers: number of reader threads
+        @param computers: number of compute threads
+        @param writers: number of writer threads
+        @param queue_size: capacity of each queue between stages; a full queue holds back the stage feeding it
+        """
+        if min(readers, computers, writers) < 1 or queue_size < 1:
+            raise ValueError("Each stage needs at least one thread and each queue room for at least one item.")
+        self.read = read
+        self.compute = compute
+        self.write = write
+        self.threads = {'read': readers, 'compute': computers, 'write': writers if write else 0}
+        self.queue_size = queue_size
+        self.queues = {}
+        self.peaks = {}
+
+    def depths(self) -> dict:
+        """
+        Report how many items wait in front of each stage, to see which stage holds the batch back.
+
+        @return current queue depths by stage; 'done' counts results not yet collected
+        """
+        return {stage: waiting.qsize() for stage, waiting in self.queues.items()}
+
+    def _put(self, stage: str, item, stop: threading.Event):
+        """Put an item in front of a stage, waiting for room unless the pipeline is stopped."""
+        while not stop.is_set():
+            try:
+                self.queues[stage].put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            self.peaks[stage] = max(self.peaks[stage], self.queues[stage].qsize())
+            return
+
+    def _get(self, stage: str, stop: threading.Event):
+        """Take the next item in front of a stage; None once the pipeline is stopped."""
+        while not stop.is_set():
+            try:
+                return self.queues[stage].get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _worker(self, stage: str, stop: threading.Event):
+        """Run one thread of a stage until the pipeline is stopped."""
+        while True:
+            task = self._get(stage, stop)
+            if task is None:
+                return
+            item, data = task
+            try:
+                if stage == 'read':
+                    self._put('compute', (item, self.read(item)), stop)
+                elif stage == 'compute':
+                    result, payload = self.compute(*data)
+                    if self.write is None or payload is None:
+                        self._put('done', (item, result, None), stop)
+                    else:
+                        self._put('write', (item, (result, payload)), stop)
+                else:
+                    result, payload = data
+                    self.write(item, payload)
+                    self._put('done', (item, result, None), stop)
+            except Exception as error:
+                self._put('done', (item, None, error), stop)
+
+    def run(self, items: Iterable) -> Iterator[Tuple[object, object, Optional[Exception]]]:
+        """
+        Push items through the stages, yielding them as they leave the pipeline.
+
+        @param items: what to process, e.g. paths to scans
+        @return iterator of (item, result, error); error is the exception raised by a stage, or None
+        """
+        items = list(items)
+        stop = threading.Event()
+        self.queues = {stage: queue.Queue(self.queue_size) for stage in ('read', 'compute', 'write', 'done')}
+        self.peaks = {stage: 0 for stage in self.queues}
+        threads = [threading.Thread(target=self._worker, args=(stage, stop), daemon=True)
+                   for stage, count in self.threads.items() for _ in range(count)]
+
+        def feed():
+            for item in items:
+                self._put('read', (item, None), stop)
+        threads.append(threading.Thread(target=feed, daemon=True))
+
+        for thread in threads:
+            thread.start()
+        try:
+            for _ in items:
+                yield self._get('done', stop)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
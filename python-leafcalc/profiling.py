@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Per-stage timers and peak memory of each image, to find out what limits a batch.
+
+Stages:
+    metadata: reading the resolution from the file header
+    decode: reading the file and decoding it to grayscale
+    grayscale: converting and reducing arrays passed to estimate_array / estimate_batch
+    threshold: choosing the threshold and classifying leaf and background
+    label: connected components (including thresholding in strip mode)
+    count: per-patch measurements and conversion to cm
+    write: saving the classified scan
+
+Boris Bongalov, Tim C.E Paine, Sabine Both
+"""
+
+import contextlib
+import json
+import sys
+import time
+from typing import Optional
+
+from pandas.core.frame import DataFrame
+
+STAGES = ('metadata', 'decode', 'grayscale', 'threshold', 'label', 'count', 'write')
+PROFILE_COLUMNS = [f'time_{stage}' for stage in STAGES] + ['peak_rss']
+
+
+def new_profile() -> dict:
+    """
+    Start the profile of an image.
+
+    @return seconds spent in each stage, all 0, and peak_rss, None until measured
+    """
+    return {**dict.fromkeys((f'time_{stage}' for stage in STAGES), 0.0), 'peak_rss': None}
+
+
+@contextlib.contextmanager
+def timed(profile: Optional[dict], stage: str):
+    """
+    Add the time spent in a block to a stage of a profile.
+
+    @param profile: as returned by new_profile, or None when not profiling
+    @param stage: one of STAGES
+    """
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile[f'time_{stage}'] += time.perf_counter() - start
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the peak resident memory of this process, so that the next reading covers a single image.
+
+    Only Linux supports this; elsewhere the peak covers the whole life of the process.
+
+    @return whether the peak was reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss() -> Optional[int]:
+    """
+    Read the peak resident memory of this process.
+
+    @return bytes, or None if the platform does not report it
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def profile_summary(output: DataFrame) -> DataFrame:
+    """
+    Aggregate the profiles of a batch.
+
+    @param output: estimate results with PROFILE_COLUMNS; per-patch rows of an image are counted once
+    @return pandas DF with the total and mean seconds of each stage and its share of the total; the number of images
+        and the largest peak_rss in bytes are kept in its attrs
+    """
+    images = output.drop_duplicates('filename')
+    times = images[[f'time_{stage}' for stage in STAGES]].rename(columns=lambda column: column[len('time_'):])
+    summary = DataFrame({'total_s': times.sum(), 'mean_s': times.mean()})
+    summary['share'] = summary['total_s'] / max(summary['total_s'].sum(), 1e-12)
+    summary.attrs['peak_rss'] = images['peak_rss'].max()
+    summary.attrs['images'] = len(images)
+    return summary
+
+
+def trace_line(filename: str, profile: dict) -> str:
+    """
+    Format the profile of an image as a JSON line.
+
+    @param filename: the image
+    @param profile: as filled in by timed
+    @return JSON object with the file name and the profile, newline-terminated
+    """
+    return json.dumps({'filename': filename, **profile}) + '\n'
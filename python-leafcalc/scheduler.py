@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Admit scans to the pool of workers under a memory budget.
+
+The number of workers alone does not bound memory: a 1200 dpi scan needs gigabytes for its grayscale, binary and label
+buffers, so many workers on a large machine can run it out of memory. The scheduler estimates the peak memory of each
+task from the image dimensions in its header, hands out the largest scans first to cut the tail of the batch, and only
+starts a task while the estimates of the running ones leave room for it.
+
+Boris Bongalov, Tim C.E Paine, Sabine Both
+"""
+
+import collections
+import queue
+import re
+from typing import Callable, Iterable, Iterator, Optional, Sequence, Tuple
+
+from .metadata import cached_header
+
+# bytes per pixel of the decoded (possibly reduced) scan held at the peak of a task
+_DECODE = 2  # grayscale scan plus the decoder's working buffers
+_BINARY = 1  # thresholded scan
+_LABELS = {'opencv': 4, 'skimage': 8}  # int32 / int64 label image
+_NUMBERED = 4  # label image renumbered for mask_format='labels' or morphology
+_MORPHOLOGY = 28  # coordinate and moment arrays of leaf pixels, assuming up to half of the scan is leaf, and holes
+
+_UNITS = {'': 1, 'k': 2 ** 10, 'm': 2 ** 20, 'g': 2 ** 30, 't': 2 ** 40}
+_END = object()  # end of the items of run_streamed
+
+
+def parse_size(value: str) -> int:
+    """
+    Read a memory size such as 512M or 16G.
+
+    @param value: a number of bytes, optionally followed by K, M, G or T (binary multiples)
+    @return the size in bytes
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*', value.lower())
+    if not match:
+        raise ValueError(f"{value} is not a memory size such as 512M or 16G.")
+    return int(float(match.group(1)) * _UNITS[match.group(2)])
+
+
+def task_memory(width: int, height: int, reduce: int = 1, strip_height: int = 0, engine: str = 'opencv',
+                numbered: bool = False, morphology: bool = False) -> int:
+    """
+    Estimate the peak memory of estimating the leaf area of one scan.
+
+    @param width: width of the scan in pixels, as stored in the file
+    @param height: height of the scan in pixels, as stored in the file
+    @param reduce: decoding reduction factor
+    @param strip_height: rows per strip in strip mode, 0 for whole scans
+    @param engine: connected-component engine
+    @param numbered: whether a renumbered label image is built, for mask_format='labels'
+    @param morphology: whether the morphology table is computed
+    @return estimated peak bytes
+    """
+    width, height = -(-width // reduce), -(-height // reduce)
+    pixels = width * height
+    if strip_height:
+        # the scan is thresholded in place and only one strip is labeled at a time
+        return pixels * _DECODE + width * min(strip_height, height) * (_LABELS['opencv'] + 2 * _BINARY)
+    per_pixel = _DECODE + _BINARY + _LABELS.get(engine, _LABELS['skimage'])
+    if numbered or morphology:
+        per_pixel += _NUMBERED
+    if morphology:
+        per_pixel += _MORPHOLOGY
+    return pixels * per_pixel
+
+
+def image_memory(path: str, **settings) -> Optional[int]:
+    """
+    Estimate the peak memory of a scan from the dimensions in its header.
+
+    @param path: path to the scan
+    @param settings: as for task_memory
+    @return estimated peak bytes, or None if the header does not give the dimensions
+    """
+    try:
+        header = cached_header(path)
+    except OSError:
+        return None
+    if not header.width or not header.height:
+        return None
+    return task_memory(header.width, header.height, **settings)
+
+
+def run_within_budget(pool, function: Callable, items: Sequence, costs: Sequence[int],
+                      budget: int) -> Iterator[Tuple[object, object, Optional[Exception]]]:
+    """
+    Run a function over items on a pool, keeping the summed costs of the running tasks within a budget.
+
+    Items are handed out largest first. While the largest waiting item does not fit next to the running ones, the
+    smallest waiting item is started if it fits. A task that exceeds the budget on its own runs alone.
+
+    @param pool: multiprocessing pool
+    @param function: picklable callable taking one item
+    @param items: what to process, e.g. paths to scans
+    @param costs: estimated peak memory of each item, in bytes
+    @param budget: bytes that running tasks may use together
+    @return iterator of (item, result, error) in order of completion; error is the exception raised, or None
+    """
+    if budget < 1:
+        raise ValueError("The memory budget must be positive.")
+    waiting = collections.deque(sorted(range(len(items)), key=lambda index: costs[index], reverse=True))
+    done = queue.Queue()
+    used = running = 0
+
+    def start(index: int):
+        pool.apply_async(function, (items[index],),
+                         callback=lambda result: done.put((index, result, None)),
+                         error_callback=lambda error: done.put((index, None, error)))
+
+    while waiting or running:
+        while waiting:
+            if not running or used + costs[waiting[0]] <= budget:
+                index = waiting.popleft()
+            elif used + costs[waiting[-1]] <= budget:
+                index = waiting.pop()
+            else:
+                break
+            used += costs[index]
+            running += 1
+            start(index)
+
+        index, result, error = done.get()
+        used -= costs[index]
+        running -= 1
+        yield items[index], result, error
+
+
+def run_streamed(pool, function: Callable, items: Iterable, window: int) -> Iterator[Tuple[object, object,
+                                                                                           Optional[Exception]]]:
+    """
+    Run a function over items on a pool as they are produced, with at most window tasks started at a time.
+
+    pool.imap takes items from the iterable as fast as it can, so it would hold, e.g., every image read from an archive
+    in memory at once; here only window items are held.
+
+    @param pool: multiprocessing pool
+    @param function: picklable callable taking one item
+    @param items: what to process, e.g. the (name, bytes) of the images of an archive
+    @param window: most tasks to have started and not yet yielded
+    @return iterator of (item, result, error) in order of completion; error is the exception raised, or None
+    """
+    if window < 1:
+        raise ValueError("The window must be positive.")
+    items = iter(items)
+    done = queue.Queue()
+    running = 0
+    more = True
+    while True:
+        while more and running < window:
+            item = next(items, _END)
+            if item is _END:
+                more = False
+                break
+            pool.apply_async(function, (item,),
+                             callback=lambda result, item=item: done.put((item, result, None)),
+                             error_callback=lambda error, item=item: done.put((item, None, error)))
+            running += 1
+        if not running:
+            return
+        item, result, error = done.get()
+        running -= 1
+        yield item, result, error
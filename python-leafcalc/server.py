@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Serve leaf area estimates over HTTP from an engine whose workers stay warm between requests.
+
+Calling LeafCalc.py once per image pays for the interpreter, the OpenCV and pandas imports and the start of a pool
+every time. The server pays for them once; each request only pays for its images. It listens on a local TCP port or a
+Unix socket:
+
+    GET  /health                 state of the server: workers, running and waiting requests
+    POST /estimate               estimate the scan or folder given as a JSON object {"path": ..., "settings": {...}}
+    GET  /estimate?path=...      the same, with the settings as further query parameters
+    POST /estimate_bytes?name=.. estimate the image file sent as the body; res and settings as query parameters
+    POST /preprocess             preprocess a scan or folder, from {"path": ..., "output_dir": ..., "settings": {...}}
+    GET  /preprocess?path=...    the same, with output_dir and the settings as query parameters
+    POST /shutdown               stop the server; so does SIGTERM
+
+Results are JSON ({"results": [one object per row], ...}), or CSV with format=csv or an Accept: text/csv header, which
+R reads with read.csv alone. Settings are the per-image arguments of EstimateLeafArea, e.g. threshold, cut_off,
+combine or res; each request gets its own copy of the engine, so requests with different settings can run at once.
+Up to concurrency requests run together on the shared pool, up to backlog more wait, and further requests are
+turned away with 503 until one finishes.
+
+Boris Bongalov, Tim C.E Paine, Sabine Both
+"""
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qsl, urlsplit
+
+from pandas.core.frame import DataFrame
+
+# through the package, which binds the name to the class rather than to the module of the same name
+from . import EstimateLeafArea
+from .archives import is_archive
+
+
+class Busy(Exception):
+    """Raised when all request slots are taken and the backlog is full."""
+
+
+class LeafAreaServer:
+    """Run requests on a shared, warm EstimateLeafArea engine, a bounded number at a time."""
+
+    def __init__(self, estimator: EstimateLeafArea, concurrency: int = 0, backlog: int = 64):
+        """
+        @param estimator: engine whose pool, cache and defaults the requests share
+        @param concurrency: requests processed at once; def: 0 (as many as estimator.workers)
+        @param backlog: requests that may wait for a slot before further ones are turned away
+        """
+        self.estimator = estimator
+        self.concurrency = concurrency or max(1, estimator.workers)
+        self.backlog = backlog
+        self._slots = threading.Semaphore(self.concurrency)
+        self._lock = threading.Lock()
+        self.running = 0
+        self.waiting = 0
+
+    def engine(self, settings: dict) -> EstimateLeafArea:
+        """
+        Copy the shared engine with the settings of a request.
+
+        @param settings: per-image arguments of EstimateLeafArea, as for EstimateLeafArea.with_settings
+        @return an estimator sharing the warm pool
+        """
+        return self.estimator.with_settings(**settings)
+
+    def run(self, function, *args):
+        """
+        Call a function once a request slot is free.
+
+        @param function: what to run, e.g. a method of an engine returned by engine()
+        @param args: its arguments
+        @return whatever the function returns
+        """
+        with self._lock:
+            if self.running >= self.concurrency and self.waiting >= self.backlog:
+                raise Busy("The server is busy. Try again later.")
+            self.waiting += 1
+        self._slots.acquire()
+        with self._lock:
+            self.waiting -= 1
+            self.running += 1
+        try:
+            return function(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+            self._slots.release()
+
+    def estimate(self, path: str, settings: dict) -> DataFrame:
+        """Estimate leaf area for a scan or folder on the server's filesystem, saving masks to any output_dir."""
+        estimator = self.engine(settings)
+        if estimator.output_dir:
+            estimator.output_dir = os.path.abspath(os.path.expanduser(estimator.output_dir))
+            # a zip archive to save into is created by the estimator
+            if not is_archive(estimator.output_dir):
+                os.makedirs(estimator.output_dir, exist_ok=True)
+        return self.run(estimator.estimate, os.path.expanduser(path))
+
+    def estimate_bytes(self, data: bytes, res: float, name: Optional[str], settings: dict) -> DataFrame:
+        """Estimate leaf area for an image file received in the request, on a warm worker."""
+        estimator = self.engine(settings)
+        pool = estimator._pool
+
+        def measure() -> DataFrame:
+            if pool is None:
+                return estimator.estimate_bytes(data, res, name)
+            return estimator._frame(name, pool.apply(estimator._task('_measure_data'), (data, res, name)))
+
+        return self.run(measure)
+
+    def preprocess(self, path: str, output_dir: str, settings: dict):
+        """Preprocess a scan or folder on the server's filesystem into output_dir."""
+        if not output_dir:
+            raise ValueError("Give the output_dir to save the preprocessed scans in.")
+        estimator = self.engine(settings)
+        estimator.output_dir = os.path.abspath(os.path.expanduser(output_dir))
+        os.makedirs(estimator.output_dir, exist_ok=True)
+        self.run(estimator.preprocess, os.path.expanduser(path))
+
+    def health(self) -> dict:
+        """State of the server, for clients to check that it is up."""
+        with self._lock:
+            return {'status': 'ok', 'workers': self.estimator.workers, 'concurrency': self.concurrency,
+                    'running': self.running, 'waiting': self.waiting, 'pid': os.getpid()}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'LeafCalc'
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # Unix sockets have no client address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status: int, payload: dict):
+        self._send(status, json.dumps(payload).encode(), 'application/json')
+
+    def _frame(self, output: DataFrame, output_format: str):
+        if output_format == 'csv' or 'text/csv' in self.headers.get('Accept', ''):
+            self._send(200, output.to_csv(index=False).encode(), 'text/csv')
+        else:
+            self._json(200, {'results': json.loads(output.to_json(orient='records')),
+                             'cache_hits': output.attrs.get('cache_hits', 0),
+                             'cache_misses': output.attrs.get('cache_misses', 0)})
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _handle(self, method: str):
+        url = urlsplit(self.path)
+        query = dict(parse_qsl(url.query))
+        output_format = query.pop('format', 'json')
+        # read the whole body first, so that the connection can be reused whatever the reply
+        body = self._body() if method == 'POST' else b''
+        service = self.server.service
+        try:
+            if method == 'GET' and url.path == '/health':
+                self._json(200, service.health())
+            elif url.path in ('/estimate', '/preprocess'):
+                # a JSON body, or query parameters for clients that can only GET, e.g. R's url()
+                if method == 'POST':
+                    request = json.loads(body or b'{}')
+                elif url.path == '/preprocess':
+                    request = {'path': query.pop('path', ''), 'output_dir': query.pop('output_dir', ''),
+                               'settings': query}
+                else:
+                    request = {'path': query.pop('path', ''), 'settings': query}
+                if url.path == '/estimate':
+                    self._frame(service.estimate(request.get('path', ''), request.get('settings', {})), output_format)
+                else:
+                    output_dir = request.get('output_dir', '')
+                    service.preprocess(request.get('path', ''), output_dir, request.get('settings', {}))
+                    self._json(200, {'output_dir': os.path.abspath(os.path.expanduser(output_dir))})
+            elif method == 'POST' and url.path == '/estimate_bytes':
+                name = query.pop('name', None)
+                res = float(query.pop('res', 0))
+                self._frame(service.estimate_bytes(body, res, name, query), output_format)
+            elif method == 'POST' and url.path == '/shutdown':
+                self._json(200, {'status': 'stopping'})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            else:
+                self._json(404, {'error': f'No {method} {url.path}.'})
+        except Busy as error:
+            self._json(503, {'error': str(error)})
+        except (ValueError, OSError) as error:
+            # bad paths, settings and images are the client's to fix
+            self._json(400, {'error': f'{type(error).__name__}: {error}'})
+        except Exception as error:
+            self._json(500, {'error': f'{type(error).__name__}: {error}'})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(estimator: EstimateLeafArea, host: str = '127.0.0.1', port: int = 8765, unix_socket: str = '',
+          concurrency: int = 0, backlog: int = 64, verbose: bool = False, ready=None):
+    """
+    Serve requests until a client posts to /shutdown or the process is interrupted.
+
+    The estimator's pool is started here and kept warm for all requests.
+
+    @param estimator: engine whose pool, cache and defaults the requests share
+    @param host: address to listen on; keep the default so that only this machine can connect
+    @param port: TCP port; 0 picks a free one
+    @param unix_socket: path of a Unix socket to listen on instead of a TCP port; def: '' (TCP)
+    @param concurrency: requests processed at once; def: 0 (as many as estimator.workers)
+    @param backlog: requests that may wait for a slot before further ones are turned away
+    @param verbose: log each request to stderr
+    @param ready: called with the address once the server listens, e.g. to print it
+    """
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            # a socket left behind by a server that did not stop cleanly
+            probe = socket.socket(socket.AF_UNIX)
+            try:
+                probe.connect(unix_socket)
+                raise ValueError(f"A server is already listening on {unix_socket}.")
+            except ConnectionRefusedError:
+                os.unlink(unix_socket)
+            finally:
+                probe.close()
+        server = _UnixHTTPServer(unix_socket, _Handler)
+        address = unix_socket
+    else:
+        server = ThreadingHTTPServer((host, port), _Handler)
+        server.daemon_threads = True
+        address = f'http://{host}:{server.server_address[1]}'
+
+    server.verbose = verbose
+    server.service = LeafAreaServer(estimator, concurrency=concurrency, backlog=backlog)
+    if threading.current_thread() is threading.main_thread():
+        # stop cleanly when killed, e.g. by tools::pskill from R
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+    try:
+        with estimator:
+            if ready is not None:
+                ready(address)
+            server.serve_forever()
+    finally:
+        server.server_close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.unlink(unix_socket)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Watch a folder that scanners save into, and estimate each scan within seconds of it landing.
+
+New files are reported by inotify on Linux. Elsewhere, with recursive, or with poll (e.g. on a network share, where
+inotify does not see files written by other machines), the folder is listed every interval instead. A file is taken
+once its size and modification time have not changed for settle seconds, so that scans still being written are not
+read half-way.
+
+Results are appended to a CSV or JSON-lines file, which is also the record of what has been done: on start, the files
+already listed in it are skipped, so a restarted watch never processes a scan twice. Scans that failed are tried again
+on restart; delete the rows of any other scan to have it processed again.
+
+Boris Bongalov, Tim C.E Paine, Sabine Both
+"""
+
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Optional, Set
+
+from pandas.core.frame import DataFrame
+
+from .discovery import IMAGE_EXTENSIONS, find_images
+from .writers import ResultWriter, processed_files
+
+# inotify event flags, from <sys/inotify.h>
+_IN_CLOSE_WRITE, _IN_MOVED_TO, _IN_CREATE, _IN_Q_OVERFLOW = 0x8, 0x80, 0x100, 0x4000
+_IN_EVENT = struct.Struct('iIII')  # watch descriptor, mask, cookie, length of the name that follows
+
+
+class _Inotify:
+    """Names of the files created in, written to or moved into a folder, as reported by the Linux kernel."""
+
+    def __init__(self, folder: str):
+        """
+        @param folder: folder to watch, not its subfolders
+        @raise OSError: if inotify is not available, e.g. not on Linux or out of watches
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not available on this system.")
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify could not be started.")
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify could not watch {folder}.")
+
+    def read(self, timeout: float) -> Optional[Set[str]]:
+        """
+        Wait for events.
+
+        @param timeout: seconds to wait for the first event
+        @return names of the files with events, or None if events were lost and the folder has to be listed again
+        """
+        names = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return names
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _IN_EVENT.unpack_from(data, offset)
+                offset += _IN_EVENT.size
+                if mask & _IN_Q_OVERFLOW:
+                    return None
+                names.add(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+                offset += length
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _settled(pending: dict, settle: float, now: float) -> list:
+    """
+    Find the pending files whose size and modification time have not changed for settle seconds.
+
+    @param pending: path -> ((size, mtime), time first seen with them), or None for a file not looked at yet; updated
+        in place, and the settled files and the ones that have gone are removed
+    @param settle: seconds a file must stay unchanged
+    @param now: the time, from time.monotonic
+    @return paths of the settled files, in sorted order
+    """
+    ready = []
+    for path, seen in list(pending.items()):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            del pending[path]
+            continue
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if seen is None or seen[0] != signature:
+            pending[path] = (signature, now)
+        elif stat.st_size and now - seen[1] >= settle:
+            ready.append(path)
+            del pending[path]
+    return sorted(ready)
+
+
+def watch(estimator, folder: str, output: str, settle: float = 2.0, interval: float = 1.0, poll: bool = False,
+          stop: Optional[threading.Event] = None, on_results: Optional[Callable[[DataFrame], None]] = None) -> int:
+    """
+    Estimate leaf area for the scans saved into a folder, as they arrive, until stopped.
+
+    The scans already in the folder that have no results yet are processed first. The estimator's pool of workers is
+    kept warm throughout, and its recursive, pattern and follow_symlinks settings select the files to watch.
+
+    @param estimator: EstimateLeafArea with the settings to use
+    @param folder: folder to watch. respects tilde expansion
+    @param output: CSV or JSON-lines (.jsonl) file to append the results to. respects tilde expansion
+    @param settle: seconds that a file must stay unchanged before it is read; def: 2
+    @param interval: seconds between checks of the files waiting to settle, and between listings of the folder when
+        polling; def: 1
+    @param poll: list the folder every interval rather than use inotify
+    @param stop: event that ends the watch when set; def: None (run until interrupted)
+    @param on_results: called with the results of each scan after they are written, e.g. to report progress
+    @return how many scans were processed
+    """
+    folder = os.path.abspath(os.path.expanduser(folder))
+    if not os.path.isdir(folder):
+        raise ValueError(f"{folder} is not a folder to watch.")
+    stop = stop or threading.Event()
+    # masks of scans in subfolders keep their subfolder
+    estimator.input_root = folder
+    search = dict(recursive=estimator.recursive, pattern=estimator.pattern, follow_symlinks=estimator.follow_symlinks)
+    done = processed_files(output)
+
+    events = None
+    if not poll and not estimator.recursive and sys.platform.startswith('linux'):
+        try:
+            events = _Inotify(folder)
+        except OSError as error:
+            sys.stderr.write(f"{error} Listing the folder every {interval} s instead.\n")
+
+    def wanted(name: str) -> bool:
+        # the rules of find_images, for the names reported by inotify
+        return (not name.startswith('.') and name.lower().endswith(IMAGE_EXTENSIONS) and
+                (not estimator.pattern or fnmatch.fnmatch(name, estimator.pattern)))
+
+    pending = {}
+    processed = 0
+    listed = False
+    kind = 'jsonl' if output.lower().endswith('.jsonl') else 'csv'
+    with ResultWriter(estimator.columns(), append=True, **{kind: output}) as writer:
+        estimator.open()
+        try:
+            while not stop.is_set():
+                if events is None or not listed:
+                    paths = find_images(folder, **search)
+                    listed = True
+                else:
+                    names = events.read(interval)
+                    if names is None:
+                        # the kernel dropped events; see what arrived
+                        paths = find_images(folder, **search)
+                    else:
+                        paths = [os.path.join(folder, name) for name in names if wanted(name)]
+                for path in paths:
+                    if path not in done and path not in pending:
+                        pending[path] = None
+
+                # with inotify, waiting for events paces the checks; files that stop changing raise no event
+                ready = _settled(pending, settle, time.monotonic())
+                if ready:
+                    for frame in estimator.iter_estimate(ready):
+                        writer.write(frame)
+                        processed += 1
+                        if on_results is not None:
+                            on_results(frame)
+                    done.update(ready)
+                elif events is None:
+                    stop.wait(interval)
+        finally:
+            estimator.close()
+            if events is not None:
+                events.close()
+    return processed
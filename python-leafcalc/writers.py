@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Write result frames to disk as they arrive, so long runs can be followed and survive a crash.
+
+Besides CSV and Parquet files, results can be streamed as JSON lines or as an Arrow IPC stream, to a file or to
+standard output, so that other programs (e.g. the R package) read typed results instead of parsing a printed table.
+
+CSV and JSON-lines files can be appended to, and then double as the record of the scans that are done: an interrupted
+run, a shard of a cluster job or a watched folder picks up where it stopped. merge_results combines such files.
+
+Boris Bongalov, Tim C.E Paine, Sabine Both
+"""
+
+import json
+import os
+import sys
+from typing import Iterable, Optional, Set
+
+import pandas as pd
+from pandas.core.frame import DataFrame
+
+TEXT_COLUMNS = ('filename', 'error')
+INTEGER_COLUMNS = ('request',)
+
+
+def _open_text(path: str, append: bool = False):
+    """Open a text output, '-' being standard output."""
+    if path == '-':
+        return sys.stdout
+    return open(os.path.expanduser(path), 'a' if append else 'w', newline='')
+
+
+def _drop_torn_row(path: str):
+    """Cut a row that a crash left unfinished off the end of a text file, so that appending starts a new row."""
+    with open(path, 'rb+') as stream:
+        position = stream.seek(0, os.SEEK_END)
+        stream.seek(position - 1)
+        if stream.read(1) == b'\n':
+            return
+        while position > 0:
+            start = max(0, position - 65536)
+            stream.seek(start)
+            newline = stream.read(position - start).rfind(b'\n')
+            if newline >= 0:
+                stream.truncate(start + newline + 1)
+                return
+            position = start
+        stream.truncate(0)
+
+
+def _has_content(path: str) -> bool:
+    """Whether a file exists and is not empty; standard output never has content to keep."""
+    return path != '-' and os.path.exists(os.path.expanduser(path)) and os.path.getsize(os.path.expanduser(path)) > 0
+
+
+class ResultWriter:
+    """Append result frames to CSV, Parquet, JSON-lines and/or Arrow IPC outputs with a fixed column layout."""
+
+    row_group = 1000
+
+    def __init__(self, columns: list, csv: Optional[str] = None, parquet: Optional[str] = None,
+                 jsonl: Optional[str] = None, arrow: Optional[str] = None, append: bool = False):
+        """
+        Open the output files.
+        @param columns: column layout of every frame; missing columns are left empty
+        @param csv: path of the CSV file to write, '-' for standard output, or None. respects tilde expansion
+        @param parquet: path of the Parquet file to write, or None; requires pyarrow. respects tilde expansion
+        @param jsonl: path of the JSON-lines file to write (one object per row, empty values as null), '-' for
+            standard output, or None. respects tilde expansion
+        @param arrow: path of the Arrow IPC stream to write, '-' for standard output, or None; requires pyarrow.
+            respects tilde expansion
+        @param append: add to the CSV and JSON-lines files if they exist, rather than replacing them; an existing CSV
+            file must have the same columns. Parquet and Arrow files cannot be appended to
+        """
+        if append and (parquet or arrow):
+            raise ValueError("Parquet and Arrow files cannot be appended to. Use CSV or JSON lines.")
+        if append:
+            for path in (csv, jsonl):
+                if path and _has_content(path):
+                    _drop_torn_row(os.path.expanduser(path))
+        self.columns = columns
+        self.csv = None
+        self.parquet = None
+        self.jsonl = None
+        self.arrow = None
+        self._arrow_file = None
+        self._buffer = []  # frames waiting to become a Parquet row group
+        self._buffered = 0
+        if csv:
+            if append and _has_content(csv):
+                header = pd.read_csv(os.path.expanduser(csv), nrows=0).columns.tolist()
+                if header != list(columns):
+                    raise ValueError(f"{csv} has other columns than the results. Write them to another file.")
+                self.csv = _open_text(csv, append)
+            else:
+                self.csv = _open_text(csv, append)
+                DataFrame(columns=columns).to_csv(self.csv, index=False)
+        if jsonl:
+            self.jsonl = _open_text(jsonl, append)
+        if parquet or arrow:
+            try:
+                import pyarrow
+                import pyarrow.ipc
+                import pyarrow.parquet
+            except ImportError:
+                raise ImportError("Parquet and Arrow output require pyarrow. Install it with: pip3 install pyarrow")
+            self._pyarrow = pyarrow
+        if parquet:
+            self.parquet = pyarrow.parquet.ParquetWriter(os.path.expanduser(parquet), self._schema(pyarrow))
+        if arrow:
+            self._arrow_file = sys.stdout.buffer if arrow == '-' else open(os.path.expanduser(arrow), 'wb')
+            self.arrow = pyarrow.ipc.new_stream(self._arrow_file, self._schema(pyarrow))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _schema(self, pyarrow):
+        """Text for file names and errors, integers for request numbers, floats elsewhere so values may be empty."""
+        return pyarrow.schema([(column, pyarrow.string() if column in TEXT_COLUMNS else
+                                pyarrow.int64() if column in INTEGER_COLUMNS else pyarrow.float64())
+                               for column in self.columns])
+
+    def _table(self, frame: DataFrame):
+        """Convert a frame to an Arrow table with the schema of the outputs."""
+        types = {column: 'string' if column in TEXT_COLUMNS else 'int64' if column in INTEGER_COLUMNS else 'float64'
+                 for column in self.columns}
+        return self._pyarrow.Table.from_pandas(frame.astype(types), schema=self._schema(self._pyarrow),
+                                               preserve_index=False)
+
+    def write(self, frame: DataFrame):
+        """
+        Append a frame. CSV, JSON-lines and Arrow rows are flushed at once, Parquet rows in row groups of about
+        row_group rows.
+
+        @param frame: results of one or more images
+        """
+        frame = frame.reindex(columns=self.columns)
+        if self.csv:
+            frame.to_csv(self.csv, header=False, index=False)
+            self.csv.flush()
+        if self.jsonl:
+            # through pandas for null empty values and plain numbers
+            for record in json.loads(frame.to_json(orient='records')):
+                self.jsonl.write(json.dumps(record) + '\n')
+            self.jsonl.flush()
+        if self.arrow:
+            self.arrow.write_table(self._table(frame))
+            self._arrow_file.flush()
+        if self.parquet:
+            self._buffer.append(frame)
+            self._buffered += len(frame)
+            if self._buffered >= self.row_group:
+                self._write_row_group()
+
+    def _write_row_group(self):
+        """Write the buffered frames to the Parquet file."""
+        if not self._buffer:
+            return
+        self.parquet.write_table(self._table(pd.concat(self._buffer)))
+        self._buffer = []
+        self._buffered = 0
+
+    def close(self):
+        """Write what is left and close the output files."""
+        for stream in (self.csv, self.jsonl):
+            if stream is not None and stream is not sys.stdout:
+                stream.close()
+        if self.parquet:
+            self._write_row_group()
+            self.parquet.close()
+        if self.arrow:
+            self.arrow.close()
+            if self._arrow_file is not sys.stdout.buffer:
+                self._arrow_file.close()
+
+
+def processed_files(path: str, errors: bool = False) -> Set[str]:
+    """
+    List the scans that have results in an output file.
+
+    @param path: CSV or JSON-lines (.jsonl) file of results, as written by ResultWriter. respects tilde expansion
+    @param errors: also list the scans whose rows record an error; def: False, so that they are tried again, e.g. after
+        a file server was briefly unreachable
+    @return file names in its filename column; empty if the file does not exist yet
+    """
+    path = os.path.expanduser(path)
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return set()
+    if path.lower().endswith('.jsonl'):
+        names = set()
+        with open(path) as stream:
+            for line in stream:
+                try:
+                    record = json.loads(line)
+                    if errors or record.get('error') is None:
+                        names.add(record['filename'])
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    # e.g. a line cut short by a crash
+                    continue
+        return names
+    header = pd.read_csv(path, nrows=0).columns
+    columns = ['filename', 'error'] if 'error' in header and not errors else ['filename']
+    rows = pd.read_csv(path, usecols=columns, dtype=str, on_bad_lines='skip')
+    if 'error' in rows:
+        rows = rows[rows['error'].isna()]
+    return set(rows['filename'].dropna())
+
+
+def read_results(path: str) -> DataFrame:
+    """
+    Load a results file written by ResultWriter.
+
+    @param path: CSV, JSON-lines (.jsonl), Parquet (.parquet) or Arrow IPC (.arrow) file. respects tilde expansion
+    @return pandas DF of the results
+    """
+    path = os.path.expanduser(path)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.jsonl':
+        with open(path) as stream:
+            records = []
+            for line in stream:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return DataFrame(records)
+    if extension == '.parquet':
+        return pd.read_parquet(path)
+    if extension == '.arrow':
+        try:
+            import pyarrow.ipc
+        except ImportError:
+            raise ImportError("Arrow input requires pyarrow. Install it with: pip3 install pyarrow")
+        with pyarrow.ipc.open_stream(path) as reader:
+            return reader.read_pandas()
+    return pd.read_csv(path, dtype={'filename': str, 'error': str}, on_bad_lines='skip')
+
+
+def merge_results(paths: Iterable[str]) -> DataFrame:
+    """
+    Combine the results of several runs, e.g. the shards of a cluster job, into one table.
+
+    Each image keeps the rows of the first file that has results for it, so images found in several files, e.g. after
+    the shards were changed between attempts, are not counted twice. The error rows of an image are only kept if no
+    file has results for it, so a failure that a resumed run retried successfully is dropped.
+
+    @param paths: results files, as for read_results
+    @return pandas DF with the columns of all the files, sorted by file name
+    """
+    frames = []
+    for path in paths:
+        frame = read_results(path)
+        if 'filename' not in frame:
+            raise ValueError(f"{path} has no filename column. It is not a results file.")
+        frames.append(frame)
+    if not frames:
+        raise ValueError("There are no results files to merge.")
+
+    # results first, then the errors of the images that have none
+    selected = []
+    seen = set()
+    for failures in (False, True):
+        for frame in frames:
+            failed = frame['error'].notna() if 'error' in frame else pd.Series(False, index=frame.index)
+            rows = frame[(failed == failures) & ~frame['filename'].isin(seen)]
+            seen.update(rows['filename'])
+            selected.append(rows)
+    output = pd.concat(selected, ignore_index=True)
+    # errors last, as written
+    columns = [column for column in output.columns if column != 'error'] + (['error'] if 'error' in output else [])
+    return output[columns].sort_values('filename', kind='stable', ignore_index=True)
@@ -26,6 +26,5 @@ setup(
         "numpy",
         "pandas",
         "opencv-python",
-        "exif",
         "scikit-image"]
     )
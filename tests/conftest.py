@@ -0,0 +1,14 @@
+"""
+Make the package importable as leafcalc from the source tree, where it lives in python-leafcalc.
+"""
+
+import importlib.util
+import os
+import sys
+
+source = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'python-leafcalc')
+spec = importlib.util.spec_from_file_location('leafcalc', os.path.join(source, '__init__.py'),
+                                              submodule_search_locations=[source])
+leafcalc = importlib.util.module_from_spec(spec)
+sys.modules['leafcalc'] = leafcalc
+spec.loader.exec_module(leafcalc)
@@ -0,0 +1,36 @@
+"""
+Archives are measured without extracting them, and their masks are saved under the name of each archive.
+"""
+
+import os
+import tarfile
+import zipfile
+
+import cv2
+import numpy as np
+
+from leafcalc import EstimateLeafArea, static
+
+
+def test_blank_member(tmp_path):
+    archive = str(tmp_path / 'blank.zip')
+    with zipfile.ZipFile(archive, 'w') as stream:
+        stream.writestr('blank.jpg', cv2.imencode('.jpg', np.full((200, 200), 255, dtype=np.uint8))[1].tobytes())
+    output = EstimateLeafArea(res=300, combine=False, workers=1).estimate(archive)
+    assert list(output['filename']) == [os.path.join(archive, 'blank.jpg')]
+    assert list(output['Area']) == [0]
+
+
+def test_masks_of_two_archives(tmp_path):
+    scan = os.path.join(static, 'img1.jpg')
+    with zipfile.ZipFile(str(tmp_path / 'site.zip'), 'w') as stream:
+        stream.write(scan, 'img1.jpg')
+    with tarfile.open(str(tmp_path / 'site.tgz'), 'w:gz') as stream:
+        stream.add(scan, 'img1.jpg')
+
+    output_dir = str(tmp_path / 'masks.zip')
+    estimator = EstimateLeafArea(res=400, combine=True, workers=1, output_dir=output_dir)
+    for name in ('site.zip', 'site.tgz'):
+        estimator.estimate(str(tmp_path / name))
+    with zipfile.ZipFile(output_dir) as stream:
+        assert sorted(stream.namelist()) == ['site.tgz/img1.jpg', 'site.zip/img1.jpg']
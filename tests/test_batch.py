@@ -0,0 +1,28 @@
+"""
+A batch in shared memory is measured by forked workers without the resource tracker reporting a leak at shutdown.
+"""
+
+import os
+import subprocess
+import sys
+
+SCRIPT = """
+import runpy, sys
+runpy.run_path(sys.argv[1])
+import cv2
+import numpy as np
+from leafcalc import EstimateLeafArea
+
+scan = np.full((200, 200, 3), 255, dtype=np.uint8)
+cv2.rectangle(scan, (50, 50), (150, 150), (0, 128, 0), -1)
+with EstimateLeafArea(res=300, workers=2, start_method='fork') as estimator:
+    for _ in range(2):
+        assert len(estimator.estimate_batch([scan, scan, scan])) == 3
+"""
+
+
+def test_no_leaked_shared_memory():
+    conftest = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'conftest.py')
+    run = subprocess.run([sys.executable, '-c', SCRIPT, conftest], capture_output=True, text=True, timeout=300)
+    assert run.returncode == 0, run.stderr
+    assert 'resource_tracker' not in run.stderr
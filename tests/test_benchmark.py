@@ -0,0 +1,29 @@
+"""
+The benchmark recovers the known leaf area of its synthetic scans.
+"""
+
+from leafcalc import EstimateLeafArea, regressions, run_benchmark, write_scans
+
+SCAN = dict(size=(3, 3), leaves=2, specks=5)
+
+
+def test_recovers_true_area(tmp_path):
+    truth = write_scans(str(tmp_path), images=1, dpi=150, **SCAN)
+    cut_off = int(0.5 * (150 / 2.54) ** 2)
+    output = EstimateLeafArea(cut_off=cut_off, combine=True, workers=1).estimate(truth['filename'][0])
+    assert abs(output['Area'][0] - truth['true_area'][0]) / truth['true_area'][0] < 0.01
+
+
+def test_run_benchmark():
+    results = run_benchmark(dpis=[150], workers=[1], images=1, repeats=1, **SCAN)
+    assert list(results['mode']) == ['single', 'directory']
+    assert (results['images'] == 1).all()
+    assert (results['max_error'] < 0.01).all()
+    assert regressions(results, results).empty
+
+
+def test_accuracy_regression():
+    baseline = run_benchmark(dpis=[150], workers=[1], images=1, repeats=1, **SCAN)
+    results = baseline.assign(mean_error=baseline['mean_error'] + 0.01)
+    assert len(regressions(results, baseline)) == len(results)
+    assert regressions(results, baseline, accuracy_tolerance=0.02).empty
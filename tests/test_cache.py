@@ -0,0 +1,37 @@
+"""
+Runs that share a result cache do not lock each other out.
+"""
+
+import sqlite3
+
+import numpy as np
+
+from leafcalc import ResultCache
+
+
+def test_concurrent_runs(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    with ResultCache(path) as first, ResultCache(path) as second:
+        first.put('a', {'Area': np.array([1.5])})
+        # the first run keeps its file open, as for the whole of a batch
+        second.put('b', {'Area': np.array([2.5])})
+        assert list(first.get('b')['Area']) == [2.5]
+        assert list(second.get('a')['Area']) == [1.5]
+
+
+def test_locked_cache(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    with ResultCache(path) as cache:
+        cache.put('a', {'Area': np.array([1.5])})
+    other = sqlite3.connect(path)
+    other.execute('BEGIN EXCLUSIVE')
+    try:
+        with ResultCache(path, timeout=0.1) as cache:
+            assert cache.get('a') is None
+            cache.put('b', {'Area': np.array([2.5])})
+    finally:
+        other.rollback()
+        other.close()
+    with ResultCache(path) as cache:
+        assert list(cache.get('a')['Area']) == [1.5]
+        assert cache.get('b') is None
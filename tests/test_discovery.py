@@ -0,0 +1,27 @@
+"""
+A manifest lists the images of the folder and search it is used with, not those of the folder it was built for.
+"""
+
+import os
+
+import pytest
+
+from leafcalc.discovery import list_images
+
+
+def test_manifest_selection(tmp_path):
+    for name in ('a/scan1.jpg', 'a/sub/scan2.jpg', 'a/sub/other.jpg', 'b/scan3.jpg'):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'')
+    a, b, manifest = str(tmp_path / 'a'), str(tmp_path / 'b'), str(tmp_path / 'manifest.csv')
+
+    everything = list_images(a, manifest, recursive=True)
+    assert [os.path.relpath(path, a) for path in everything] == [
+        'scan1.jpg', os.path.join('sub', 'other.jpg'), os.path.join('sub', 'scan2.jpg')]
+    assert list_images(a, manifest) == [os.path.join(a, 'scan1.jpg')]
+    assert list_images(a, manifest, recursive=True, pattern='sub/scan*') == [os.path.join(a, 'sub', 'scan2.jpg')]
+    assert list_images(os.path.join(a, 'sub'), manifest) == [os.path.join(a, 'sub', 'other.jpg'),
+                                                             os.path.join(a, 'sub', 'scan2.jpg')]
+    with pytest.raises(ValueError):
+        list_images(b, manifest)
@@ -0,0 +1,56 @@
+"""
+The area engines give the same patches, in the same order, as the original skimage.measure.label + np.unique path.
+"""
+
+import os
+
+import cv2
+import numpy as np
+import pandas as pd
+import pytest
+from skimage import measure
+
+from leafcalc import EstimateLeafArea, static
+from leafcalc.engines import opencv_areas, skimage_areas, strip_areas
+
+SCANS = sorted(os.path.join(static, name) for name in os.listdir(static) if name.endswith('.jpg'))
+CUT_OFFS = [1, 10000]
+STRIP_HEIGHTS = [13, 256, 100000]  # many boundaries, a few, and the whole scan in one strip
+
+
+def baseline_areas(binary: np.ndarray, cut_off: int) -> np.ndarray:
+    """Pixel counts of the patches as the package computed them before the engines were added."""
+    labels, counts = np.unique(measure.label(binary, background=0), return_counts=True)
+    return counts[(counts >= cut_off) & (labels != 0)]
+
+
+@pytest.fixture(scope='module', params=SCANS, ids=os.path.basename)
+def binary(request) -> np.ndarray:
+    gray = cv2.imread(request.param, cv2.IMREAD_GRAYSCALE)
+    return cv2.threshold(gray, 120, 255, cv2.THRESH_BINARY_INV)[1]
+
+
+@pytest.mark.parametrize('cut_off', CUT_OFFS)
+def test_opencv_areas(binary, cut_off):
+    np.testing.assert_array_equal(opencv_areas(binary, cut_off), baseline_areas(binary, cut_off))
+
+
+@pytest.mark.parametrize('cut_off', CUT_OFFS)
+def test_skimage_areas(binary, cut_off):
+    np.testing.assert_array_equal(skimage_areas(binary, cut_off), baseline_areas(binary, cut_off))
+
+
+@pytest.mark.parametrize('cut_off', CUT_OFFS)
+@pytest.mark.parametrize('strip_height', STRIP_HEIGHTS)
+def test_strip_areas(binary, cut_off, strip_height):
+    strips = (binary[row:row + strip_height] for row in range(0, binary.shape[0], strip_height))
+    np.testing.assert_array_equal(strip_areas(strips, cut_off), baseline_areas(binary, cut_off))
+
+
+@pytest.mark.parametrize('settings', [dict(engine='opencv'), dict(strip_height=64), dict(strip_height=500)],
+                         ids=['opencv', 'strips64', 'strips500'])
+def test_estimate_rows(settings):
+    expected = EstimateLeafArea(engine='skimage', res=400, combine=False, workers=1)
+    estimator = EstimateLeafArea(res=400, combine=False, workers=1, **settings)
+    for scan in SCANS:
+        pd.testing.assert_frame_equal(estimator.estimate(scan), expected.estimate(scan))
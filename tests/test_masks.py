@@ -0,0 +1,35 @@
+"""
+Masks and preprocessed copies of a folder searched recursively keep their subfolders.
+"""
+
+import os
+import shutil
+
+from leafcalc import EstimateLeafArea, static
+
+
+def scans(tmp_path) -> str:
+    folder = tmp_path / 'scans'
+    for subfolder, name in (('a', 'img1.jpg'), ('b', 'img2.jpg')):
+        (folder / subfolder).mkdir(parents=True)
+        shutil.copy(os.path.join(static, name), str(folder / subfolder / 'scan.jpg'))
+    return str(folder)
+
+
+def files(folder) -> list:
+    return sorted(os.path.relpath(os.path.join(path, name), str(folder))
+                  for path, _, names in os.walk(str(folder)) for name in names)
+
+
+def test_masks(tmp_path):
+    output_dir = tmp_path / 'masks'
+    EstimateLeafArea(res=400, recursive=True, output_dir=str(output_dir), mask_format='png',
+                     workers=1).estimate(scans(tmp_path))
+    assert files(output_dir) == [os.path.join('a', 'scan.png'), os.path.join('b', 'scan.png')]
+
+
+def test_preprocess(tmp_path):
+    output_dir = tmp_path / 'preprocessed'
+    output_dir.mkdir()
+    EstimateLeafArea(recursive=True, output_dir=str(output_dir), crop=10, workers=1).preprocess(scans(tmp_path))
+    assert files(output_dir) == [os.path.join('a', 'scan.jpg'), os.path.join('b', 'scan.jpg')]
@@ -0,0 +1,41 @@
+"""
+A sweep over a folder records the images that cannot be read rather than failing as a whole.
+"""
+
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from leafcalc import EstimateLeafArea, static
+
+THRESHOLDS = [100, 150]
+
+
+@pytest.fixture
+def folder(tmp_path):
+    for name in ('img1.jpg', 'img2.jpg'):
+        shutil.copy(os.path.join(static, name), tmp_path / name)
+    (tmp_path / 'broken.jpg').write_bytes(b'not a jpeg')
+    return tmp_path
+
+
+def test_sweep_records_errors(folder):
+    estimator = EstimateLeafArea(res=300, workers=2, combine=False)
+    output = estimator.sweep(str(folder), THRESHOLDS)
+    broken = output[output['filename'].str.endswith('broken.jpg')]
+    assert len(broken) == 1
+    assert pd.isna(broken['Area'].iloc[0])
+    assert isinstance(broken['error'].iloc[0], str)
+    assert set(output.dropna(subset=['threshold'])['threshold']) == set(THRESHOLDS)
+
+
+def test_combined_sweep_records_errors(folder):
+    estimator = EstimateLeafArea(res=300, workers=2, combine=True)
+    output = estimator.sweep(str(folder), THRESHOLDS)
+    assert len(output) == 3
+    broken = output.loc[str(folder / 'broken.jpg')]
+    assert pd.isna(broken[THRESHOLDS]).all()
+    assert isinstance(broken['error'], str)
+    assert (output.drop(index=str(folder / 'broken.jpg'))[THRESHOLDS] > 0).all().all()
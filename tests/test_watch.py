@@ -0,0 +1,30 @@
+"""
+A watch records every scan that lands in the folder, including scans without leaves.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from leafcalc import EstimateLeafArea, processed_files, watch
+
+
+def test_blank_scan(tmp_path):
+    folder = tmp_path / 'scans'
+    folder.mkdir()
+    scan = str(folder / 'blank.jpg')
+    cv2.imwrite(scan, np.full((200, 200), 255, dtype=np.uint8))
+    output = str(tmp_path / 'results.csv')
+
+    stop = threading.Event()
+    estimator = EstimateLeafArea(res=300, combine=False, workers=1)
+    processed = watch(estimator, str(folder), output, settle=0, interval=0.05, poll=True, stop=stop,
+                      on_results=lambda frame: stop.set())
+
+    assert processed == 1
+    results = pd.read_csv(output)
+    assert list(results['filename']) == [scan]
+    assert list(results['Area']) == [0]
+    assert processed_files(output) == {scan}
@@ -0,0 +1,31 @@
+"""
+A results file is the checkpoint of a resumed run: images with results are done, images with errors are not.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from leafcalc import ResultWriter, merge_results, processed_files
+
+ROWS = pd.DataFrame({'filename': ['a.jpg', 'a.jpg', 'blank.jpg', 'b.jpg'], 'Area': [1.5, 2.5, 0, np.nan],
+                     'error': [None, None, None, 'OSError: unreachable']})
+
+
+@pytest.mark.parametrize('kind', ['csv', 'jsonl'])
+def test_processed_files(tmp_path, kind):
+    path = str(tmp_path / f'results.{kind}')
+    with ResultWriter(['filename', 'Area', 'error'], **{kind: path}) as writer:
+        writer.write(ROWS)
+    assert processed_files(path) == {'a.jpg', 'blank.jpg'}
+    assert processed_files(path, errors=True) == {'a.jpg', 'blank.jpg', 'b.jpg'}
+
+
+def test_merge_retried(tmp_path):
+    first, second = str(tmp_path / 'first.csv'), str(tmp_path / 'second.csv')
+    ROWS.to_csv(first, index=False)
+    pd.DataFrame({'filename': ['b.jpg', 'a.jpg'], 'Area': [3.5, 9.9], 'error': [None, None]}).to_csv(second, index=False)
+    merged = merge_results([first, second])
+    assert list(merged['filename']) == ['a.jpg', 'a.jpg', 'b.jpg', 'blank.jpg']
+    assert list(merged['Area']) == [1.5, 2.5, 3.5, 0]
+    assert merged['error'].isna().all()